@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+A hand-written RFC 5322 address checker that gives the same verdicts as
+validation.regex, in time linear in the length of the input.
+
+The regex is used with re.search, so it doesn't check that the whole
+string is an address, only that one appears somewhere in it: an '@' with a
+local part ending right before it, and a domain starting right after it.
+Backtracking makes that quadratic or worse on some inputs (long runs of
+'a.a.a.' or of '"aaa', for instance), which is enough to hang the GUI.
+check_address() finds the same thing with one pass over the string, and
+says why an address was rejected.
+
+The grammar, as the regex has it (lowercase only, no flags):
+
+    local   = atext+ ('.' atext+)*  |  '"' (qtext | '\\' quoted-pair)* '"'
+    domain  = (label '.')+ label  |  '[' (octet '.'){3} octet ']'
+            | '[' (octet '.'){3} tag ':' (dtext | '\\' quoted-pair)+ ']'
+    label   = [a-z0-9] ([a-z0-9-]* [a-z0-9])?
+    tag     = [a-z0-9-]* [a-z0-9]
+
+Run this file to check it against the regex and time both:
+
+    python addrparse.py [longest input]
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import collections
+import random
+import sys
+import time
+
+Verdict = collections.namedtuple('Verdict', ['valid', 'reason'])
+
+_LOWER_DIGITS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+
+def _chars(*ranges):
+    """Build a frozenset of characters from (first, last) code ranges."""
+    return frozenset(chr(c) for first, last in ranges
+                     for c in range(first, last + 1))
+
+
+ATEXT = frozenset(_LOWER_DIGITS + "!#$%&'*+/=?^_`{|}~-")
+QTEXT = _chars((0x01, 0x08), (0x0b, 0x0c), (0x0e, 0x1f), (0x21, 0x21),
+               (0x23, 0x5b), (0x5d, 0x7f))
+QUOTED_PAIR = _chars((0x01, 0x09), (0x0b, 0x0c), (0x0e, 0x7f))
+DTEXT = _chars((0x01, 0x08), (0x0b, 0x0c), (0x0e, 0x1f), (0x21, 0x7f))
+LET_DIG = frozenset(_LOWER_DIGITS)
+LDH = frozenset(_LOWER_DIGITS + '-')
+DIGITS = frozenset('0123456789')
+
+
+def _octet_ok(digits):
+    """Whether a run of digits is a decimal octet as the regex has it:
+    0-255, no leading zeros."""
+    if not 0 < len(digits) <= 3 or (len(digits) > 1 and digits[0] == '0'):
+        return False
+    return int(digits) <= 255
+
+
+class _Literal(object):
+    """Checks domain literals.  The general form's contents may run on
+    over later '@'s, so what's needed to check them is worked out once per
+    address, in one backward pass, and shared between all the '@'s."""
+
+    def __init__(self, address):
+        self.address = address
+        self._next_close = None
+        self._next_bad = None
+
+    def _prepare(self):
+        """For every position, find the next ']' and the next character
+        that can't be in a literal's contents."""
+        address = self.address
+        n = len(address)
+        next_close = [n] * (n + 1)
+        next_bad = [n] * (n + 1)
+        for i in range(n - 1, -1, -1):
+            char = address[i]
+            next_close[i] = i if char == ']' else next_close[i + 1]
+            # space and tab are only allowed escaped with a backslash, which
+            # can always be taken as the escape since it's dtext itself
+            ok = char in DTEXT or (char in QUOTED_PAIR and i > 0 and
+                                   address[i - 1] == '\\')
+            next_bad[i] = next_bad[i + 1] if ok else i
+        self._next_close, self._next_bad = next_close, next_bad
+
+    def contents_ok(self, start):
+        """Whether the contents starting at start run on to a ']'."""
+        address = self.address
+        if start >= len(address) or address[start] not in DTEXT:
+            return False
+        if self._next_close is None:
+            self._prepare()
+        return self._next_close[start + 1] < self._next_bad[start + 1]
+
+    def check(self, start):
+        """Check for a literal whose '[' is at start.  Returns the reason
+        it's no good, or None if it's fine."""
+        address = self.address
+        n = len(address)
+        pos = start + 1
+        for _ in range(3):
+            end = pos
+            while end < n and end - pos < 4 and address[end] in DIGITS:
+                end += 1
+            if end >= n or address[end] != '.' or \
+                    not _octet_ok(address[pos:end]):
+                return "the domain literal must start with an IPv4 address"
+            pos = end + 1
+
+        end = pos
+        while end < n and end - pos < 4 and address[end] in DIGITS:
+            end += 1
+        if end < n and address[end] == ']' and _octet_ok(address[pos:end]):
+            return None
+
+        # not a fourth octet, so it has to be a tag, ':' and contents
+        end = pos
+        while end < n and address[end] in LDH:
+            end += 1
+        if end == pos or end >= n or address[end] != ':':
+            return "the domain literal isn't an IPv4 address or tag:value"
+        if address[end - 1] not in LET_DIG:
+            return "the domain literal's tag can't end with '-'"
+        if not self.contents_ok(end + 1):
+            return "the domain literal isn't closed with ']'"
+        return None
+
+
+def _check_domain(address, start, literal):
+    """Check for a domain starting at start.  Returns the reason it's no
+    good, or None if it's fine."""
+    n = len(address)
+    if start >= n:
+        return "there's nothing after the '@'"
+    first = address[start]
+    if first == '[':
+        return literal.check(start)
+    if first not in LET_DIG:
+        return "the domain must start with a lowercase letter, digit or " \
+            "'[', not {!r}".format(first)
+
+    # (label '.')+ label matches as soon as the first label is followed by
+    # a '.' and the start of another label
+    end = start
+    while end < n and address[end] in LDH:
+        end += 1
+    if end >= n or address[end] != '.':
+        return "the domain needs at least one '.'"
+    if address[end - 1] not in LET_DIG:
+        return "a domain label can't end with '-'"
+    if end + 1 >= n:
+        return "the domain can't end with '.'"
+    if address[end + 1] not in LET_DIG:
+        return "a domain label must start with a lowercase letter or " \
+            "digit, not {!r}".format(address[end + 1])
+    return None
+
+
+def _check_at(address, pos, local_ok, literal):
+    """Check the '@' at pos, given whether a local part ends right before
+    it.  Returns the reason it's no good, or None if it's fine."""
+    if pos == 0:
+        return "there's nothing before the '@'"
+    if local_ok:
+        return _check_domain(address, pos + 1, literal)
+    previous = address[pos - 1]
+    if previous == '"':
+        return "the quoted local part isn't a valid quoted string"
+    return "the local part must end with a lowercase letter, digit, one " \
+        "of !#$%&'*+/=?^_`{{|}}~- or a closing quote, not {!r}".format(
+            previous)
+
+
+def check_address(address):
+    """
+    Check an address the way validation.regex does.  Returns a Verdict of
+    (valid, reason), the reason being None for valid addresses, and
+    otherwise describing what's wrong around the first '@'.
+    """
+    literal = _Literal(address)
+    first_reason = None
+
+    if '"' not in address:
+        # no quoted strings to track, so only the '@'s need looking at
+        pos = address.find('@')
+        while pos != -1:
+            reason = _check_at(address, pos, address[pos - 1] in ATEXT
+                               if pos else False, literal)
+            if reason is None:
+                return Verdict(True, None)
+            first_reason = first_reason or reason
+            pos = address.find('@', pos + 1)
+        return Verdict(False, first_reason or "there's no '@'")
+
+    # quoted strings are tracked as they go past: in_quote if some '"' so
+    # far could still be the start of one, escaped if that one has just
+    # had a backslash.  closed is whether one ended on the last character.
+    in_quote = escaped = closed = False
+    previous = ''
+
+    for pos, char in enumerate(address):
+        if char == '@':
+            reason = _check_at(address, pos, previous in ATEXT or closed,
+                               literal)
+            if reason is None:
+                return Verdict(True, None)
+            first_reason = first_reason or reason
+
+        closed = in_quote and char == '"'
+        in_quote, escaped = ((in_quote and char in QTEXT) or
+                             (escaped and char in QUOTED_PAIR) or
+                             char == '"'), in_quote and char == '\\'
+        previous = char
+
+    return Verdict(False, first_reason or "there's no '@'")
+
+
+# %% conformance corpus and benchmark
+
+# addresses the parser and the regex must agree on.  the fuzzer below
+# makes up plenty more.
+CORPUS = [
+    'user@example.com', 'first.last@sub.example.co.uk', 'a@b.c',
+    "o'reilly+tag@example.org", '!#$%&\'*+/=?^_`{|}~-@example.com',
+    '"quoted"@example.com', '"with \\" escape"@example.com',
+    '"spaces are fine"@example.com', '"unterminated@example.com',
+    'user@[192.168.0.1]', 'user@[255.255.255.255]', 'user@[256.1.1.1]',
+    'user@[01.2.3.4]', 'user@[1.2.3]', 'user@[1.2.3.4', 'user@[1.2.3.v6:abc]',
+    'user@[1.2.3.v6-:abc]', 'user@[1.2.3.x:\\ y]', 'user@[1.2.3.x: y]',
+    'User@Example.com', 'user@Example.com', 'USER@example.com',
+    'user@localhost', 'user@-example.com', 'user@example-.com',
+    'user@example.', 'user@.example.com', 'user@exa_mple.com',
+    'user.@example.com', '.user@example.com', 'us..er@example.com',
+    'user', '@example.com', 'user@', '', '@', 'a@@b.c', 'user@@example.com',
+    'Name <user@example.com>', 'junk user@example.com junk',
+    'no at sign here', 'two@at@example.com', 'user@exam ple.com',
+    'us er@example.com', 'user@1.2', 'user@a.-b', 'user@a.b-',
+    '"a"b"@example.com', '"\\\t"@example.com', 'user@[1.2.3.4]x',
+    'a.' * 50 + '@example.com', '"' + 'a' * 100, 'a@' + 'a-' * 100,
+]
+
+# strings made mostly of the characters the grammar cares about, for the
+# fuzzer
+_FUZZ_CHARS = 'aZ0.-@"\\[]: \t:1259x_'
+
+
+def _regex():
+    """The compiled validation.regex."""
+    from prereqs import validation_regex
+    return validation_regex()
+
+
+def conformance(n_random=20000, seed=0):
+    """Check the parser against the regex on the corpus and on n_random
+    random strings.  Returns the list of strings they disagree on."""
+    regex = _regex()
+    rand = random.Random(seed)
+    cases = list(CORPUS)
+    for _ in range(n_random):
+        cases.append(''.join(rand.choice(_FUZZ_CHARS)
+                             for _ in range(rand.randint(0, 14))))
+    return [case for case in cases
+            if check_address(case).valid != bool(regex.search(case))]
+
+
+# inputs that make the regex backtrack, as functions of a length
+PATHOLOGICAL = [
+    ("runs of atoms", lambda n: 'a.' * (n // 2)),
+    ("atoms before '@'", lambda n: 'a.' * (n // 2) + '@'),
+    ("open quote", lambda n: '"' + 'a' * n),
+    ("hyphenated domain", lambda n: 'a@' + 'a-' * (n // 2)),
+    ("open domain literal", lambda n: 'a@[1.2.3.x:' + 'a' * n),
+]
+
+
+def benchmark(longest=8000):
+    """Time the parser and the regex on the pathological inputs at
+    doubling lengths, and print the results.  The parser's time should
+    double with the length; the regex's grows much faster."""
+    regex = _regex()
+    print("{:22} {:>7} {:>12} {:>12}".format("input", "length", "parser ms",
+                                             "regex ms"))
+    for name, make in PATHOLOGICAL:
+        n = 1000
+        while n <= longest:
+            text = make(n)
+            began = time.perf_counter()
+            check_address(text)
+            parser_ms = (time.perf_counter() - began) * 1000
+            began = time.perf_counter()
+            regex.search(text)
+            regex_ms = (time.perf_counter() - began) * 1000
+            print("{:22} {:>7} {:>12.2f} {:>12.2f}".format(
+                name, len(text), parser_ms, regex_ms))
+            n *= 2
+
+
+if __name__ == '__main__':
+    MISMATCHES = conformance()
+    if MISMATCHES:
+        print("parser and regex disagree on:")
+        for case in MISMATCHES[:20]:
+            print("   ", repr(case), check_address(case))
+        sys.exit(1)
+    print("parser agrees with the regex on {} corpus strings and 20000 "
+          "random ones".format(len(CORPUS)))
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 8000)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Validates whole recipient lists against the RFC 5322 grammar, for lists far
+too big to check one address at a time in the Verify window.
+
+The list is streamed (blank lines and lines starting with '#' are skipped,
+as for recipient files) and de-duplicated case-insensitively as it's read;
+the unique addresses are checked in parallel by a pool of processes (or,
+for lists that fit in one chunk, in this process, which is quicker than
+starting the pool).  Three
+files are written: the valid addresses, the invalid ones (each followed by
+a tab and the reason it was rejected), and the duplicates, each in the
+order they appeared in the list.
+
+    python bulkvalidate.py mailboxes.txt [-o PREFIX] [-j PROCESSES]
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import argparse
+import collections
+import itertools
+import multiprocessing
+import sys
+import time
+
+from addrparse import check_address
+
+# addresses sent to a worker process at a time.  big enough that the
+# pickling overhead doesn't matter, small enough to keep every core busy
+CHUNK_SIZE = 5000
+
+
+def _check_chunk(chunk):
+    """Check a list of addresses, usually in a worker process.  Returns a
+    list of the reason each was rejected, or None for the valid ones."""
+    return [check_address(address).reason for address in chunk]
+
+
+def _unique_chunks(filename, duplicates, counts):
+    """Stream the list, writing duplicates out as they're found, and yield
+    chunks of first occurrences."""
+    seen = set()
+    chunk = []
+    with open(filename, 'r') as listfile:
+        for line in listfile:
+            address = line.strip()
+            if not address or address.startswith('#'):
+                continue
+            counts['read'] += 1
+            key = address.lower()
+            if key in seen:
+                counts['duplicate'] += 1
+                duplicates.write(address + '\n')
+                continue
+            seen.add(key)
+            chunk.append(address)
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+def _write_verdicts(chunk, reasons, valid, invalid, counts):
+    """Write a chunk's addresses out, given the reason each was rejected
+    (None for the valid ones)."""
+    n_valid = 0
+    for address, reason in zip(chunk, reasons):
+        if reason is None:
+            valid.write(address + '\n')
+            n_valid += 1
+        else:
+            invalid.write(address + '\t' + reason + '\n')
+    counts['valid'] += n_valid
+    counts['invalid'] += len(chunk) - n_valid
+
+
+def validate_list(filename, prefix=None, processes=None):
+    """
+    Validate every address in a list file.
+
+    :filename: str.  The list, one address per line.
+    :prefix: str.  Output files are prefix + '.valid', '.invalid' and
+             '.duplicates'.  Defaults to the list's filename.
+    :processes: int.  Worker processes to use; defaults to one per core.
+                1 checks everything in this process, as do lists that fit
+                in one chunk.
+
+    Returns a dictionary of counts: read, valid, invalid and duplicate.
+    """
+    prefix = prefix or filename
+    counts = {'read': 0, 'valid': 0, 'invalid': 0, 'duplicate': 0}
+
+    with open(prefix + '.valid', 'w') as valid, \
+            open(prefix + '.invalid', 'w') as invalid, \
+            open(prefix + '.duplicates', 'w') as duplicates:
+        chunks = _unique_chunks(filename, duplicates, counts)
+
+        # only a full chunk can have more after it
+        first = next(chunks, [])
+        if len(first) < CHUNK_SIZE or processes == 1:
+            for chunk in itertools.chain([first], chunks):
+                _write_verdicts(chunk, _check_chunk(chunk), valid, invalid,
+                                counts)
+            return counts
+        chunks = itertools.chain([first], chunks)
+
+        pool = multiprocessing.Pool(processes)
+        # chunks in flight, oldest first.  bounded, so the list is never
+        # read much further ahead than the workers have got to
+        window = (processes or multiprocessing.cpu_count()) * 4
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                pending.append((chunk, pool.apply_async(_check_chunk,
+                                                        (chunk,))))
+                if len(pending) >= window:
+                    chunk, result = pending.popleft()
+                    _write_verdicts(chunk, result.get(), valid, invalid,
+                                    counts)
+            while pending:
+                chunk, result = pending.popleft()
+                _write_verdicts(chunk, result.get(), valid, invalid, counts)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    return counts
+
+
+def main(argv=None):
+    """Validate a list from the command line and print the counts."""
+    parser = argparse.ArgumentParser(description="Check a list of "
+                                     "addresses against RFC 5322.")
+    parser.add_argument('list', help="file with one address per line")
+    parser.add_argument('-o', '--output', metavar='PREFIX',
+                        help="output filename prefix (default: the list's)")
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help="worker processes (default: one per core)")
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    counts = validate_list(args.list, args.output, args.processes)
+    took = time.time() - start
+
+    print("read {read}, valid {valid}, invalid {invalid}, "
+          "duplicates {duplicate}".format(**counts))
+    print("{:.1f} sec, {:.0f} addresses/min".format(
+        took, counts['read'] / took * 60 if took else 0))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
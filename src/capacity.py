@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+Finds the most load a server can take before it stops meeting its SLOs.
+
+The offered load (mails/sec, through a load profile) is raised one step
+at a time, each step a headless run of its own, until a step breaks an
+SLO: p99 latency too high, too many transactions refused with a 4xx
+(temporary failure) code, too many connection errors, or the server not
+keeping up with the offered rate.  The sustainable rate is then narrowed
+down between the last good step and the first bad one, and confirmed by
+running it again, backing off further if the confirmation fails.
+
+A search is described by a JSON file:
+
+    {
+        "settings": {"server": "mail.test:25", "use_auth": false},
+        "concurrency": 32,
+        "step_duration": 20,
+        "warmup": 5,
+        "mode": "step",
+        "start_rate": 50,
+        "step": 50,
+        "max_rate": 5000,
+        "precision": 0.05,
+        "confirm": 1,
+        "backoff": 0.1,
+        "slo": {"p99": 0.5, "tempfail_rate": 0.01, "conn_errors": 0,
+                "min_rate_ratio": 0.95}
+    }
+
+In "step" mode the rate goes up by `step` each time; in "search" mode it
+doubles.  Either way, the gap between the last good and first bad rates
+is then halved until it's within `precision` of the good one.  "settings"
+and "contents" are as for sweep.py.
+
+    python capacity.py capacity.json -o steps
+
+prints every step and the result, and writes the steps to steps.csv.
+Exits with status 1 if not even start_rate could be sustained.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import argparse
+import csv
+import json
+import sys
+
+from sweep import HeadlessCoordinator, base_config
+import logger
+
+LOG = logger.get_logger('capacity')
+
+DEFAULTS = {
+    'concurrency': 32,
+    'step_duration': 20,
+    'warmup': 5,
+    'mode': 'step',
+    'start_rate': 50,
+    'step': 50,
+    'max_rate': 5000,
+    'precision': 0.05,
+    'confirm': 1,
+    'backoff': 0.1,
+}
+
+DEFAULT_SLO = {
+    # seconds
+    'p99': 0.5,
+    # fraction of transactions refused with a 4xx code
+    'tempfail_rate': 0.01,
+    # failed connection attempts and dropped connections per step
+    'conn_errors': 0,
+    # least fraction of the offered rate that has to get sent
+    'min_rate_ratio': 0.95,
+}
+
+# what each step's evidence holds, in table order
+STEP_FIELDS = ('phase', 'offered', 'achieved', 'concurrency', 'p99',
+               'tempfail_rate', 'conn_errors', 'sent', 'ok', 'broken')
+
+
+def check_slo(slo, offered, results, tempfail_rate):
+    """Return the list of SLOs a step's results break; empty if none."""
+    broken = []
+    if results['p99'] is not None and results['p99'] > slo['p99']:
+        broken.append("p99 {:.4g} > {:.4g} sec".format(results['p99'],
+                                                       slo['p99']))
+    if tempfail_rate > slo['tempfail_rate']:
+        broken.append("4xx {:.2%} > {:.2%}".format(tempfail_rate,
+                                                   slo['tempfail_rate']))
+    if results['conn_errors'] > slo['conn_errors']:
+        broken.append("{} connection errors > {}".format(
+            results['conn_errors'], slo['conn_errors']))
+    if results['rate'] < offered * slo['min_rate_ratio']:
+        broken.append("sent {:.1f} of {:.1f} mails/sec".format(
+            results['rate'], offered))
+    if results['error']:
+        broken.append(results['error'])
+    return broken
+
+
+class CapacitySearch(object):
+    """
+    Runs the steps of a capacity search on a HeadlessCoordinator, keeping
+    the evidence from each.
+    """
+
+    def __init__(self, spec, report=print):
+        """
+        Instantiate the CapacitySearch.
+
+        :spec: dict.  The search, as described at the top of this file.
+        :report: callable given a line of progress after each step.
+        """
+        self.spec = dict(DEFAULTS, **spec)
+        self.slo = dict(DEFAULT_SLO, **spec.get('slo', {}))
+        if self.spec['mode'] not in ('step', 'search'):
+            raise ValueError("Unknown mode {!r}".format(self.spec['mode']))
+        self.report = report
+        self.steps = []
+        settings, contents = base_config(spec)
+        self.coordinator = HeadlessCoordinator(settings, contents)
+
+    def trial(self, rate, phase):
+        """Offer rate mails/sec for one step.  Returns whether it met the
+        SLOs."""
+        spec = self.spec
+        workers = spec['concurrency']
+        results = self.coordinator.run({
+            'mt_mode': 'limited',
+            'mt_num': workers,
+            'run_duration': spec['step_duration'],
+            'warmup_exclude': spec['warmup'],
+            'profile': [{'duration': spec['step_duration'], 'rate': rate,
+                         'concurrency': workers}],
+            'metrics': True,
+            'run_label': "capacity {}: {:.1f} mails/sec".format(phase, rate),
+        })
+
+        tempfailed = 0
+        metrics = self.coordinator.sender.metrics
+        if metrics is not None:
+            for worker in metrics.workers:
+                tempfailed += sum(count for code, count
+                                  in worker.failed.copy().items()
+                                  if 400 <= code < 500)
+        transactions = results['sent'] + results['failed']
+        tempfail_rate = tempfailed / transactions if transactions else 0.0
+        broken = check_slo(self.slo, rate, results, tempfail_rate)
+
+        step = {
+            'phase': phase,
+            'offered': rate,
+            'achieved': results['rate'],
+            # Little's law: how many sends were in flight on average
+            'concurrency': results['rate'] * (results['mean_latency'] or 0),
+            'p99': results['p99'],
+            'tempfail_rate': tempfail_rate,
+            'conn_errors': results['conn_errors'],
+            'sent': results['sent'],
+            'ok': not broken,
+            'broken': '; '.join(broken),
+        }
+        self.steps.append(step)
+        self.report(format_step(step))
+        return step['ok']
+
+    def run(self):
+        """
+        Find the sustainable rate.  Returns a dict of 'rate' (None if even
+        start_rate wasn't), the 'concurrency' seen at it, and 'workers'.
+        """
+        spec = self.spec
+        good = bad = None
+
+        # find a rate that breaks an SLO
+        rate = float(spec['start_rate'])
+        while rate <= spec['max_rate']:
+            if not self.trial(rate, 'ramp'):
+                bad = rate
+                break
+            good = rate
+            rate = rate + spec['step'] if spec['mode'] == 'step' \
+                else rate * 2
+        if good is None:
+            return self._result(None)
+        if bad is None:
+            LOG.info("max_rate reached without breaking an SLO",
+                     rate=good)
+
+        # narrow it down
+        while bad is not None and (bad - good) / good > spec['precision']:
+            rate = (good + bad) / 2
+            if self.trial(rate, 'narrow'):
+                good = rate
+            else:
+                bad = rate
+
+        # make sure it holds, backing off if it doesn't
+        while good >= spec['start_rate'] * (1 - spec['backoff']):
+            if all(self.trial(good, 'confirm')
+                   for _ in range(spec['confirm'])):
+                return self._result(good)
+            good *= 1 - spec['backoff']
+        return self._result(None)
+
+    def _result(self, rate):
+        """The search's outcome, for a sustainable rate or None."""
+        confirmed = [step for step in self.steps
+                     if step['ok'] and step['offered'] == rate]
+        last = confirmed[-1] if confirmed else {'achieved': 0,
+                                                'concurrency': 0}
+        return {'rate': rate,
+                'achieved': last['achieved'],
+                'concurrency': last['concurrency'],
+                'workers': self.spec['concurrency']}
+
+
+def format_step(step):
+    """One line of evidence for a step."""
+    fields = dict(step, verdict='ok' if step['ok'] else
+                  'BROKEN: ' + step['broken'])
+    fields['p99'] = '-' if step['p99'] is None else \
+        '{:.4g}'.format(step['p99'])
+    return ("{phase:>7}  offered {offered:8.1f}  sent {achieved:8.1f} "
+            "mails/sec  in flight {concurrency:5.1f}  p99 {p99:>7} sec  "
+            "4xx {tempfail_rate:6.2%}  conn errors {conn_errors}  {verdict}"
+            .format(**fields))
+
+
+def write_steps(filename, steps):
+    """Write the evidence from every step as CSV."""
+    with open(filename, 'w') as out:
+        writer = csv.writer(out)
+        writer.writerow(STEP_FIELDS)
+        for step in steps:
+            writer.writerow([step[field] for field in STEP_FIELDS])
+
+
+def main(argv=None):
+    """Run a capacity search from the command line.  Returns the exit
+    status."""
+    parser = argparse.ArgumentParser(description="Find the most load a "
+                                     "server can sustain within its SLOs.")
+    parser.add_argument('spec', help="search description (JSON)")
+    parser.add_argument('-o', '--output', metavar='PREFIX',
+                        help="also write the steps to PREFIX.csv")
+    args = parser.parse_args(argv)
+
+    with open(args.spec, 'r') as spec_file:
+        search = CapacitySearch(json.load(spec_file))
+    result = search.run()
+    if args.output:
+        write_steps(args.output + '.csv', search.steps)
+
+    if result['rate'] is None:
+        print("couldn't sustain even {} mails/sec".format(
+            search.spec['start_rate']))
+        return 1
+    print("sustainable: {rate:.1f} mails/sec offered ({achieved:.1f} sent), "
+          "{concurrency:.1f} sends in flight on {workers} workers".format(
+              **result))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,6 +4,7 @@ Contains the Coordinator class that is responsible for communications between
 all different modules of the program.
 """
 
+import argparse
 import copy
 import sys
 import os
@@ -11,10 +12,11 @@ import os
 from emailbuilder import Email
 from headers import Headers
 from sender import EmailSendHandler
-from gui import EmailGUI
 
-from prereqs import CONFIG, FakeSTDOUT, CATCH_EXC
-from gui_callbacks import CALLBACKS, handle_error
+from prereqs import FakeSTDOUT, load_config, catch_exc
+import logger
+
+LOG = logger.get_logger('coordinator')
 
 
 class Coordinator(object):
@@ -27,23 +29,20 @@ class Coordinator(object):
         """Instantiate the Coordinator object.  Automatically creates & links
         the required modules."""
 
-        if CONFIG['settings']['debug']:
-            print("coordinator.__init__: starting instantiation")
+        config = load_config()
+        logger.configure(config['settings'])
+        LOG.debug("starting instantiation")
 
-        self.overall_config = CONFIG
-        self.settings = copy.deepcopy(CONFIG['settings'])
-        self.contents = copy.deepcopy(CONFIG['contents'])
+        self.overall_config = config
+        self.settings = copy.deepcopy(config['settings'])
+        self.contents = copy.deepcopy(config['contents'])
         self.callbacks = {}
         self.register_callbacks()
         self.active_guis = {}
-        self.metrics = {'sending-rate': None,
-                        'sending-time': None,
-                        'remaining': None,
-                        'sent': None,
-                        'etc': None,
-                        'etr': None,
-                        'no-active-connections': None,
-                        }
+
+        # tkinter and the GUI modules are only imported once there's a GUI
+        # to show, so the command line doesn't pay for them
+        from gui import EmailGUI
 
         self.email = Email(self, None)
         self.sender = EmailSendHandler(self)
@@ -51,15 +50,18 @@ class Coordinator(object):
         self.headers = Headers(self, self.email)
         self.email.headers = self.headers
 
+        self.exporter = None
+
         self.last_exc = None
         self.ready_to_send = True
 
-        if self.settings['debug']:
-            print("coordinator.__init__: instantiation complete")
+        LOG.debug("instantiation complete")
 
     def register_callbacks(self):
         """Given a name and a function, register the callback function."""
         # we have to convert the callback to take this as an argument...
+        from gui_callbacks import CALLBACKS, handle_error
+        catch = catch_exc()
 
         for cb in CALLBACKS:
             cbname = cb.__name__.split('_')[1]
@@ -68,13 +70,13 @@ class Coordinator(object):
                 def wrapped():
                     try:
                         return cbfunc(self)
-                    except CATCH_EXC as exc:
+                    except catch as exc:
                         self.last_exc = exc
+                        logger.dump_ring()
                         handle_error(self)
                 return wrapped
 
-            if self.settings['debug']:
-                print("coordinator.register_callbacks: registering " + cbname)
+            LOG.debug("registering callback", name=cbname)
 
             self.callbacks.update({cbname: wrapit(cb)})
 
@@ -99,10 +101,11 @@ class Coordinator(object):
     def retrieve_data_from_uis(self):
         """Get all the data from various UI elements."""
 
-        if self.settings['debug']:
-            print("coordinator.retrieve_data_from_uis: pulling data")
+        LOG.debug("pulling data from uis")
 
         self.gui.dump_values_to_coordinator()
+        # the debug checkbox may have changed
+        logger.configure(self.settings)
 
     def prepare_to_send(self):
         """Take all the necessary actions to prepare for sending."""
@@ -114,26 +117,41 @@ class Coordinator(object):
 
     def send(self):
         """Send emails as configured."""
+        self.start_exporter()
         self.sender.start()
+        self.gui.start_metrics_polling()
 
         self.ready_to_send = False
 
-    def callback_sent(self):
-        """Action to take when an email has been sent."""
-        if self.settings['debug']:
-            print("coordinator received notification of email sent")
-        self.gui.callback_sent()
-        if self.settings['debug']:
-            print("coordinator notification actions completed")
+    def start_exporter(self):
+        """Start the metrics exporter if a port is configured, or move it
+        if the port has changed.  It keeps running between sends so the
+        scrape target doesn't come and go."""
+        port = self.settings['metrics_port']
+        if self.exporter is not None and self.exporter.port != port:
+            self.exporter.stop()
+            self.exporter = None
+        if port and self.exporter is None:
+            from exporter import MetricsExporter
+            self.exporter = MetricsExporter(self, port)
+            self.exporter.start()
+
+    def metrics_snapshot(self):
+        """Return a snapshot of the current run's metrics, or None if the
+        run hasn't got going yet."""
+        metrics = self.sender.metrics
+        if metrics is None or metrics.profile.start_time is None:
+            return None
+        return metrics.snapshot()
 
     def reset(self):
         """Discard old data and get ready for another send."""
         self.sender.pre_delete_actions()
         self.sender = EmailSendHandler(self)
-        self.email = Email(self, self.headers)
+        # the Email is kept, and only re-renders whatever parts changed
+        # when prepare_to_send pulls the new data in
         self.retrieve_data_from_uis()
-        self.sender.init_metrics()
-        self.gui.pull_metrics_from_coordinator()
+        self.gui.clear_metrics()
 
     def main(self):
         """Do stuff!"""
@@ -142,22 +160,53 @@ class Coordinator(object):
             if os.path.exists(log):
                 os.remove(log)
 
+        rotation = {'max_bytes': self.settings['log_max_bytes'],
+                    'rotate_interval': self.settings['log_rotate_interval'],
+                    'backups': self.settings['log_backups']}
         sys.stdout = FakeSTDOUT(sys.stdout, self.settings['log_stdout'],
-                                realtime=self.settings['realtime'])
+                                realtime=self.settings['realtime'],
+                                **rotation)
         sys.stderr = FakeSTDOUT(sys.stderr, self.settings['log_stderr'],
-                                realtime=self.settings['realtime'])
+                                realtime=self.settings['realtime'],
+                                **rotation)
 
         try:
             self.gui.spawn_gui()
             self.gui.run()
-        except CATCH_EXC as exc:
+        except catch_exc() as exc:
+            from gui_callbacks import handle_error
             self.last_exc = exc
+            logger.dump_ring()
             handle_error(self)
 
+        if self.exporter is not None:
+            self.exporter.stop()
+
         sys.stdout = sys.stdout.FSO_close()
         sys.stderr = sys.stderr.FSO_close()
 
 
+def parse_args(argv=None):
+    """Read the command line.  Anything given there overrides
+    settings.json for this session."""
+    parser = argparse.ArgumentParser(description="Email server load "
+                                                 "generator.")
+    parser.add_argument('--profile', action='store_true',
+                        help="profile every run; see profiler_* in "
+                             "settings.json")
+    parser.add_argument('--profile-output', metavar='FILE',
+                        help="base filename for the profile output")
+    args = parser.parse_args(argv)
+
+    settings = load_config()['settings']
+    if args.profile:
+        settings['profiler'] = True
+    if args.profile_output:
+        settings['profiler_output'] = args.profile_output
+    return args
+
+
 if __name__ == '__main__':
+    parse_args()
     C = Coordinator()
     C.main()
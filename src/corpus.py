@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the Corpus and CorpusSource classes, which replay real messages
+(a directory of .eml files, or an mbox file) instead of sending the same
+built message every time.
+
+An mbox is indexed once: the offset of every message is found with one
+pass over a memory map of the file, and saved next to it as <mbox>.idx so
+later runs don't have to scan it again.  Messages are then sliced straight
+out of the memory map, so the corpus is never read into memory as a
+whole, and the operating system's page cache does the rest.
+
+Index file layout:
+    header:  MAGIC, then INDEX_HEADER (mbox size, mbox mtime in ns,
+             number of messages).
+    body:    one unsigned 64-bit start offset per message, then the mbox
+             size, so message i is [offset i, offset i + 1).
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import array
+import mmap
+import os
+import random
+import struct
+import sys
+
+import logger
+
+LOG = logger.get_logger('corpus')
+
+MAGIC = b'EMIDX\x00\x01\x00'
+INDEX_HEADER = struct.Struct('<QQQ')
+
+
+def _offsets_array(values=()):
+    """An array of unsigned 64-bit offsets."""
+    return array.array('Q', values)
+
+
+class Corpus(object):
+    """
+    A set of messages to replay, from an mbox file or a directory of .eml
+    files.  Messages are numbered from 0, and fetched with message(i).
+
+    One Corpus is shared by all the workers in a run; it's safe to read
+    from any number of threads.
+    """
+
+    def __init__(self, path):
+        """
+        Open a corpus, indexing it if need be.
+
+        :path: str.  An mbox file, or a directory searched (recursively)
+               for .eml files.
+        """
+        self.path = path
+        self._map = None
+        self._file = None
+        self.offsets = None
+        self.files = None
+
+        if os.path.isdir(path):
+            self.files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names if name.lower().endswith('.eml'))
+        else:
+            self._open_mbox()
+
+        if not len(self):
+            raise ValueError("Corpus {} contains no messages".format(path))
+        LOG.info("corpus opened", path=path, messages=len(self))
+
+    def __len__(self):
+        if self.files is not None:
+            return len(self.files)
+        return len(self.offsets) - 1
+
+    def _open_mbox(self):
+        """Memory-map the mbox, and load or build its index."""
+        self._file = open(self.path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        if not stat.st_size:
+            self.offsets = _offsets_array([0])
+            return
+        self._map = mmap.mmap(self._file.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        self.offsets = self._load_index(stamp)
+        if self.offsets is None:
+            self.offsets = self._build_index()
+            self._save_index(stamp)
+
+    @property
+    def index_path(self):
+        """Where the mbox's index is kept."""
+        return self.path + '.idx'
+
+    def _load_index(self, stamp):
+        """Return the saved offsets, or None if there's no index or it's
+        out of date."""
+        try:
+            with open(self.index_path, 'rb') as index:
+                if index.read(len(MAGIC)) != MAGIC:
+                    return None
+                size, mtime, count = INDEX_HEADER.unpack(
+                    index.read(INDEX_HEADER.size))
+                if (size, mtime) != stamp:
+                    return None
+                offsets = _offsets_array()
+                offsets.frombytes(index.read())
+        except (IOError, OSError, struct.error):
+            return None
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+        if len(offsets) != count + 1:
+            return None
+        return offsets
+
+    def _build_index(self):
+        """Find where every message in the mbox starts, in one pass."""
+        LOG.info("indexing mbox", path=self.path, bytes=len(self._map))
+        data = self._map
+        offsets = _offsets_array()
+        if data[:5] == b'From ':
+            offsets.append(0)
+        pos = data.find(b'\nFrom ')
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = data.find(b'\nFrom ', pos + 1)
+        offsets.append(len(data))
+        return offsets
+
+    def _save_index(self, stamp):
+        """Save the index next to the mbox.  Not being able to is only
+        worth a warning; it's built again next time."""
+        offsets = self.offsets
+        if sys.byteorder != 'little':
+            offsets = _offsets_array(offsets)
+            offsets.byteswap()
+        try:
+            with open(self.index_path, 'wb') as index:
+                index.write(MAGIC)
+                index.write(INDEX_HEADER.pack(stamp[0], stamp[1],
+                                              len(self.offsets) - 1))
+                index.write(offsets.tobytes())
+        except (IOError, OSError) as exc:
+            LOG.warning("couldn't save mbox index", path=self.index_path,
+                        error=repr(exc))
+
+    def message(self, i):
+        """
+        Return message i, as bytes or a memoryview of the mbox.  For an
+        mbox, the 'From ' separator line is left off.  '>From ' lines are
+        sent as they are: whether they were quoted depends on the mbox
+        flavour, and either way they're something a server has to parse.
+        """
+        if self.files is not None:
+            with open(self.files[i], 'rb') as eml:
+                return eml.read()
+
+        start, end = self.offsets[i], self.offsets[i + 1]
+        start = self._map.find(b'\n', start, end) + 1 or end
+        # the blank line before the next separator belongs to the mbox
+        if self._map[end - 2:end] == b'\n\n' and end - 1 > start:
+            end -= 1
+        return memoryview(self._map)[start:end]
+
+    def close(self):
+        """Unmap and close the mbox."""
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # a message is still being looked at; the map goes when
+                # it does
+                pass
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class CorpusSource(object):
+    """
+    Yields messages from a Corpus for one worker, in order or at random.
+
+    In order, the corpus is sharded between workers like recipient files:
+    worker i of n takes messages i, i + n, i + 2n and so on, starting over
+    when it gets to the end.  At random, each worker draws from the whole
+    corpus with its own seeded generator, so a run can be repeated.
+    """
+
+    def __init__(self, corpus, order='sequential', shard=0, n_shards=1,
+                 seed=0):
+        """
+        Instantiate the CorpusSource.
+
+        :corpus: Corpus.  Shared by every worker.
+        :order: str.  'sequential' or 'random'.
+        :shard: int.  Index of the worker this source belongs to.
+        :n_shards: int.  Total number of workers.
+        :seed: int.  Seed for random order; each worker adds its shard.
+        """
+        if order not in ('sequential', 'random'):
+            raise ValueError("Unknown corpus order {!r}".format(order))
+        self.corpus = corpus
+        self.order = order
+        self.shard = shard
+        # more workers than messages: every worker goes through the lot
+        self.n_shards = max(n_shards, 1) if n_shards <= len(corpus) else 1
+        self._random = random.Random(seed + shard)
+        self._next = shard % self.n_shards
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.order == 'random':
+            return self.corpus.message(
+                self._random.randrange(len(self.corpus)))
+        i = self._next
+        self._next += self.n_shards
+        if self._next >= len(self.corpus):
+            self._next = self.shard % self.n_shards
+        return self.corpus.message(i)
+
+    next = __next__  # py2
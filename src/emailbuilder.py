@@ -7,11 +7,34 @@ per configuration defined in the Coordinator class.
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email.mime.text import MIMEText
+from email.charset import Charset, QP, BASE64
 from email import encoders
+import email.policy
 
 import os
+import re
+import threading
+import uuid
 from sys import getsizeof
 
+# longest line, not counting the CRLF, allowed in 7bit and 8bit parts
+MAX_LINE = 998
+
+# what keeps text out of an 8bit (or 7bit) part: NULs and lines that are
+# too long.  line endings are made CRLF when it's rendered
+_NOT_8BIT_TEXT = re.compile(br'\0|[^\r\n]{%d}' % (MAX_LINE + 1))
+# and other data, whose line endings can't be touched: bare CRs and LFs too
+_NOT_8BIT = re.compile(br'\0|\r(?!\n)|(?<!\r)\n|[^\r\n]{%d}' %
+                       (MAX_LINE + 1))
+
+# what as_wire renders with: CRLF line endings, and headers either encoded
+# as they are for as_string, or left as UTF-8 for SMTPUTF8 servers
+_WIRE_POLICY = email.policy.compat32.clone(linesep='\r\n')
+_WIRE_POLICY_UTF8 = email.policy.SMTPUTF8
+
+# headers as_wire leaves to the parts it builds
+_MIME_HEADERS = ('content-type', 'mime-version', 'content-transfer-encoding')
+
 
 class PayloadGenerator(object):
     """
@@ -51,10 +74,17 @@ class PayloadGenerator(object):
 
 class Email(object):
     """
-    This class is responsible for constructing a MIMEMultipart message
-    given details defined in the Coordinator class and the Header class.
+    This class is responsible for constructing a MIME message given details
+    defined in the Coordinator class and the Header class.
+
+    The message is rendered lazily and incrementally: the body, the header
+    block and each attachment are tracked separately, and only the parts
+    that changed since the last render are rebuilt.  A message with a
+    single text part and no attachments is rendered as a plain MIMEText
+    instead of a one-part MIMEMultipart.
 
-    It is able to output the final email message as a string.
+    It is able to output the final email message as a string, or, for the
+    wire, as bytes in the cheapest transfer encodings a server allows.
     """
 
     def __init__(self, coordinator, headers):
@@ -63,46 +93,251 @@ class Email(object):
         self.coordinator = coordinator
         self.headers = headers
 
-        self.mimemulti = MIMEMultipart()
+        self._text = None
+        self._subject = None
+        self._payloads = []
+        self._attachments = []
+        # filename -> ((mtime, size), MIMEBase part)
+        self._attach_cache = {}
+
+        self._mime = None
+        self._string = None
+        # (body type, utf8) -> as_wire bytes.  workers ask for them from
+        # their own threads, so rendering is done under the lock
+        self._wire = {}
+        self._wire_lock = threading.Lock()
+        # the headers the body was built with (Content-Type and so on),
+        # which only change when the body is rebuilt
+        self._body_headers = []
+
+        self._body_dirty = True
+        self._headers_dirty = True
+
+    @property
+    def dirty(self):
+        """True if the message has to be re-rendered before sending."""
+        return self._body_dirty or self._headers_dirty or \
+            (self.headers is not None and self.headers.dirty)
 
     def add_text(self, text):
         """Attach a chunk of text to the message."""
-        mimetext = MIMEText(text)
-        self.mimemulti.attach(mimetext)
+        self._payloads.append(text)
+        self._body_dirty = True
 
     def add_header(self, header, value, **options):
         """Add a header to the message header section."""
-        self.mimemulti.add_header(header, value, **options)
+        self.getmime().add_header(header, value, **options)
+        self._string = None
+        self._wire = {}
+
+    def _load_attachment(self, filename):
+        """Return the MIME part for a file attachment, reading the file only
+        if it's new or has changed on disk since it was last read."""
+        stat = os.stat(filename)
+        stamp = (stat.st_mtime, stat.st_size)
+        cached = self._attach_cache.get(filename)
+        if cached is not None and cached[0] == stamp:
+            return cached[1], False
 
-    def add_attachment(self, filename):
-        """Add a file attachment."""
         # I'm absolutely sure I stole this code off stackoverflow somewhere
         # about 2 years ago, but I have absolutely no idea where.
         # Credit to StackOverflow for this method.
         part = MIMEBase('application', 'octet-stream')
-        part.set_payload(open(filename, 'rb').read())
+        with open(filename, 'rb') as attachment:
+            part.set_payload(attachment.read())
         encoders.encode_base64(part)  # modifies in-place.  magic.
         filepath = os.path.basename(filename)
         part.add_header('Content-Disposition',
                         'attachment; filename="{}"'.format(filepath))
-        self.mimemulti.attach(part)
+        self._attach_cache[filename] = (stamp, part)
+        return part, True
+
+    def add_attachment(self, filename):
+        """Add a file attachment."""
+        self._load_attachment(filename)
+        self._attachments.append(filename)
+        self._body_dirty = True
 
     def pull_data_from_coordinator(self):
-        """Pull in the data from the coordinator."""
-        self.add_text(self.coordinator.contents['text'])
-        for attach in self.coordinator.contents['attach'].split(','):
-            if not attach:
-                continue
-            attach = attach.strip()
-            self.add_attachment(attach)
-        self.headers.dump_headers_to_email()
+        """Pull in the data from the coordinator.  Only the parts that
+        differ from what was pulled last time are marked for rebuilding."""
+        text = self.coordinator.contents['text']
+        if text != self._text:
+            self._text = text
+            self._body_dirty = True
+
+        attachments = [a.strip() for a in
+                       self.coordinator.contents['attach'].split(',')
+                       if a.strip()]
+        if attachments != self._attachments:
+            self._attachments = attachments
+            self._body_dirty = True
+        for attach in attachments:
+            if self._load_attachment(attach)[1]:
+                self._body_dirty = True
+        # forget files that are no longer attached
+        for attach in list(self._attach_cache):
+            if attach not in attachments:
+                del self._attach_cache[attach]
+
         # subject is technically a header in MIME...
-        self.add_header('subject', self.coordinator.contents['subject'])
+        if self.coordinator.contents['subject'] != self._subject:
+            self._subject = self.coordinator.contents['subject']
+            self._headers_dirty = True
+
+        self.render()
+
+    def _build_body(self):
+        """Create a fresh MIME object holding the body and attachments, but
+        no headers besides the MIME ones."""
+        texts = [self._text or ''] + self._payloads
+        if len(texts) == 1 and not self._attachments:
+            # single-part fast path.  no multipart boundaries, no preamble
+            return MIMEText(texts[0])
+
+        mimemulti = MIMEMultipart()
+        for text in texts:
+            mimemulti.attach(MIMEText(text))
+        for attach in self._attachments:
+            mimemulti.attach(self._attach_cache[attach][1])
+        return mimemulti
+
+    def _apply_headers(self):
+        """Take off whatever headers were applied before, and put the
+        current ones on."""
+        # deleting by name would also take the body's own headers if one
+        # of ours shares a name with them (a custom Content-Type, say), so
+        # everything comes off and the body's go back on first
+        for header in set(self._mime.keys()):
+            del self._mime[header]
+        for header, value in self._body_headers:
+            self._mime[header] = value
+
+        if self.headers is not None:
+            self.headers.dump_headers_to_email()
+            self.headers.mark_clean()
+        self.add_header('subject', self._subject or '')
+
+    def render(self):
+        """Bring the MIME object up to date, rebuilding only what changed.
+        Returns the MIME object."""
+        if self._mime is None or self._body_dirty:
+            self._mime = self._build_body()
+            self._body_headers = self._mime.items()
+            self._body_dirty = False
+            self._headers_dirty = True
+        if self._headers_dirty or \
+           (self.headers is not None and self.headers.dirty):
+            self._headers_dirty = False
+            self._apply_headers()
+        return self._mime
 
     def getmime(self):
-        """Returns the MIMEMultipart object."""
-        return self.mimemulti
+        """Returns the MIME object, without re-rendering it."""
+        if self._mime is None:
+            return self.render()
+        return self._mime
 
     def as_string(self):
-        """Returns the stored email message as a string."""
-        return self.mimemulti.as_string()
+        """Returns the stored email message as a string.  The string is
+        cached until the message changes."""
+        if self.dirty:
+            self.render()
+        if self._string is None:
+            self._string = self._mime.as_string()
+        return self._string
+
+    @staticmethod
+    def _wire_text(text, body_type):
+        """Return a text part in the cheapest transfer encoding body_type
+        allows."""
+        data = text.encode('utf-8')
+        bare = _NOT_8BIT_TEXT.search(data) is None
+        if bare and not any(byte > 127 for byte in data):
+            return MIMEText(text)
+
+        charset = Charset('utf-8')
+        if body_type == 'binary' or (body_type == '8bit' and bare):
+            charset.body_encoding = None
+            part = MIMEText(text, 'plain', charset)
+            if not bare:
+                part.replace_header('Content-Transfer-Encoding', 'binary')
+            return part
+
+        # quoted-printable takes 3 bytes for each 8-bit byte or '=', plus a
+        # soft line break every 75 or so; base64 takes 4 for every 3
+        escaped = sum(1 for byte in data if byte > 126 or byte == 61)
+        qp_size = len(data) + 2 * escaped + len(data) // 25
+        charset.body_encoding = QP if qp_size < len(data) * 4 // 3 \
+            else BASE64
+        return MIMEText(text, 'plain', charset)
+
+    def _wire_attachment(self, filename, body_type, raw):
+        """Return an attachment part in the cheapest transfer encoding
+        body_type allows.  Parts that go unencoded hold a placeholder,
+        mapped to the file's contents in raw."""
+        cached = self._attach_cache[filename][1]
+        data = cached.get_payload(decode=True)
+        if body_type == 'binary':
+            encoding = 'binary'
+        elif _NOT_8BIT.search(data) is not None:
+            return cached
+        elif not any(byte > 127 for byte in data):
+            encoding = '7bit'
+        elif body_type == '8bit':
+            encoding = '8bit'
+        else:
+            return cached
+
+        part = MIMEBase('application', 'octet-stream')
+        token = 'emailer-part-' + uuid.uuid4().hex
+        part.set_payload(token)
+        part['Content-Transfer-Encoding'] = encoding
+        part.add_header('Content-Disposition',
+                        cached['Content-Disposition'])
+        raw[token.encode('ascii')] = data
+        return part
+
+    def _render_wire(self, body_type, utf8):
+        """Render the message for the wire.  See as_wire."""
+        raw = {}
+        texts = [self._text or ''] + self._payloads
+        if len(texts) == 1 and not self._attachments:
+            mime = self._wire_text(texts[0], body_type)
+        else:
+            mime = MIMEMultipart()
+            for text in texts:
+                mime.attach(self._wire_text(text, body_type))
+            for attach in self._attachments:
+                mime.attach(self._wire_attachment(attach, body_type, raw))
+
+        for name, value in self._mime.items():
+            if name.lower() not in _MIME_HEADERS:
+                mime[name] = value
+
+        data = mime.as_bytes(policy=_WIRE_POLICY_UTF8 if utf8
+                             else _WIRE_POLICY)
+        for token, contents in raw.items():
+            data = data.replace(token, contents, 1)
+        return data
+
+    def as_wire(self, body_type='7bit', utf8=False):
+        """
+        Returns the message as bytes ready to send, with CRLF line endings,
+        each part in the cheapest transfer encoding the server allows.
+        Cached until the message changes.
+
+        :body_type: str.  '7bit' for any server, '8bit' if it does
+                    8BITMIME, or 'binary' if it does BINARYMIME (which
+                    needs BDAT to send).
+        :utf8: bool.  Whether the server does SMTPUTF8, so headers can be
+               left as UTF-8.
+        """
+        with self._wire_lock:
+            if self.dirty:
+                self.render()
+            key = (body_type, utf8)
+            data = self._wire.get(key)
+            if data is None:
+                data = self._wire[key] = self._render_wire(body_type, utf8)
+            return data
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the EventLog class, which records one fixed-width binary record per
+email sent, for analysis after the run.
+
+File layout:
+    header:  MAGIC, then HEADER (version, flags, record size, sample rate,
+             length of the record format string), then the record format
+             string itself.
+    body:    RECORD-packed records back to back, zlib-compressed as one
+             stream if the compressed flag is set.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import collections
+import struct
+import sys
+import threading
+import zlib
+
+MAGIC = b'EGEV'
+VERSION = 1
+FLAG_COMPRESSED = 0x01
+
+HEADER = struct.Struct('<BBHIH')
+
+# timestamp, worker, connect secs, send secs, total secs, bytes, reply code
+RECORD = struct.Struct('<dIfffIH')
+
+EventRecord = collections.namedtuple('EventRecord',
+                                     ['timestamp', 'worker', 'connect',
+                                      'send', 'total', 'nbytes', 'code'])
+
+
+class EventLog(object):
+    """
+    Collects per-message event records from the worker threads and writes
+    them to disk from a background thread.
+
+    Every worker appends packed records to its own deque; deque appends and
+    pops are atomic, so workers never wait on each other or on the writer.
+    The writer wakes up every flush_interval seconds, drains all the deques,
+    and writes whatever it got as one block.
+    """
+
+    def __init__(self, filename, n_workers, compress=False, sample=1,
+                 flush_interval=0.5):
+        """
+        Instantiate the EventLog and start its writer thread.
+
+        :filename: str.  File to write the log to.  Overwritten.
+        :n_workers: int.  Number of worker threads that will log.
+        :compress: bool.  zlib-compress the body of the log.
+        :sample: int.  Keep only every n'th record from each worker.
+        :flush_interval: float.  Seconds between writes.
+        """
+        self.filename = filename
+        self.sample = max(int(sample), 1)
+        self.flush_interval = flush_interval
+
+        self._buffers = [collections.deque() for _ in range(n_workers)]
+        self._counts = [0] * n_workers
+        self._compressor = zlib.compressobj() if compress else None
+        self._stop = threading.Event()
+
+        self.n_written = 0
+
+        self._file = open(filename, 'wb')
+        fmt = RECORD.format
+        if not isinstance(fmt, bytes):
+            fmt = fmt.encode('ascii')
+        self._file.write(MAGIC)
+        self._file.write(HEADER.pack(VERSION,
+                                     FLAG_COMPRESSED if compress else 0,
+                                     RECORD.size, self.sample, len(fmt)))
+        self._file.write(fmt)
+
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name="EventLogWriter")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def log(self, worker, timestamp, connect, send, total, nbytes, code,
+            virtual=None):
+        """Record one message.  Called from the worker threads; each worker
+        must only ever log under its own index.  If given, the record shows
+        the virtual worker id instead of the index."""
+        count = self._counts[worker] + 1
+        self._counts[worker] = count
+        if count % self.sample:
+            return
+        if virtual is None:
+            virtual = worker
+        self._buffers[worker].append(RECORD.pack(timestamp, virtual, connect,
+                                                 send, total, nbytes, code))
+
+    def _drain(self):
+        """Take everything currently buffered and write it out."""
+        chunks = []
+        for buf in self._buffers:
+            # only take what's there now -- the worker may be appending
+            for _ in range(len(buf)):
+                chunks.append(buf.popleft())
+        if not chunks:
+            return
+        block = b''.join(chunks)
+        if self._compressor is not None:
+            block = self._compressor.compress(block)
+        self._file.write(block)
+        self.n_written += len(chunks)
+
+    def _write_loop(self):
+        """Body of the writer thread."""
+        while not self._stop.wait(self.flush_interval):
+            self._drain()
+
+    def close(self):
+        """Stop the writer, write out anything left, and close the file."""
+        self._stop.set()
+        self._writer.join()
+        self._drain()
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+        self._file.close()
+
+
+def read_events(filename):
+    """Yield an EventRecord for each record in an event log file."""
+    with open(filename, 'rb') as logfile:
+        if logfile.read(len(MAGIC)) != MAGIC:
+            raise ValueError(filename + " is not an event log")
+        version, flags, size, _, fmtlen = \
+            HEADER.unpack(logfile.read(HEADER.size))
+        if version != VERSION:
+            raise ValueError("Unsupported event log version " + str(version))
+        record = struct.Struct(logfile.read(fmtlen).decode('ascii'))
+        assert record.size == size, "corrupt event log header"
+
+        decompressor = zlib.decompressobj() \
+            if flags & FLAG_COMPRESSED else None
+        leftover = b''
+        while True:
+            block = logfile.read(1 << 16)
+            if not block:
+                break
+            if decompressor is not None:
+                block = decompressor.decompress(block)
+            block = leftover + block
+            end = len(block) - len(block) % size
+            for fields in record.iter_unpack(block[:end]):
+                yield EventRecord(*fields)
+            leftover = block[end:]
+
+
+if __name__ == '__main__':
+    # dump an event log as CSV:  python eventlog.py events.bin > events.csv
+    print(','.join(EventRecord._fields))
+    for event in read_events(sys.argv[1]):
+        print(','.join(str(field) for field in event))
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the MetricsExporter, a small HTTP server on localhost that serves
+the current run's metrics in the Prometheus text exposition format, so a
+running load can be scraped by the same monitoring as the server under
+test.
+
+Scrapes read the workers' counters the same way the GUI's snapshots do:
+without taking any locks, so the send path never waits on a scrape.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import threading
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    # py2
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+
+from metrics import LATENCY_BUCKETS, STATE_NAMES
+import logger
+
+LOG = logger.get_logger('exporter')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _metric(out, name, kind, helptext, samples):
+    """Append one metric family to out.  samples is a list of
+    (suffix, labels, value), labels being a string like 'code="550"'."""
+    out.append("# HELP {} {}".format(name, helptext))
+    out.append("# TYPE {} {}".format(name, kind))
+    for suffix, labels, value in samples:
+        if labels:
+            out.append("{}{}{{{}}} {}".format(name, suffix, labels, value))
+        else:
+            out.append("{}{} {}".format(name, suffix, value))
+
+
+def render_metrics(metrics):
+    """
+    Return the Prometheus text for a SendMetrics, or for no run at all if
+    metrics is None.
+    """
+    if metrics is None or metrics.profile.start_time is None:
+        return "\n"
+
+    out = []
+    snapshot = metrics.snapshot()
+    workers = metrics.workers
+
+    failed = {}
+    reconnects = 0
+    conn_errors = 0
+    buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+    latency_sum = 0.0
+    for worker in workers:
+        # copies are made in one go under the GIL, so a worker writing at
+        # the same time can't upset the iteration
+        for code, count in worker.failed.copy().items():
+            failed[code] = failed.get(code, 0) + count
+        reconnects += worker.reconnects
+        conn_errors += worker.conn_errors
+        for i, count in enumerate(list(worker.latency)):
+            buckets[i] += count
+        latency_sum += worker.latency_sum
+
+    _metric(out, 'emailer_sent_total', 'counter',
+            "Emails sent, including ones the server refused.",
+            [('', '', snapshot.sent)])
+    _metric(out, 'emailer_failed_total', 'counter',
+            "Transactions the server refused, by reply code.",
+            [('', 'code="{}"'.format(code), failed[code])
+             for code in sorted(failed)])
+    _metric(out, 'emailer_reconnects_total', 'counter',
+            "Connections made by workers after their first.",
+            [('', '', reconnects)])
+    _metric(out, 'emailer_connection_errors_total', 'counter',
+            "Connection attempts that failed, and connections dropped.",
+            [('', '', conn_errors)])
+
+    _metric(out, 'emailer_sent_bytes_total', 'counter',
+            "Message bytes the server accepted.",
+            [('', '', snapshot.bytes_sent)])
+    _metric(out, 'emailer_encoding_saved_bytes_total', 'counter',
+            "Message bytes not sent thanks to 8bit or binary encoding.",
+            [('', '', snapshot.bytes_saved)])
+
+    _metric(out, 'emailer_active_connections', 'gauge',
+            "Connections currently open.",
+            [('', '', snapshot.active_connections)])
+    _metric(out, 'emailer_queue_depth', 'gauge',
+            "Emails still waiting to be sent.",
+            [('', '', snapshot.remaining)])
+    _metric(out, 'emailer_generation_queue_depth', 'gauge',
+            "Messages prepared and waiting for a worker.",
+            [('', '', snapshot.queue_depth)])
+    _metric(out, 'emailer_generation_wait_seconds_total', 'counter',
+            "Seconds spent waiting on the generation queue: by workers "
+            "for a message, or by producers for room.",
+            [('', 'side="worker"', snapshot.gen_wait),
+             ('', 'side="producer"', snapshot.gen_blocked)])
+    _metric(out, 'emailer_rate', 'gauge',
+            "Emails per second past warm-up.",
+            [('', '', snapshot.sending_rate)])
+    target = metrics.profile.targets(snapshot.time -
+                                     metrics.profile.start_time)[0]
+    _metric(out, 'emailer_byte_rate', 'gauge',
+            "Message bytes per second past warm-up.",
+            [('', '', snapshot.byte_rate)])
+    _metric(out, 'emailer_target_rate', 'gauge',
+            "Emails per second the load profile is aiming for.",
+            [] if target is None else [('', '', target)])
+    states = snapshot.worker_state
+    _metric(out, 'emailer_workers', 'gauge',
+            "Worker threads, by what they're doing.",
+            [('', 'state="{}"'.format(name), states.count(i))
+             for i, name in enumerate(STATE_NAMES)])
+    _metric(out, 'emailer_done', 'gauge',
+            "1 once the run has finished.",
+            [('', '', int(snapshot.done))])
+
+    samples = []
+    total = 0
+    for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), buckets):
+        total += count
+        samples.append(('_bucket', 'le="{}"'.format(bound), total))
+    samples.append(('_sum', '', latency_sum))
+    samples.append(('_count', '', total))
+    _metric(out, 'emailer_send_latency_seconds', 'histogram',
+            "Seconds taken to send each email, past warm-up.", samples)
+
+    return "\n".join(out) + "\n"
+
+
+class MetricsExporter(object):
+    """
+    Serves render_metrics() for whatever run the coordinator currently
+    has, at http://127.0.0.1:<port>/metrics, from a daemon thread.
+    """
+
+    def __init__(self, coordinator, port, host='127.0.0.1'):
+        """
+        Instantiate the MetricsExporter.  Call start() to begin serving.
+
+        :coordinator: Must be a Coordinator object.
+        :port: int.  TCP port to listen on.
+        :host: str.  Address to listen on; keep it local unless the
+               machine is firewalled.
+        """
+        self.coordinator = coordinator
+        self.port = port
+
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = render_metrics(
+                    exporter.coordinator.sender.metrics).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                if LOG.isdebug:
+                    LOG.debug("scrape", client=self.client_address[0],
+                              request=fmt % args)
+
+        self.server = HTTPServer((host, port), Handler)
+        self._thread = None
+
+    def start(self):
+        """Start serving in the background."""
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="MetricsExporter")
+        self._thread.daemon = True
+        self._thread.start()
+        LOG.info("serving metrics", port=self.port)
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.server.shutdown()
+        self.server.server_close()
+        self._thread.join()
@@ -23,11 +23,14 @@ from __future__ import (division, print_function, generators, absolute_import)
 # %% imports and constants
 
 import sys
-import threading
 import uuid
 
-from gui_addons import Tooltip
+from gui_addons import Tooltip, WorkerHeatmap
 from helpers import time_from_epoch
+from metrics import STATE_NAMES
+import logger
+
+LOG = logger.get_logger('gui')
 
 if sys.version_info.major == 3:
     import tkinter as tk
@@ -188,13 +191,11 @@ class GUIBase(object):
 
     def dump_values_to_coordinator(self):
         """Sends over all the information needed for a successful email."""
-        if self.coordinator.settings['debug']:
-            print("guibase.dump_values_to_coordinator: beginning data dump")
+        LOG.debug("beginning data dump to coordinator")
         for var in self.variables:
-            if self.coordinator.settings['debug']:
-                print("  processing " + var + " with " + repr(
-                    self.variables[var].get()) + "/" + repr(type(
-                        self.variables[var].get())))
+            if LOG.isdebug:
+                LOG.debug("processing variable", name=var,
+                          value=self.variables[var].get())
 
             if var in self.coordinator.settings:
                 dic = self.coordinator.settings
@@ -217,20 +218,19 @@ class GUIBase(object):
                 except (ValueError, TypeError):
                     val = self.variables[var].get()
 
-            if self.coordinator.settings['debug']:
-                print("  dumping variable " + var + " with value " + str(val))
+            if LOG.isdebug:
+                LOG.debug("dumping variable", name=var, value=val)
             dic[var] = val
 
     def pull_values_from_coordinator(self):
         """Update (and overwrite!) all values with those stored in the
         coordinator."""
-        if self.coordinator.settings['debug']:
-            print('guibase.pull_values_from_coordinator: beginning data pull')
+        LOG.debug("beginning data pull from coordinator")
 
         for key in self.variables:
-            if self.coordinator.settings['debug']:
-                print('   processing ' + str(key) + " with val " +
-                      repr(self.variables[key].get()))
+            if LOG.isdebug:
+                LOG.debug("processing variable", name=key,
+                          value=self.variables[key].get())
 
             if key in self.coordinator.settings:
                 dsel = self.coordinator.settings
@@ -258,19 +258,44 @@ class EmailGUI(GUIBase):
         """Start the class, and make stuff happen."""
         super(EmailGUI, self).__init__(coordinator, name='main')
 
-        self._pbar_lock = threading.Lock()
         # pylint: disable=C0102
         self.bar = None
         self._notebook = None
+        # page name -> [frame, spawner, built], see spawn_gui_notebook
+        self._pages = {}
         self.barframe = None
-
-    def callback_sent(self):
-        """Action to take on a sent email."""
-        # progress bar update
-        self._pbar_lock.acquire()
-        var = self.variables['progressbar']
-        var.set(var.get() + 1)
-        self._pbar_lock.release()
+        self.heatmap = None
+
+    def start_metrics_polling(self):
+        """Start refreshing the progress page from the sender's metrics.
+        Must be called from the GUI thread."""
+        self.heatmap = None
+        self.build_page('progress')
+        self.root.after(0, self._poll_metrics)
+
+    def _poll_metrics(self):
+        """Update the progress page from a snapshot of the metrics, then
+        schedule the next update.  The worker threads never touch Tk
+        themselves; this is the only place the display gets updated while
+        sending."""
+        snapshot = self.coordinator.metrics_snapshot()
+        if snapshot is not None:
+            self.variables['progressbar'].set(snapshot.sent)
+
+            if self.coordinator.settings['metrics']:
+                if self.heatmap is None:
+                    self.heatmap = self.add_worker_heatmap(
+                        len(snapshot.worker_sent))
+                self.heatmap.update(snapshot.worker_state,
+                                    snapshot.worker_sent)
+                self.pull_metrics_from_coordinator(snapshot)
+
+            if snapshot.done:
+                self.root.bell()
+                return
+
+        interval = int(1000 / self.coordinator.settings['gui_refresh_hz'])
+        self.root.after(interval, self._poll_metrics)
 
     def spawn_gui(self):
         """Spawn the entire GUI."""
@@ -332,20 +357,45 @@ class EmailGUI(GUIBase):
                         sticky='ew')
 
     def spawn_gui_notebook(self):
-        """Create the notebook pages."""
+        """Create the notebook pages.  Only the first page is filled in
+        straight away; the others are filled in when first shown (or when
+        something needs them, see build_page).  Until then, their settings
+        keep the values from the coordinator."""
         self._notebook = ttk.Notebook(self.root)
         self._notebook.grid(row=10, column=0, columnspan=10, sticky='nsew')
 
-        self.spawn_page_1(self._notebook)
-        self.spawn_page_2(self._notebook)
-        self.spawn_page_3(self._notebook)
-
-    def spawn_page_1(self, notebook):
+        for name, text, spawner, colors in (
+                ('sending', "Sending", self.spawn_page_1, self.colors),
+                ('connection', "Connection", self.spawn_page_2, self.colors),
+                ('progress', "Progress", self.spawn_page_3, {})):
+            page = tk.Frame(self._notebook, **colors)
+            self._notebook.add(page, text=text, compound=tk.TOP)
+            self._pages[name] = [page, spawner, False]
+
+        self.build_page('sending')
+        self._notebook.bind('<<NotebookTabChanged>>', self._on_tab_changed)
+
+    def build_page(self, name):
+        """Fill in a notebook page, if that hasn't been done yet."""
+        entry = self._pages[name]
+        if not entry[2]:
+            entry[2] = True
+            entry[1](entry[0])
+
+    def page_built(self, name):
+        """Whether a notebook page has been filled in yet."""
+        return self._pages[name][2]
+
+    def _on_tab_changed(self, event=None):
+        """Fill in the newly selected page if need be."""
+        selected = self._notebook.select()
+        for name, entry in self._pages.items():
+            if str(entry[0]) == selected:
+                self.build_page(name)
+
+    def spawn_page_1(self, page):
         """Create the elements of the first tab page."""
 
-        page = tk.Frame(notebook, **self.colors)
-        notebook.add(page, text="Sending", compound=tk.TOP)
-
         mtframe = tk.LabelFrame(page, text="Multithreading options",
                                 relief=tk.RIDGE, **self.colors)
         mtframe.grid(row=0, column=1, sticky='w', )
@@ -375,6 +425,10 @@ class EmailGUI(GUIBase):
                         row=0, column=1, sticky='nw')
         self._add_entry('mt_num', root=mtframe, width=4,
                         row=1, column=1, sticky='nw')
+        maxcon = self._add_entry('max_connections', root=mtframe, width=4,
+                                 row=2, column=1, sticky='nw')
+        Tooltip(maxcon, text="Most connections to have open at once in "
+                "unlimited mode.  0 picks as many as the system allows.")
 
         oframe = tk.LabelFrame(page, text="Misc. options",
                                relief=tk.RIDGE, **self.colors)
@@ -382,20 +436,62 @@ class EmailGUI(GUIBase):
 
         dbgbox = self._add_box("debug", "Debug mode", root=oframe,
                                row=0, column=0, sticky='w')
-        Tooltip(dbgbox, text="Not recommended!  Makes program slow!")
+        Tooltip(dbgbox, text="Log every step of sending.  Not recommended "
+                "for big runs, makes the program slow!")
 
         rtlbox = self._add_box("realtime", "Realtime logging", root=oframe,
                                row=1, column=0, sticky='w')
-        Tooltip(rtlbox, text="Not recommended!  Makes program very slow!")
+        Tooltip(rtlbox, text="Keep the log files on disk up to date "
+                "while the program runs.")
 
         self._add_button("Dump logs",
                          self.coordinator.callbacks['flushlogs'],
                          root=oframe, row=2, column=0, sticky='w')
 
+        profbox = self._add_box("profiler", "Profile this run", root=oframe,
+                                row=3, column=0, sticky='w')
+        Tooltip(profbox, text="Sample what every thread is doing while "
+                "sending, and write a flamegraph-ready profile.")
+
         metbox = self._add_box("metrics", "Enable Performance Metrics",
                                root=oframe, row=0, column=1, sticky='w')
-        Tooltip(metbox, text="Makes program slower, but enables"
-                " information such as est. time remaining.")
+        Tooltip(metbox, text="Show information such as est. time "
+                "remaining and mails/sec on the Progress tab.")
+
+        self._add_label("Event log file:", root=oframe, row=1, column=1,
+                        sticky='w')
+        evlog = self._add_entry('event_log', root=oframe, width=20,
+                                row=2, column=1, sticky='w')
+        Tooltip(evlog, text="If set, write a binary record of every email "
+                "sent (timing, size, reply code) to this file.")
+
+        self._add_label("Metrics port:", root=oframe, row=3, column=1,
+                        sticky='w')
+        portentry = self._add_entry('metrics_port', root=oframe, width=6,
+                                    row=4, column=1, sticky='w')
+        Tooltip(portentry, text="If not 0, serve live metrics for "
+                "Prometheus at http://127.0.0.1:<port>/metrics.")
+
+        lframe = tk.LabelFrame(page, text="Load options",
+                               relief=tk.RIDGE, **self.colors)
+        lframe.grid(row=0, column=3, sticky='nw')
+
+        self._add_label("Run for (sec):", root=lframe, row=0, column=0,
+                        sticky='w')
+        durentry = self._add_entry('run_duration', root=lframe, width=5,
+                                   row=0, column=1, sticky='w')
+        Tooltip(durentry, text="If not 0, send for this long instead of "
+                "sending a set number of emails.")
+        self._add_label("Stagger starts (sec):", root=lframe, row=1,
+                        column=0, sticky='w')
+        self._add_entry('stagger_start', root=lframe, width=5,
+                        row=1, column=1, sticky='w')
+        self._add_label("Ignore first (sec):", root=lframe, row=2,
+                        column=0, sticky='w')
+        warmentry = self._add_entry('warmup_exclude', root=lframe, width=5,
+                                    row=2, column=1, sticky='w')
+        Tooltip(warmentry, text="Leave the warm-up at the start of the run "
+                "out of the metrics.")
 
         bframe = tk.LabelFrame(page, text="Controls",
                                relief=tk.RIDGE, **self.colors)
@@ -408,12 +504,9 @@ class EmailGUI(GUIBase):
         self._add_button('Reset', self.coordinator.callbacks['reset'],
                          root=bframe, row=2, column=0, sticky='n')
 
-    def spawn_page_2(self, notebook):
+    def spawn_page_2(self, page):
         """Spawn the page with connection options."""
 
-        page = tk.Frame(notebook, **self.colors)
-        notebook.add(page, text="Connection", compound=tk.TOP)
-
         cframe = tk.LabelFrame(page, text="Connection options",
                                relief=tk.RIDGE, **self.colors)
         cframe.grid(row=0, column=0, rowspan=3, columnspan=4,
@@ -467,6 +560,13 @@ class EmailGUI(GUIBase):
         self._add_entry("connection_timeout",
                         root=cframe, width=4, row=0, column=5,
                         sticky='w')
+        self._add_label("Prefetch connections: ", root=cframe,
+                        row=1, column=4, sticky='w')
+        prefetch = self._add_entry("con_prefetch", root=cframe, width=4,
+                                   row=1, column=5, sticky='w')
+        Tooltip(prefetch, text="Connections each thread opens ahead of "
+                "time when connecting per send or every n mails.  0 "
+                "connects only when needed.")
 
         tls = self._add_box("use_starttls", "Use STARTTLS",
                             root=aframe, row=0, column=0, sticky='w')
@@ -476,14 +576,71 @@ class EmailGUI(GUIBase):
                              root=aframe, row=1, column=0, sticky='w')
         Tooltip(auth, text="Use AUTH if server allows it.")
 
-    def spawn_page_3(self, notebook):
+        lean = self._add_box("lean_smtp", "Lean SMTP",
+                             root=aframe, row=2, column=0, sticky='w')
+        Tooltip(lean, text="Send with a faster SMTP path that prepares the "
+                "message once.  Adds an X-Emailer-Id header to each email.")
+        self._add_label("BDAT chunk:", root=aframe, row=3, column=0,
+                        sticky='w')
+        bdat = self._add_entry("bdat_chunk_size", root=aframe, width=8,
+                               row=3, column=1, sticky='w')
+        Tooltip(bdat, text="Bytes per BDAT chunk when using Lean SMTP and "
+                "the server supports CHUNKING.  0 always uses DATA.")
+        mime = self._add_box("negotiate_mime", "8-bit encoding",
+                             root=aframe, row=4, column=0, sticky='w')
+        Tooltip(mime, text="With Lean SMTP, send parts unencoded when the "
+                "server supports 8BITMIME, BINARYMIME or SMTPUTF8.")
+
+        fframe = tk.LabelFrame(page, text="Fan-out options",
+                               relief=tk.RIDGE, **self.colors)
+        fframe.grid(row=3, column=0, rowspan=2, columnspan=6,
+                    padx=30, pady=4, sticky='w')
+
+        self._add_label("Recipient file:", root=fframe, row=0, column=0,
+                        sticky='w')
+        rcptfile = self._add_entry("rcpt_source", root=fframe, width=40,
+                                   row=0, column=1, sticky='w')
+        Tooltip(rcptfile, text="File with one address per line.  Split "
+                "between the worker threads instead of using the "
+                "Recipient(s) field.")
+        self._add_label("RCPT TO per mail:", root=fframe, row=0, column=2,
+                        sticky='w')
+        self._add_entry("rcpt_per_txn", root=fframe, width=4,
+                        row=0, column=3, sticky='w')
+        self._add_label("Results file:", root=fframe, row=1, column=0,
+                        sticky='w')
+        self._add_entry("rcpt_report", root=fframe, width=40,
+                        row=1, column=1, sticky='w')
+
+        self._add_label("Replay corpus:", root=fframe, row=2, column=0,
+                        sticky='w')
+        corpus = self._add_entry("corpus_source", root=fframe, width=40,
+                                 row=2, column=1, sticky='w')
+        Tooltip(corpus, text="An mbox file, or a folder of .eml files, to "
+                "send instead of the message above.  Recipients are still "
+                "the ones set here.")
+        self._add_label("Order:", root=fframe, row=2, column=2, sticky='w')
+        self._add_combobox("corpus_order", root=fframe,
+                           values=['sequential', 'random'], width=10,
+                           row=2, column=3, sticky='w')
+        self._add_label("Generator threads:", root=fframe, row=3, column=0,
+                        sticky='w')
+        generators = self._add_entry("gen_threads", root=fframe, width=4,
+                                     row=3, column=1, sticky='w')
+        Tooltip(generators, text="Threads preparing corpus messages ahead "
+                "of the senders.  0 prepares each one as it's sent.")
+        self._add_label("Queue size:", root=fframe, row=3, column=2,
+                        sticky='w')
+        queued = self._add_entry("gen_queue_size", root=fframe, width=6,
+                                 row=3, column=3, sticky='w')
+        Tooltip(queued, text="Most prepared messages to hold in memory.")
+
+    def spawn_page_3(self, page):
         """Spawn the progress page"""
-        page = tk.Frame(notebook)
-        notebook.add(page, text="Progress", compound=tk.TOP)
 
         self.barframe = tk.Frame(page)
         self.barframe.grid(row=0, column=0, columnspan=10, sticky='nsew')
-        self._add_label("Sub-progress bars will spawn once emails are sent!",
+        self._add_label("Worker states will show once emails are sent!",
                         root=self.barframe, row=0, column=0,
                         columnspan=10, sticky='nsew')
 
@@ -525,6 +682,19 @@ class EmailGUI(GUIBase):
                         sticky='w')
         self._add_changinglabel("0", 'no-active-connections', root=page,
                                 row=3, column=5, sticky='w')
+        self._add_label("Bytes/sec:", root=page, row=3, column=6,
+                        sticky='w')
+        self._add_changinglabel("0", 'byte-rate', root=page, row=3,
+                                column=7, sticky='w')
+        # ROW SPLIT
+        self._add_label("Workers:", root=page, row=4, column=0, sticky='w')
+        self._add_changinglabel("", 'worker-states', root=page, row=4,
+                                column=1, columnspan=9, sticky='w')
+        # ROW SPLIT
+        self._add_label("Generation:", root=page, row=5, column=0,
+                        sticky='w')
+        self._add_changinglabel("", 'generation', root=page, row=5,
+                                column=1, columnspan=9, sticky='w')
 
     def dump_values_to_coordinator(self):
         """Do everything we'd normally do, except also add the password."""
@@ -532,64 +702,92 @@ class EmailGUI(GUIBase):
         self.coordinator.contents['password'] = \
             self.variables['password'].get()
 
-    def pull_metrics_from_coordinator(self):
-        """Grab the metrics from the coordinator, convert to UX-friendly
-        format, and push to display."""
+    def pull_metrics_from_coordinator(self, snapshot):
+        """Take a metrics snapshot, convert to UX-friendly format, and push
+        to display."""
 
         assert self.coordinator.settings['metrics'], "Should never reach here!"
 
         def rstr(num):
             return str(round(num, 2))
 
-        direct_translations = ['remaining', 'sent', 'no-active-connections']
-        for t in direct_translations:
-            self.variables[t].set(str(self.coordinator.metrics[t]))
+        self.variables['remaining'].set(str(snapshot.remaining))
+        self.variables['sent'].set(str(snapshot.sent))
+        self.variables['no-active-connections'].set(
+            str(snapshot.active_connections))
         self.variables['etr'].set(
-            time_from_epoch(self.coordinator.metrics['etr'],
-                            tzconvert=False))
-        self.variables['etc'].set(
-            time_from_epoch(self.coordinator.metrics['etc']))
+            time_from_epoch(snapshot.etr, tzconvert=False))
+        self.variables['etc'].set(time_from_epoch(snapshot.etc))
         self.variables['sending-rate'].set(
-            rstr(self.coordinator.metrics['sending-rate']) + " / sec")
+            rstr(snapshot.sending_rate) + " / sec")
         self.variables['sending-time'].set(
-            rstr(self.coordinator.metrics['sending-time']) + " sec")
-
-    def add_n_progress_bars(self, n):
-        """Add a number of progress bars to the progress window.
-        Will autofill from coordinator settings with relevant information,
-        but must be given the number of bars to spawn.
+            rstr(snapshot.sending_time) + " sec")
+        rate = rstr(snapshot.byte_rate) + " / sec"
+        if snapshot.bytes_saved:
+            rate += " ({} saved)".format(snapshot.bytes_saved)
+        self.variables['byte-rate'].set(rate)
+
+        if self.coordinator.sender.pipeline is not None:
+            self.variables['generation'].set(
+                "{}/{} ready, senders waited {} sec, producers waited {} "
+                "sec".format(snapshot.queue_depth,
+                             self.coordinator.settings['gen_queue_size'],
+                             rstr(snapshot.gen_wait),
+                             rstr(snapshot.gen_blocked)))
+
+        states = snapshot.worker_state
+        self.variables['worker-states'].set(", ".join(
+            "{} {}".format(states.count(i), name)
+            for i, name in enumerate(STATE_NAMES)))
+
+    def clear_metrics(self):
+        """Put the metric displays back to how they start out."""
+        if not self.page_built('progress'):
+            return
+        for var in ('remaining', 'sent', 'no-active-connections',
+                    'sending-rate', 'sending-time', 'byte-rate'):
+            self.variables[var].set("0")
+        for var in ('etr', 'etc'):
+            self.variables[var].set("00:00")
+        self.variables['worker-states'].set("")
+        self.variables['generation'].set("")
+
+    def add_worker_heatmap(self, n):
+        """Add the worker heatmap to the progress window, for n workers.
 
         By the time this is called, coordinator.sender.worker_amounts
         must be defined and accurate.
 
-        Returns a list of ttk.Progressbar's."""
+        Returns the WorkerHeatmap."""
         assert self.coordinator.settings['metrics'], "Should never reach here!"
 
+        for child in self.barframe.winfo_children():
+            child.destroy()
+
         amounts = self.coordinator.sender.worker_amounts
-        bars = []
-        intvars = []
-        length = int(600 / n)
-
-        for i in range(n):
-            var = tk.IntVar()
-            var.set(0)
-            intvars.append(var)
-            newbar = ttk.Progressbar(self.barframe, orient='horizontal',
-                                     length=length, mode='indeterminate',
-                                     variable=var,
-                                     maximum=amounts[i])
-            newbar.grid(row=0, column=i, sticky='w')
-            bars.append(newbar)
-
-        return bars, intvars
+        # time-bounded runs don't have a set amount per thread
+        if None in amounts:
+            amounts = None
+        heatmap = WorkerHeatmap(self.barframe, n, amounts, width=600)
+        heatmap.grid(row=0, column=0, columnspan=10, sticky='w')
+
+        legend = "   ".join("{}: {}".format(name, color) for name, color in
+                            zip(STATE_NAMES, WorkerHeatmap.STATE_COLORS))
+        Tooltip(heatmap.canvas, text="Top: worker states, coloured " +
+                legend + ".\nBottom: progress of each cell's workers.")
+
+        return heatmap
 
     def reset_subprogress_bars(self):
-        """Resets the thread progress bars."""
+        """Resets the worker heatmap."""
+        if not self.page_built('progress'):
+            return
         page = self.barframe.master
         self.barframe.destroy()
+        self.heatmap = None
         self.barframe = tk.Frame(page)
         self.barframe.grid(row=0, column=0, columnspan=10, sticky='nsew')
-        self._add_label("Sub-progress bars will spawn once emails are sent!",
+        self._add_label("Worker states will show once emails are sent!",
                         root=self.barframe, row=0, column=0,
                         columnspan=10, sticky='nsew')
 
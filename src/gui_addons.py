@@ -190,3 +190,125 @@ class Tooltip:
         if tw:
             tw.destroy()
         self.tw = None
+
+
+class WorkerHeatmap(object):
+    """
+    Shows what every worker thread is doing, on one Canvas.
+
+    The top part is a grid of cells coloured by worker state; the bottom is
+    a strip chart with one bar per cell, showing how far along its workers
+    are.  With more workers than max_cells, neighbouring workers share a
+    cell, which then shows their most common state and their combined
+    progress.  The canvas items are made once, and update() only
+    reconfigures the ones that changed, so a redraw costs the same whether
+    there are ten workers or ten thousand.
+    """
+
+    # indexed by the state numbers in metrics.py
+    STATE_COLORS = ('#d0d0d0',    # idle
+                    '#f0c040',    # connecting
+                    '#40a040',    # sending
+                    '#d04040',    # retrying
+                    '#4070c0')    # done
+
+    def __init__(self, master, n_workers, amounts=None, width=600,
+                 map_height=80, strip_height=30, max_cells=1024):
+        """
+        Instantiate the WorkerHeatmap.
+
+        :master: the Tk widget to put the canvas into.
+        :n_workers: int.  Number of worker threads.
+        :amounts: list of emails per worker, or None if the run is
+                  time-bounded, in which case the strip chart is scaled to
+                  the busiest cell.
+        """
+        self.n_workers = n_workers
+        self.per_cell = -(-n_workers // max_cells)
+        n_cells = -(-n_workers // self.per_cell)
+
+        # squarish cells filling width x map_height as best they can
+        cols = 1
+        while cols < n_cells and \
+                -(-n_cells // cols) * (width // cols) > map_height:
+            cols += 1
+        size = max(min(width // cols, map_height), 1)
+        rows = -(-n_cells // cols)
+
+        self.strip_top = rows * size + 4
+        self.strip_height = strip_height
+        self.canvas = tk.Canvas(master, width=width,
+                                height=self.strip_top + strip_height,
+                                highlightthickness=0)
+
+        self.cells = []
+        for i in range(n_cells):
+            x, y = (i % cols) * size, (i // cols) * size
+            self.cells.append(self.canvas.create_rectangle(
+                x, y, x + size, y + size, width=0,
+                fill=self.STATE_COLORS[0]))
+        self._colors = [0] * n_cells
+
+        self.bar_width = float(width) / n_cells
+        bottom = self.strip_top + strip_height
+        self.canvas.create_rectangle(0, self.strip_top, width, bottom,
+                                     width=0, fill='#f4f4f4')
+        self.bars = []
+        for i in range(n_cells):
+            x = i * self.bar_width
+            self.bars.append(self.canvas.create_rectangle(
+                x, bottom, x + self.bar_width, bottom, width=0,
+                fill=self.STATE_COLORS[4]))
+        self._heights = [0] * n_cells
+
+        if amounts is None:
+            self.cell_amounts = None
+        else:
+            self.cell_amounts = [sum(amounts[i:i + self.per_cell]) or 1
+                                 for i in range(0, n_workers, self.per_cell)]
+
+    def grid(self, **grids):
+        """Grid the underlying canvas."""
+        self.canvas.grid(**grids)
+
+    def _cells(self, values):
+        """Split a per-worker tuple into per-cell slices."""
+        step = self.per_cell
+        return (values[i:i + step] for i in range(0, len(values), step))
+
+    def update(self, worker_state, worker_sent):
+        """Redraw from a metrics snapshot's worker_state and worker_sent."""
+        canvas = self.canvas
+
+        if self.per_cell == 1:
+            states = worker_state
+            sent = worker_sent
+        else:
+            states = [max(set(cell), key=cell.count)
+                      for cell in self._cells(worker_state)]
+            sent = [sum(cell) for cell in self._cells(worker_sent)]
+
+        colors = self._colors
+        for i, state in enumerate(states):
+            if colors[i] != state:
+                colors[i] = state
+                canvas.itemconfigure(self.cells[i],
+                                     fill=self.STATE_COLORS[state])
+
+        if self.cell_amounts is None:
+            scale = [max(max(sent), 1)] * len(sent)
+        else:
+            scale = self.cell_amounts
+        bottom = self.strip_top + self.strip_height
+        heights = self._heights
+        for i, done in enumerate(sent):
+            height = int(self.strip_height * min(float(done) / scale[i], 1))
+            if heights[i] != height:
+                heights[i] = height
+                x = i * self.bar_width
+                canvas.coords(self.bars[i], x, bottom - height,
+                              x + self.bar_width, bottom)
+
+    def destroy(self):
+        """Remove the canvas."""
+        self.canvas.destroy()
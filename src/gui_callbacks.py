@@ -8,11 +8,12 @@ import webbrowser
 import traceback
 
 from helpers import suggest_thread_amt
-from prereqs import GUI_DOC
+from prereqs import gui_doc
 from helper_guis import HeaderGUI, VerificationGUI, EmailEditorGUI, \
     SMTPResponseCodeLookupGUI
 from gui_addons import error_more_details
 from emailbuilder import PayloadGenerator
+import logger
 
 if sys.version_info.major == 3:
     import tkinter as tk
@@ -70,8 +71,8 @@ CALLBACKS.append(handle_browse)
 
 def handle_send(coordinator):
     """Send the emails."""
-    if coordinator.settings['debug']:
-        print("recieved send instruction, beginning firing sequence")
+    logger.get_logger('callbacks').debug(
+        "received send instruction, beginning firing sequence")
     try:
         coordinator.prepare_to_send()
     except RuntimeError as exc:
@@ -95,7 +96,9 @@ CALLBACKS.append(handle_send)
 def handle_reset(coordinator):
     """Reset the program for another round of sending."""
     coordinator.reset()
-    coordinator.gui.variables['progressbar'].set(0)
+    # the progress page may not have been shown yet
+    if coordinator.gui.page_built('progress'):
+        coordinator.gui.variables['progressbar'].set(0)
     coordinator.gui.reset_subprogress_bars()
     coordinator.ready_to_send = True
 
@@ -164,7 +167,7 @@ def handle_quickhelp(coordinator):
     helper = tk.Toplevel(coordinator.gui.root)
     helper.title("Help")
     txt = scrolledtext.ScrolledText(helper)
-    txt.insert(tk.END, GUI_DOC)
+    txt.insert(tk.END, gui_doc())
     txt['font'] = ('liberation mono', '10')
     txt.pack(expand=True, fill='both')
 
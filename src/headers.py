@@ -8,6 +8,10 @@ from email.utils import formatdate
 import uuid
 import time
 
+import logger
+
+LOG = logger.get_logger('headers')
+
 REQUIRED_HEADERS = ['date',     # RFC 2822
                     'sender',   # RFC 2822
                     'from',     # RFC 2822
@@ -17,6 +21,12 @@ REQUIRED_HEADERS = ['date',     # RFC 2822
 
 class Headers(object):
     """This class is responsible for managing the headers of an email message.
+
+    Headers are kept in insertion order in self.headers, and indexed by
+    their lowercased name in self._index so that lookups and updates don't
+    have to scan the whole list.  Header names are case-insensitive (RFC
+    5322 section 1.2.2), so 'From' and 'from' refer to the same header.
+    A name may map to more than one entry (e.g. 'received', 'comments').
     """
 
     def __init__(self, coordinator, email):
@@ -32,87 +42,119 @@ class Headers(object):
         #  "value": str,
         #  "enabled": bool}
         # the keys are quite obvious I believe...
+
+        # lowercased name -> list of positions in self.headers.  dicts keep
+        # insertion order, so this is also ordered by first appearance.
+        self._index = {}
+
+        # set whenever anything changes, so the Email can tell whether it
+        # has to re-render the header block.  cleared by mark_clean().
+        self.dirty = True
+
         for key, val in self.coordinator.contents['headers'].items():
             self.add_header(key, val)
 
         self.auto_make_basics()
 
+    def __len__(self):
+        return len(self.headers)
+
+    def __contains__(self, header):
+        return header.lower() in self._index
+
+    @staticmethod
+    def _auto_enable(value, enabled):
+        """Headers are enabled by default exactly when they have a value."""
+        if enabled is None:
+            return value != ''
+        return enabled
+
     def add_header(self, header, value, enabled=None):
-        """Add a header to the records."""
+        """Add a header to the records.  Existing headers of the same name
+        are kept, so this is how multi-valued headers are built up."""
         h = {"name": header,
              "value": value,
-             "enabled": enabled}
-        if h['value'] and (enabled is None):
-            h['enabled'] = True
-        elif not h['value'] and (enabled is None):
-            h['enabled'] = False
+             "enabled": self._auto_enable(value, enabled)}
+        self._index.setdefault(header.lower(), []).append(len(self.headers))
         self.headers.append(h)
+        self.dirty = True
+
+    def get_entry(self, header):
+        """Return the first entry dictionary for a header, or None if there
+        is no such header."""
+        positions = self._index.get(header.lower())
+        if not positions:
+            return None
+        return self.headers[positions[0]]
+
+    def get_entries(self, header):
+        """Return a list of all the entry dictionaries for a header, in the
+        order they were added."""
+        return [self.headers[i] for i in self._index.get(header.lower(), [])]
+
+    def get_value(self, header, default=None):
+        """Return the value of the first entry for a header."""
+        entry = self.get_entry(header)
+        if entry is None:
+            return default
+        return entry['value']
+
+    def update_entry(self, entry, value=None, enabled=None):
+        """Change the value and/or enabled state of an existing entry."""
+        if value is not None:
+            entry['value'] = value
+        entry['enabled'] = self._auto_enable(entry['value'], enabled)
+        self.dirty = True
 
     def add_or_update_header(self, header, value, enabled=None):
         """If a header is not already in the records, add it.  If it is,
         update it."""
-        if header in self.header_list:
-            # updating an existing record
-            # first, check to make sure there's only 1 existing
-            # copy in the list
-            list = self.header_list
-            try:
-                idx = list.index(header, list.index(header), len(list) - 1)
-            except ValueError:
-                # good, a ValueError is expected if the item cannot
-                # be found
-                pass
-            self.headers[idx].update(name=header, value=value)
-            if enabled is None:
-                if self.headers[idx]['value'] is '':
-                    self.headers[idx]['enabled'] = False
-                else:
-                    self.headers[idx]['enabled'] = True
-        else:
+        entry = self.get_entry(header)
+        if entry is None:
             # adding a new record, just handoff to self.add_header
             self.add_header(header, value, enabled)
+        else:
+            self.update_entry(entry, value, enabled)
 
     def add_nonexisting_header(self, header, value, enabled=None):
         """If a header is already in the records, do nothing.  Else, add it."""
-        if header in self.header_list:
-            return
-        else:
+        if header not in self:
             self.add_header(header, value, enabled)
 
     def add_if_empty(self, header, value, enabled=None):
         """If a header exists, but is empty, update it.  Else, add it."""
-        if header in self.header_list:
-            idx = self.header_list.index(header)
-            old = self.headers[idx]['value']
-            if old is '':
-                self.add_or_update_header(header, value, enabled)
-        else:
+        entry = self.get_entry(header)
+        if entry is None:
             self.add_header(header, value, enabled)
+        elif entry['value'] == '':
+            self.update_entry(entry, value, enabled)
 
-    # TODO: possible to add a cache of some sort here?
-    # would need to clear the cache every time self.headers gets
-    # updated in any way...
     @property
     def header_list(self):
-        """Get the headers contained in the headers dictionary list as a
-        list."""
-        headers = []
-        for h in self.headers:
-            headers.append(h['name'])
-        return headers
+        """Get the names of all the headers, in order, as a list."""
+        return [h['name'] for h in self.headers]
 
     def check_for_required_headers(self):
         """Determine whether or not all the required headers are present."""
         for header in REQUIRED_HEADERS:
-            if header not in self.headers_list:
+            if header not in self:
                 return False
         return True
 
-    def paste_headers_into_email(self):
-        """Send all the header information over to the Email object."""
+    def enabled_items(self):
+        """Yield (name, value) for every enabled header, in order."""
         for header in self.headers:
             if header['enabled']:
-                self.email.add_header(header['name'], header['value'])
+                yield header['name'], header['value']
+
+    def mark_clean(self):
+        """Called by the renderer once the headers have been rendered."""
+        self.dirty = False
+
+    def paste_headers_into_email(self):
+        """Send all the header information over to the Email object."""
+        for name, value in self.enabled_items():
+            self.email.add_header(name, value)
 
     def auto_make_basics(self):
         """Create the basic tags from the Coordinator settings fields."""
@@ -125,21 +167,17 @@ class Headers(object):
         """Get all the headers from the GUI."""
         for i in range(len(header_gui.variables)):
             header = header_gui.variables[i]
-            header['value'] = header['value'].get()
-            header['enabled'] = bool(header['enabled'].get())
-            self.headers[i] = header
+            self.update_entry(self.headers[i],
+                              header['value'].get(),
+                              bool(header['enabled'].get()))
 
     def dump_headers_to_email(self):
         """Send all the header information to the Email class."""
-        if self.coordinator.settings['debug']:
-            print("starting header dump...")
+        LOG.debug("starting header dump")
         for header in self.headers:
-            if self.coordinator.settings['debug']:
-                print("  on " + repr(header) + "...")
             if header['enabled']:
-                if self.coordinator.settings['debug']:
-                    print('  dumping with value ' + repr(header))
+                if LOG.isdebug:
+                    LOG.debug("dumping header", **header)
                 self.coordinator.email.add_header(header['name'],
                                                   header['value'])
-        if self.coordinator.settings['debug']:
-            print("header dump complete")
+        LOG.debug("header dump complete")
@@ -4,10 +4,10 @@ Contains the header edit submenu.
 """
 
 import sys
-import re
 
 from gui import GUIBase
-from helpers import verify_to, verify_to_email, check_rfc_5322
+from helpers import verify_to, verify_to_email
+from addrparse import check_address
 
 if sys.version_info.major == 3:
     import tkinter as tk
@@ -48,14 +48,10 @@ class HeaderGUI(GUIBase):
         root = root or self.root
 
         self.variables[idx]['value'] = tk.StringVar()
-        if self.variables[idx]['name'] in self.coordinator.headers.header_list:
-            # vagrant syntax abuse, but necessary to keep this from being
-            # 9000 characters long
-            name = self.variables[idx]['name']
-            hlidx = self.coordinator.headers.header_list.index(name)
-            hlinfo = self.coordinator.headers.headers[hlidx]
-            value = hlinfo['value']
-            self.variables[idx]['value'].set(value)
+        # the header entry itself is handed over by _spawn_field, so there's
+        # no need to look it up again by name
+        self.variables[idx]['value'].set(
+            self.variables[idx]['entry']['value'])
 
         entry = tk.Entry(root, textvariable=self.variables[idx]['value'],
                          **entry_opts)
@@ -95,6 +91,7 @@ class HeaderGUI(GUIBase):
             self._column += 2
 
         self.variables.append({"name": header_info['name'],
+                               "entry": header_info,
                                "value": None,
                                "enabled": None})
 
@@ -141,14 +138,6 @@ class VerificationGUI(GUIBase):
                                               'verification')
         self.entry_width = self.entry_width // 3
 
-        with open("validation.regex", 'r') as regex:
-            lines = regex.readlines()
-        pattern = ''
-        for line in lines:
-            pattern += line.strip()
-
-        self.regex = re.compile(pattern)
-
     def _add_entry(self, varname, root=None, width=None, entry_opts=None,
                    **grids):
         """Adds a tk.Entry element to the window, and links the variable
@@ -171,10 +160,12 @@ class VerificationGUI(GUIBase):
     def verify_syntax(self):
         """Verify that the email provided is compliant with RFC5322 grammar."""
         self.variables['output_5322'].set('Please wait...')
-        if check_rfc_5322(self.coordinator.gui.variables['to'].get()):
+        verdict = check_address(self.coordinator.gui.variables['to'].get())
+        if verdict.valid:
             msg = "Email is RFC5322 grammar compliant"
         else:
-            msg = "Email is *not* compliant with RFC5322 grammar"
+            msg = "Email is *not* compliant with RFC5322 grammar: " + \
+                verdict.reason
 
         self.variables['output_5322'].set(msg)
 
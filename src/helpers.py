@@ -6,11 +6,10 @@ Contains 'simpler' helper functions that don't depend on other functionality.
 import smtplib
 import ipaddress
 import math
-import re
 import time
 import threading
 
-from prereqs import VALIDATION_RE
+from addrparse import check_address
 
 
 def time_from_epoch(sec, tzconvert=True):
@@ -129,6 +128,6 @@ def check_rfc_5322(address):
     # thanks to this S.O. answer where I got the regex snippet from
     # https://stackoverflow.com/a/201378/4612410
     # credit to user bortzmeyer & community wiki
-    regex = re.compile(VALIDATION_RE)
-    success = regex.search(address)
-    return success is not None
+    # the regex itself is slow on some inputs; addrparse gives the same
+    # answers in linear time.  see check_address for why it's rejected.
+    return check_address(address).valid
@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps a history of runs in a SQLite database, and compares them.
+
+While a run goes, a RunRecorder samples its metrics every
+history_interval seconds; when it's over, the run is saved with its
+settings, message and engine details, summary statistics, latency
+histogram and samples.  From the command line, runs can then be listed,
+shown, saved as named baselines, and compared:
+
+    python history.py list
+    python history.py baseline release-2.0 last
+    python history.py compare release-2.0 last
+
+compare prints throughput and p99 latency for both runs with 95%
+confidence intervals, flags a regression when the second run is worse by
+more than history_max_rate_drop (throughput) or history_max_p99_rise
+(p99), by a margin the intervals can't explain, and exits with status 1
+if it flagged anything.
+
+Throughput intervals come from the per-interval send rates past the
+warm-up; p99 intervals from the order statistics of the latency
+histogram, so they're only as fine as its buckets (metrics.LATENCY_BUCKETS).
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import argparse
+import json
+import math
+import os
+import platform
+import sqlite3
+import sys
+import threading
+import time
+
+from metrics import LATENCY_BUCKETS
+import logger
+
+LOG = logger.get_logger('history')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL,
+    duration REAL,
+    warmup REAL,
+    label TEXT,
+    settings TEXT,
+    message TEXT,
+    engine TEXT,
+    sent INTEGER,
+    failed INTEGER,
+    reconnects INTEGER,
+    bytes_sent INTEGER,
+    rate REAL,
+    byte_rate REAL,
+    mean_latency REAL,
+    p50 REAL,
+    p95 REAL,
+    p99 REAL
+);
+CREATE TABLE IF NOT EXISTS latency (
+    run_id INTEGER,
+    le REAL,            -- bucket upper bound; NULL for the overflow bucket
+    count INTEGER
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER,
+    t REAL,             -- secs since the run began
+    sent INTEGER,
+    timed INTEGER,
+    latency_sum REAL,
+    bytes_sent INTEGER,
+    failed INTEGER
+);
+CREATE TABLE IF NOT EXISTS baselines (
+    name TEXT PRIMARY KEY,
+    run_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS latency_run ON latency (run_id);
+CREATE INDEX IF NOT EXISTS samples_run ON samples (run_id);
+"""
+
+# two-sided 95% critical values of Student's t, by degrees of freedom;
+# past the end, the normal distribution's is close enough
+T_95 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262,
+        2.228, 2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101,
+        2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052,
+        2.048, 2.045, 2.042)
+Z_95 = 1.960
+
+
+def t_95(df):
+    """Two-sided 95% critical value of Student's t with df degrees of
+    freedom."""
+    if df < 1:
+        return float('inf')
+    if df <= len(T_95):
+        return T_95[int(df) - 1]
+    return Z_95
+
+
+def connect(path):
+    """Open (creating if need be) the history database at path."""
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+# %% statistics
+
+def value_at_rank(counts, rank):
+    """
+    The latency of the rank'th timed send (counting from 0), interpolated
+    within its histogram bucket.  Sends in the overflow bucket are only
+    known to be past the last bound, so that's what they come to.
+
+    :counts: list of counts per LATENCY_BUCKETS bucket, plus overflow.
+    """
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(LATENCY_BUCKETS + (None,), counts):
+        if count and seen + count > rank:
+            if bound is None:
+                return lower
+            return lower + (bound - lower) * (rank - seen) / count
+        seen += count
+        if bound is not None:
+            lower = bound
+    return lower
+
+
+def quantile(counts, q):
+    """The q'th quantile of a latency histogram, or None if it's empty."""
+    total = sum(counts)
+    if not total:
+        return None
+    return value_at_rank(counts, min(q * total, total - 1))
+
+
+def quantile_interval(counts, q):
+    """
+    95% confidence interval (low, high) for the q'th quantile of a latency
+    histogram, from the normal approximation to the binomial distribution
+    of the order statistics.  None if the histogram is empty.
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    spread = Z_95 * math.sqrt(total * q * (1 - q))
+    low = max(q * total - spread, 0)
+    high = min(q * total + spread + 1, total - 1)
+    return value_at_rank(counts, low), value_at_rank(counts, high)
+
+
+def interval_rates(samples, warmup):
+    """Emails/sec over each sampling interval that starts past the warm-up.
+
+    :samples: list of (t, sent, ...) rows, in time order.
+    """
+    rates = []
+    for before, after in zip(samples, samples[1:]):
+        if before[0] >= warmup and after[0] > before[0]:
+            rates.append((after[1] - before[1]) / (after[0] - before[0]))
+    return rates
+
+
+def mean_interval(values):
+    """Return (mean, half-width of its 95% confidence interval, n) for a
+    list of values.  The half-width is None with fewer than two."""
+    n = len(values)
+    if not n:
+        return None, None, 0
+    mean = sum(values) / n
+    if n < 2:
+        return mean, None, n
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return mean, t_95(n - 1) * math.sqrt(variance / n), n
+
+
+def difference_interval(a, b):
+    """
+    95% confidence interval (low, high) for mean(b) - mean(a), by Welch's
+    t-test, or None if either has fewer than two values.
+    """
+    if len(a) < 2 or len(b) < 2:
+        return None
+    mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+    var_a = sum((v - mean_a) ** 2 for v in a) / (len(a) - 1) / len(a)
+    var_b = sum((v - mean_b) ** 2 for v in b) / (len(b) - 1) / len(b)
+    error = math.sqrt(var_a + var_b)
+    if not error:
+        return mean_b - mean_a, mean_b - mean_a
+    df = (var_a + var_b) ** 2 / (var_a ** 2 / (len(a) - 1) +
+                                 var_b ** 2 / (len(b) - 1))
+    half = t_95(math.floor(df)) * error
+    return mean_b - mean_a - half, mean_b - mean_a + half
+
+
+# %% recording
+
+class RunRecorder(object):
+    """
+    Samples a run's metrics from a background thread, and saves the run to
+    the history database once it's over.  Like the GUI and the exporter,
+    it only ever reads the workers' counters, so it never holds them up.
+    """
+
+    def __init__(self, path, metrics, interval=1.0):
+        """
+        Instantiate the RunRecorder, and start sampling.
+
+        :path: str.  The history database.
+        :metrics: the run's SendMetrics.
+        :interval: float.  Seconds between samples.
+        """
+        self.path = path
+        self.metrics = metrics
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="RunRecorder")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _sample(self):
+        """Take one sample, once the run has begun."""
+        start = self.metrics.profile.start_time
+        if start is None:
+            return
+        workers = self.metrics.workers
+        # a snapshot, rather than just the counters, so the run's rates
+        # get worked out even with no GUI polling
+        snapshot = self.metrics.snapshot()
+        self.samples.append((
+            snapshot.time - start, snapshot.sent,
+            sum(w.timed for w in workers),
+            sum(w.latency_sum for w in workers), snapshot.bytes_sent,
+            sum(sum(w.failed.copy().values()) for w in workers)))
+
+    def _run(self):
+        """Body of the sampling thread."""
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def finish(self, settings, contents):
+        """
+        Stop sampling and save the run.  Returns its id, or None if it
+        couldn't be saved; that's only worth a warning.
+
+        :settings: dict.  The run's settings.
+        :contents: dict.  The message contents; any password is left out.
+        """
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+        try:
+            db = connect(self.path)
+            try:
+                with db:
+                    run_id = self._save(db, settings, contents)
+            finally:
+                db.close()
+        except sqlite3.Error as exc:
+            LOG.warning("couldn't save run to history", path=self.path,
+                        error=repr(exc))
+            return None
+        LOG.info("run saved to history", path=self.path, run=run_id)
+        return run_id
+
+    def _save(self, db, settings, contents):
+        """Insert the run's rows.  Returns its id."""
+        metrics = self.metrics
+        snapshot = metrics.snapshot()
+        workers = metrics.workers
+        counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        for worker in workers:
+            for i, count in enumerate(worker.latency):
+                counts[i] += count
+        timed = sum(counts)
+
+        message = dict((key, value) for key, value in contents.items()
+                       if key != 'password')
+        message['size'] = snapshot.bytes_sent // snapshot.sent \
+            if snapshot.sent else 0
+        engine = {'python': platform.python_version(),
+                  'implementation': platform.python_implementation(),
+                  'platform': platform.platform(),
+                  'cpus': os.cpu_count()}
+
+        cursor = db.execute(
+            "INSERT INTO runs (started, duration, warmup, label, settings, "
+            "message, engine, sent, failed, reconnects, bytes_sent, rate, "
+            "byte_rate, mean_latency, p50, p95, p99) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (metrics.profile.start_time,
+             metrics.end_time - metrics.profile.start_time,
+             metrics.profile.warmup, settings.get('run_label', ''),
+             json.dumps(settings, sort_keys=True),
+             json.dumps(message, sort_keys=True),
+             json.dumps(engine, sort_keys=True),
+             snapshot.sent,
+             sum(sum(w.failed.values()) for w in workers),
+             sum(w.reconnects for w in workers),
+             snapshot.bytes_sent, snapshot.sending_rate,
+             snapshot.byte_rate,
+             sum(w.latency_sum for w in workers) / timed if timed else None,
+             quantile(counts, 0.50), quantile(counts, 0.95),
+             quantile(counts, 0.99)))
+        run_id = cursor.lastrowid
+        db.executemany("INSERT INTO latency VALUES (?, ?, ?)",
+                       [(run_id, bound, count) for bound, count
+                        in zip(LATENCY_BUCKETS + (None,), counts)])
+        db.executemany("INSERT INTO samples VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       [(run_id,) + sample for sample in self.samples])
+        return run_id
+
+
+# %% reading and comparing
+
+RUN_COLUMNS = ('id', 'started', 'duration', 'warmup', 'label', 'sent',
+               'failed', 'reconnects', 'bytes_sent', 'rate', 'byte_rate',
+               'mean_latency', 'p50', 'p95', 'p99')
+
+
+def resolve_run(db, ref):
+    """Turn a run id, a baseline name or 'last' into a run id.  Raises
+    ValueError if there's no such run."""
+    if ref == 'last':
+        row = db.execute("SELECT MAX(id) FROM runs").fetchone()
+    elif ref.isdigit():
+        row = db.execute("SELECT id FROM runs WHERE id = ?",
+                         (int(ref),)).fetchone()
+    else:
+        row = db.execute("SELECT run_id FROM baselines WHERE name = ?",
+                         (ref,)).fetchone()
+    if row is None or row[0] is None:
+        raise ValueError("No run or baseline " + repr(ref))
+    return row[0]
+
+
+def load_run(db, run_id):
+    """Return a run as a dict of its RUN_COLUMNS, plus 'counts' (its
+    latency histogram) and 'samples'."""
+    row = db.execute("SELECT {} FROM runs WHERE id = ?".format(
+        ', '.join(RUN_COLUMNS)), (run_id,)).fetchone()
+    run = dict(zip(RUN_COLUMNS, row))
+    buckets = dict(db.execute("SELECT le, count FROM latency "
+                              "WHERE run_id = ?", (run_id,)))
+    run['counts'] = [buckets.get(bound, 0)
+                     for bound in LATENCY_BUCKETS + (None,)]
+    run['samples'] = db.execute("SELECT t, sent, timed, latency_sum, "
+                                "bytes_sent, failed FROM samples "
+                                "WHERE run_id = ? ORDER BY t",
+                                (run_id,)).fetchall()
+    return run
+
+
+def _fmt(value, digits=4):
+    """A number for display, or '-' if there isn't one."""
+    if value is None:
+        return '-'
+    return '{:.{}g}'.format(value, digits)
+
+
+def describe(run):
+    """Lines summing up one run."""
+    rates = interval_rates(run['samples'], run['warmup'])
+    mean, half, n = mean_interval(rates)
+    p99 = quantile_interval(run['counts'], 0.99)
+    return [
+        "run {id}  {label}  {when}".format(
+            when=time.strftime('%Y-%m-%d %H:%M:%S',
+                               time.localtime(run['started'])),
+            **run),
+        "  sent {sent}, failed {failed}, reconnects {reconnects}, "
+        "{duration:.1f} sec".format(**run),
+        "  mails/sec {}  (per-interval mean {} +/- {}, n={})".format(
+            _fmt(run['rate']), _fmt(mean), _fmt(half), n),
+        "  latency mean {} p50 {} p95 {} p99 {} sec  (p99 95% CI {}..{})"
+        .format(_fmt(run['mean_latency']), _fmt(run['p50']),
+                _fmt(run['p95']), _fmt(run['p99']),
+                _fmt(p99 and p99[0]), _fmt(p99 and p99[1])),
+    ]
+
+
+def compare(a, b, max_rate_drop, max_p99_rise):
+    """
+    Compare run b against run a.  Returns (lines to print, list of
+    regressions found).
+
+    Throughput regresses when b's rate is more than max_rate_drop (a
+    fraction) below a's and the confidence interval of the difference is
+    entirely below 0; p99 regresses when b's is more than max_p99_rise
+    above a's and their confidence intervals don't overlap.  Without
+    enough samples for an interval, the threshold alone decides.
+    """
+    lines = describe(a) + describe(b)
+    regressions = []
+
+    rates_a = interval_rates(a['samples'], a['warmup'])
+    rates_b = interval_rates(b['samples'], b['warmup'])
+    if a['rate']:
+        change = (b['rate'] - a['rate']) / a['rate']
+        diff = difference_interval(rates_a, rates_b)
+        significant = diff is None or diff[1] < 0
+        lines.append("throughput: {:+.1%}  (difference 95% CI {}..{} "
+                     "mails/sec)".format(change, _fmt(diff and diff[0]),
+                                         _fmt(diff and diff[1])))
+        if change < -max_rate_drop and significant:
+            regressions.append("throughput dropped {:.1%} (limit {:.1%})"
+                               .format(-change, max_rate_drop))
+
+    if a['p99'] and b['p99'] is not None:
+        change = (b['p99'] - a['p99']) / a['p99']
+        ci_a = quantile_interval(a['counts'], 0.99)
+        ci_b = quantile_interval(b['counts'], 0.99)
+        significant = ci_b[0] > ci_a[1]
+        lines.append("p99 latency: {:+.1%}".format(change))
+        if change > max_p99_rise and significant:
+            regressions.append("p99 latency rose {:.1%} (limit {:.1%})"
+                               .format(change, max_p99_rise))
+    else:
+        # saved before sends were timed whenever history was on
+        lines.append("p99 latency: not compared, none recorded for run {}"
+                     .format(', '.join(str(run['id']) for run in (a, b)
+                                       if not run['p99'])))
+
+    for regression in regressions:
+        lines.append("REGRESSION: " + regression)
+    return lines, regressions
+
+
+def main(argv=None):
+    """List, show, save baselines of and compare runs from the command
+    line.  Returns the exit status."""
+    from prereqs import load_config
+    settings = load_config()['settings']
+
+    parser = argparse.ArgumentParser(description="Look through and compare "
+                                     "the run history.")
+    parser.add_argument('-d', '--db', default=settings['history_db'],
+                        help="history database (default: %(default)s)")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    listing = commands.add_parser('list', help="list recent runs")
+    listing.add_argument('-n', '--count', type=int, default=20,
+                         help="how many (default: %(default)s)")
+    show = commands.add_parser('show', help="show one run")
+    show.add_argument('run', help="run id, baseline name or 'last'")
+    baseline = commands.add_parser('baseline',
+                                   help="save a run as a named baseline")
+    baseline.add_argument('name')
+    baseline.add_argument('run', help="run id, baseline name or 'last'")
+    comparing = commands.add_parser('compare', help="compare two runs, and "
+                                    "exit with 1 on a regression")
+    comparing.add_argument('baseline', help="run id, baseline name or "
+                           "'last'")
+    comparing.add_argument('run', help="run id, baseline name or 'last'")
+    comparing.add_argument('--max-rate-drop', type=float,
+                           default=settings['history_max_rate_drop'],
+                           help="fraction (default: %(default)s)")
+    comparing.add_argument('--max-p99-rise', type=float,
+                           default=settings['history_max_p99_rise'],
+                           help="fraction (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print("no history at " + args.db)
+        return 2
+    db = connect(args.db)
+    try:
+        if args.command == 'list':
+            for row in db.execute("SELECT id, started, label, sent, rate, "
+                                  "p99 FROM runs ORDER BY id DESC LIMIT ?",
+                                  (args.count,)):
+                print("{:5d}  {}  {:>8} sent  {:>8} mails/sec  p99 {:>6} "
+                      "sec  {}".format(
+                          row[0], time.strftime('%Y-%m-%d %H:%M:%S',
+                                                time.localtime(row[1])),
+                          row[3], _fmt(row[4]), _fmt(row[5]), row[2]))
+        elif args.command == 'show':
+            print('\n'.join(describe(load_run(db, resolve_run(db,
+                                                              args.run)))))
+        elif args.command == 'baseline':
+            with db:
+                db.execute("INSERT OR REPLACE INTO baselines VALUES (?, ?)",
+                           (args.name, resolve_run(db, args.run)))
+        else:
+            lines, regressions = compare(
+                load_run(db, resolve_run(db, args.baseline)),
+                load_run(db, resolve_run(db, args.run)),
+                args.max_rate_drop, args.max_p99_rise)
+            print('\n'.join(lines))
+            return 1 if regressions else 0
+    except ValueError as exc:
+        print(exc)
+        return 2
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
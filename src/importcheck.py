@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the program still starts up quickly: imports what the command
+line and the GUI need in a fresh interpreter, using python's own
+-X importtime, and fails if either takes longer than its budget.  Run it
+from this directory after adding imports:
+
+    python importcheck.py [budget scale]
+
+A budget scale of 2 doubles every budget, for slow machines (or slow
+network home directories).  When over budget, the slowest modules are
+listed, so it's easy to tell what to import lazily.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import os
+import subprocess
+import sys
+
+# entry point -> (what it imports, budget in milliseconds)
+BUDGETS = {'cli': ("import coordinator", 150),
+           'gui': ("import coordinator, gui, gui_callbacks, helper_guis",
+                   300)}
+
+# how many of the slowest modules to show when over budget
+SHOW_SLOWEST = 8
+
+
+def import_times(statement):
+    """Run statement in a fresh interpreter, and return a list of
+    (self microseconds, cumulative microseconds, depth, module) for every
+    module it imported."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                           statement], cwd=here, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True,
+                          check=True)
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        times.append((int(own), int(cumulative), depth, name.strip()))
+    return times
+
+
+def total_ms(times):
+    """Total import time of the top-level imports, in milliseconds."""
+    return sum(t[1] for t in times if t[2] == 0) / 1000
+
+
+def check(scale=1.0):
+    """Check every entry point against its budget.  Returns True if they
+    were all within it."""
+    # the interpreter imports some things on its own; don't count them
+    baseline = total_ms(import_times('pass'))
+    ok = True
+    for name in sorted(BUDGETS):
+        statement, budget = BUDGETS[name]
+        times = import_times(statement)
+        took = total_ms(times) - baseline
+        budget *= scale
+        print("{}: {:.1f} ms (budget {:.0f} ms)".format(name, took, budget))
+        if took > budget:
+            ok = False
+            print("  over budget!  slowest modules:")
+            for own, _, _, module in sorted(times, reverse=True)[
+                    :SHOW_SLOWEST]:
+                print("    {:8.1f} ms  {}".format(own / 1000, module))
+    return ok
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
+             else 1)
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the LoadProfile class, which decides how fast and with how many
+workers a run sends over the course of its lifetime.
+"""
+
+import threading
+import time
+
+
+# longest we'll sleep in one go while waiting for a turn, so that aborts and
+# changes in the profile are noticed promptly
+_MAX_NAP = 0.1
+
+
+def _span(value):
+    """Turn a phase's rate or concurrency entry into a (start, end) pair.
+    A single number is held constant; None means 'no limit'."""
+    if isinstance(value, (list, tuple)):
+        return float(value[0]), float(value[1])
+    if value is None:
+        return None
+    return float(value), float(value)
+
+
+class LoadProfile(object):
+    """
+    A declarative description of the offered load during a run.
+
+    A profile is a list of phases, run one after another.  Each phase is a
+    dictionary of the form:
+
+        {"duration": seconds,
+         "rate": msgs/sec, or [start, end] to ramp, or null for unlimited,
+         "concurrency": workers, or [start, end] to ramp, or null for all,
+         "steps": 0 for a smooth ramp, or n to ramp in n equal steps,
+                  the first at the start value and the last at the end}
+
+    A phase whose rate and concurrency are single numbers is a steady-state
+    phase.  The rate is a target for the whole run, shared between all the
+    active workers.
+
+    If a profile or a run duration is given, the run is time-bounded: it
+    ends when the duration (or, without one, the last phase) is over, and
+    the amount of emails isn't used.  Past the end of the last phase, its
+    final rate and concurrency are held.
+    """
+
+    def __init__(self, phases=None, duration=0, warmup=0):
+        """
+        Instantiate the LoadProfile.
+
+        :phases: list of phase dictionaries, as above.
+        :duration: float.  Seconds to run for, or 0 to run until the last
+                   phase ends.
+        :warmup: float.  Seconds at the start of the run to leave out of
+                 the statistics.
+        """
+        self.phases = []
+        for phase in phases or []:
+            self.phases.append({"duration": float(phase['duration']),
+                                "rate": _span(phase.get('rate')),
+                                "concurrency": _span(
+                                    phase.get('concurrency')),
+                                "steps": int(phase.get('steps', 0))})
+        self.duration = float(duration or 0) or \
+            sum(p['duration'] for p in self.phases)
+        self.warmup = float(warmup or 0)
+
+        self.start_time = None
+        self._next_slot = 0
+        self._slot_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        """Build a LoadProfile from the coordinator settings."""
+        return cls(settings['profile'], settings['run_duration'],
+                   settings['warmup_exclude'])
+
+    @property
+    def time_bounded(self):
+        """Whether the run ends on time rather than on amount sent."""
+        return self.duration > 0
+
+    @property
+    def end_time(self):
+        """Epoch time that a time-bounded run ends at."""
+        return self.start_time + self.duration
+
+    @property
+    def max_concurrency(self):
+        """The most workers any phase asks for, or None if unbounded."""
+        peaks = []
+        for phase in self.phases:
+            if phase['concurrency'] is None:
+                return None
+            peaks.append(max(phase['concurrency']))
+        if not peaks:
+            return None
+        return int(max(peaks))
+
+    def begin(self):
+        """Mark the start of the run.  The clock for all phases starts
+        here."""
+        self.start_time = time.time()
+        self._next_slot = self.start_time
+
+    def in_warmup(self, when):
+        """Whether the given epoch time falls in the excluded warm-up."""
+        return when < self.start_time + self.warmup
+
+    def phase_at(self, elapsed):
+        """Return the index of the phase running at a given number of
+        seconds into the run.  Past the end of the last phase, this is the
+        number of phases."""
+        phase_end = 0
+        for i, phase in enumerate(self.phases):
+            phase_end += phase['duration']
+            if elapsed < phase_end:
+                return i
+        return len(self.phases)
+
+    def targets(self, elapsed):
+        """Return the (rate, concurrency) targets at a given number of
+        seconds into the run.  Either may be None, meaning unlimited."""
+        if not self.phases:
+            return None, None
+
+        phase_start = 0
+        for phase in self.phases:
+            if elapsed < phase_start + phase['duration']:
+                into = (elapsed - phase_start) / phase['duration']
+                break
+            phase_start += phase['duration']
+        else:
+            phase, into = self.phases[-1], 1.0
+
+        if phase['steps'] > 1:
+            # hold each step for an equal share of the phase, starting on
+            # the start value and ending on the end value
+            into = min(int(into * phase['steps']) /
+                       float(phase['steps'] - 1), 1.0)
+        elif phase['steps'] == 1:
+            into = 0.0
+
+        out = []
+        for key in ('rate', 'concurrency'):
+            if phase[key] is None:
+                out.append(None)
+            else:
+                start, end = phase[key]
+                out.append(start + (end - start) * into)
+        return out[0], out[1]
+
+    def wait_turn(self, worker_index, should_stop):
+        """
+        Block a worker until it's allowed to send its next email.
+
+        :worker_index: int.  Workers at or above the current concurrency
+                       target sit idle until it rises.
+        :should_stop: callable.  Checked while waiting; if it returns true,
+                      stop waiting and let the worker deal with it.
+
+        Returns False once a time-bounded run is over, True otherwise.
+        """
+        while True:
+            now = time.time()
+            if self.time_bounded and now >= self.end_time:
+                return False
+            if should_stop():
+                return True
+
+            rate, concurrency = self.targets(now - self.start_time)
+
+            if concurrency is not None and worker_index >= int(concurrency):
+                time.sleep(_MAX_NAP)
+                continue
+
+            if rate is None:
+                return True
+            if rate <= 0:
+                time.sleep(_MAX_NAP)
+                continue
+
+            with self._slot_lock:
+                slot = max(now, self._next_slot)
+                if slot - now <= _MAX_NAP:
+                    self._next_slot = slot + 1.0 / rate
+                    claimed = True
+                else:
+                    claimed = False
+            if claimed:
+                if slot > now:
+                    time.sleep(slot - now)
+                return True
+            time.sleep(_MAX_NAP)
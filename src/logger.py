@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Leveled, structured logging for the whole program.
+
+Each part of the program gets its own Logger from get_logger(), and each
+Logger has its own level for what gets printed.  Separately, the most
+recent events are kept in a ring buffer, by default down to debug level
+whatever the loggers print.  Records in the ring stay unformatted, and are
+only turned into text if the ring is dumped after an error, so the debug
+events leading up to it can be seen without printing them all the time.
+
+Call sites in hot loops guard the call with the logger's level flag, so
+that an event nobody wants costs one attribute check and nothing is built:
+
+    if LOG.isdebug:
+        LOG.debug("sent", index=i)
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import collections
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+
+LEVELS = {'debug': DEBUG,
+          'info': INFO,
+          'warning': WARNING,
+          'error': ERROR,
+          'off': OFF}
+LEVEL_NAMES = {v: k.upper() for k, v in LEVELS.items()}
+
+_LOGGERS = {}
+_LOGGERS_LOCK = threading.Lock()
+
+# (time, subsystem, level, message, fields) for the latest records
+_RING = collections.deque(maxlen=1000)
+
+_DEFAULT_LEVEL = INFO
+_LEVEL_OVERRIDES = {}
+# lowest level kept in the ring
+_RING_LEVEL = DEBUG
+
+
+class Logger(object):
+    """A logger for one subsystem of the program."""
+
+    def __init__(self, subsystem, level=INFO):
+        """Instantiate a Logger.  Use get_logger() instead."""
+        self.subsystem = subsystem
+        self.level = OFF
+        self.isdebug = self.isinfo = False
+        self.set_level(level)
+
+    def set_level(self, level):
+        """Change the level printed at, given as a name or a number."""
+        if not isinstance(level, int):
+            level = LEVELS[level.lower()]
+        self.level = level
+        self._update_flags()
+
+    def _update_flags(self):
+        """Work out which levels anything wants, to be printed or kept in
+        the ring.  Precomputed, so call sites only need to check an
+        attribute."""
+        wanted = min(self.level, _RING_LEVEL)
+        self.isdebug = wanted <= DEBUG
+        self.isinfo = wanted <= INFO
+
+    def log(self, level, message, **fields):
+        """Record an event at the given level: keep it in the ring if the
+        ring's level allows, and print it if this logger's does."""
+        record = None
+        if level >= _RING_LEVEL:
+            record = (time.time(), self.subsystem, level, message, fields)
+            _RING.append(record)
+        if level >= self.level:
+            if record is None:
+                record = (time.time(), self.subsystem, level, message,
+                          fields)
+            stream = sys.stderr if level >= WARNING else sys.stdout
+            stream.write(format_record(record) + '\n')
+
+    def debug(self, message, **fields):
+        """Record an event at debug level."""
+        if self.isdebug:
+            self.log(DEBUG, message, **fields)
+
+    def info(self, message, **fields):
+        """Record an event at info level."""
+        if self.isinfo:
+            self.log(INFO, message, **fields)
+
+    def warning(self, message, **fields):
+        """Record an event at warning level."""
+        self.log(WARNING, message, **fields)
+
+    def error(self, message, **fields):
+        """Record an event at error level."""
+        self.log(ERROR, message, **fields)
+
+
+def format_record(record):
+    """Turn a record tuple into a line of text."""
+    when, subsystem, level, message, fields = record
+    stamp = time.strftime("%H:%M:%S", time.localtime(when)) + \
+        "{:.3f}".format(when % 1)[1:]
+    out = "{} {} {}: {}".format(stamp, LEVEL_NAMES.get(level, level),
+                                subsystem, message)
+    if fields:
+        out += " " + " ".join("{}={!r}".format(key, fields[key])
+                              for key in sorted(fields))
+    return out
+
+
+def get_logger(subsystem):
+    """Get the Logger for a subsystem, creating it if need be."""
+    try:
+        return _LOGGERS[subsystem]
+    except KeyError:
+        with _LOGGERS_LOCK:
+            if subsystem not in _LOGGERS:
+                _LOGGERS[subsystem] = Logger(
+                    subsystem, _LEVEL_OVERRIDES.get(subsystem,
+                                                    _DEFAULT_LEVEL))
+            return _LOGGERS[subsystem]
+
+
+def configure(settings):
+    """Set up logger levels and the ring buffer from the coordinator
+    settings.  In debug mode everything defaults to printing at debug
+    level; otherwise, at info.  'log_levels' can override the level per
+    subsystem.  'log_ring_level' is the lowest level kept in the ring."""
+    global _DEFAULT_LEVEL, _RING, _RING_LEVEL
+
+    _DEFAULT_LEVEL = DEBUG if settings['debug'] else INFO
+    _LEVEL_OVERRIDES.clear()
+    for subsystem, level in settings['log_levels'].items():
+        _LEVEL_OVERRIDES[subsystem] = LEVELS[level.lower()]
+    _RING_LEVEL = LEVELS[settings['log_ring_level'].lower()]
+
+    with _LOGGERS_LOCK:
+        for subsystem, logger in _LOGGERS.items():
+            logger.set_level(_LEVEL_OVERRIDES.get(subsystem,
+                                                  _DEFAULT_LEVEL))
+
+    if settings['log_ring_size'] != _RING.maxlen:
+        _RING = collections.deque(_RING, maxlen=settings['log_ring_size'])
+
+
+def dump_ring(stream=None):
+    """Write out the most recent log records.  Used after an error, so the
+    events leading up to it end up next to the traceback."""
+    stream = stream or sys.stderr
+    records = list(_RING)
+    stream.write("----- last {} log events -----\n".format(len(records)))
+    for record in records:
+        stream.write(format_record(record) + '\n')
+    stream.write("----- end of log events -----\n")
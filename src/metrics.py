@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the SendMetrics class, which collects performance metrics from the
+worker threads without any locking, and hands out immutable snapshots of
+them to whoever wants to display them.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import bisect
+import collections
+import time
+
+# what a worker is up to, as kept in WorkerMetrics.state
+IDLE, CONNECTING, SENDING, RETRYING, DONE = range(5)
+STATE_NAMES = ('idle', 'connecting', 'sending', 'retrying', 'done')
+
+# upper bounds, in seconds, of the send latency histogram buckets.  there's
+# one more bucket on the end for everything slower.  the run history works
+# out percentiles from these, so they start fine enough for a local server
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+MetricsSnapshot = collections.namedtuple('MetricsSnapshot', [
+    'time',                 # epoch time the snapshot was taken
+    'sent',                 # total emails sent so far
+    'remaining',            # emails left to send (estimated if time-bound)
+    'sending_rate',         # emails/sec, over the whole run past warm-up
+    'sending_time',         # mean seconds per email, past warm-up
+    'etr',                  # est. seconds remaining
+    'etc',                  # est. epoch time of completion
+    'active_connections',   # connections currently open
+    'worker_sent',          # tuple of emails sent per worker
+    'worker_state',         # tuple of each worker's state, e.g. IDLE
+    'bytes_sent',           # total message bytes put on the wire
+    'byte_rate',            # bytes/sec, over the whole run past warm-up
+    'bytes_saved',          # bytes not sent thanks to 8bit/binary encoding
+    'queue_depth',          # messages built and waiting for a worker
+    'gen_wait',             # secs workers spent waiting for a message
+    'gen_blocked',          # secs producers spent waiting for queue room
+    'done',                 # whether the run has finished
+])
+
+
+class WorkerMetrics(object):
+    """
+    The counters belonging to one worker thread.  Only that worker ever
+    writes to them, so no locking is needed; readers may see a value that's
+    one email out of date, which is fine for display.
+    """
+
+    __slots__ = ('sent', 'timed', 'sending_time', 'connections', 'state',
+                 'reconnects', 'failed', 'latency', 'latency_sum',
+                 'bytes_sent', 'bytes_saved', 'gen_taken', 'gen_wait',
+                 'conn_errors')
+
+    def __init__(self):
+        self.state = IDLE
+        self.sent = 0
+        # number of sends that went into sending_time
+        self.timed = 0
+        # running mean of seconds per email
+        self.sending_time = 0.0
+        self.connections = 0
+        # connections made after the first one
+        self.reconnects = 0
+        # connection attempts that failed, and connections the server
+        # dropped mid-run
+        self.conn_errors = 0
+        # reply code -> number of transactions the server refused
+        self.failed = {}
+        # count of timed sends per LATENCY_BUCKETS bucket, and their total
+        # seconds
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        # message bytes sent, and how many fewer that was than with every
+        # part 7-bit encoded
+        self.bytes_sent = 0
+        self.bytes_saved = 0
+        # messages taken from the generation pipeline, and seconds spent
+        # waiting for them
+        self.gen_taken = 0
+        self.gen_wait = 0.0
+
+    def record_send(self, delta, counted=True):
+        """Count one sent email that took delta seconds.  If counted is
+        false (e.g. during warm-up), it isn't included in the timing."""
+        self.sent += 1
+        if counted:
+            self.timed += 1
+            self.sending_time += (delta - self.sending_time) / self.timed
+            self.latency[bisect.bisect_left(LATENCY_BUCKETS, delta)] += 1
+            self.latency_sum += delta
+
+    def record_bytes(self, size, saved=0):
+        """Count one message of size bytes accepted by the server, which
+        came to saved fewer bytes than it would have 7-bit encoded."""
+        self.bytes_sent += size
+        self.bytes_saved += saved
+
+    def record_failure(self, code):
+        """Count one transaction the server refused with the given reply
+        code."""
+        self.failed[code] = self.failed.get(code, 0) + 1
+
+
+class ProducerMetrics(object):
+    """
+    The counters belonging to one MessagePipeline producer thread, written
+    only by that thread, like WorkerMetrics.
+    """
+
+    __slots__ = ('produced', 'blocked')
+
+    def __init__(self):
+        # messages put on the queue
+        self.produced = 0
+        # seconds spent waiting for room on the queue
+        self.blocked = 0.0
+
+
+class SendMetrics(object):
+    """
+    Holds the metrics for one run: one WorkerMetrics per worker thread, plus
+    what's needed to turn them into rates and estimates.
+    """
+
+    def __init__(self, n_workers, amount, profile):
+        """
+        Instantiate the SendMetrics.
+
+        :n_workers: int.  Number of worker threads.
+        :amount: int.  Total number of emails, or None if time-bounded.
+        :profile: the run's LoadProfile.  Snapshots can only be taken
+                  once it has begun.
+        """
+        self.workers = [WorkerMetrics() for _ in range(n_workers)]
+        # the MessagePipeline's ProducerMetrics, if the run has one
+        self.producers = []
+        self.amount = amount
+        self.profile = profile
+        self.done = False
+        self.end_time = None
+
+        # sent count and bytes when the warm-up ended, for the rate
+        # calculations
+        self._warm_sent = None
+        self._warm_bytes = None
+
+    def finish(self):
+        """Mark the run as over.  Rates stop decaying from here on."""
+        self.end_time = time.time()
+        self.done = True
+
+    def snapshot(self):
+        """Build a MetricsSnapshot of the current state.  Takes no locks,
+        so it's safe to call from any thread at any rate."""
+        now = self.end_time or time.time()
+        workers = self.workers
+        worker_sent = tuple(w.sent for w in workers)
+        worker_state = tuple(w.state for w in workers)
+        sent = sum(worker_sent)
+        connections = sum(w.connections for w in workers)
+        bytes_sent = sum(w.bytes_sent for w in workers)
+        bytes_saved = sum(w.bytes_saved for w in workers)
+        gen_wait = sum(w.gen_wait for w in workers)
+        producers = self.producers
+        gen_blocked = sum(p.blocked for p in producers)
+        # a message can be taken before its producer has counted it
+        queue_depth = max(sum(p.produced for p in producers) -
+                          sum(w.gen_taken for w in workers), 0)
+
+        timed = [w for w in workers if w.timed]
+        if timed:
+            sending_time = sum(w.sending_time for w in timed) / len(timed)
+        else:
+            sending_time = 0.0
+
+        warm_end = self.profile.start_time + self.profile.warmup
+        if self._warm_sent is None:
+            if now >= warm_end:
+                self._warm_sent = sent if self.profile.warmup else 0
+                self._warm_bytes = bytes_sent if self.profile.warmup else 0
+            rate = byte_rate = 0.0
+        elif now > warm_end:
+            rate = (sent - self._warm_sent) / (now - warm_end)
+            byte_rate = (bytes_sent - self._warm_bytes) / (now - warm_end)
+        else:
+            rate = byte_rate = 0.0
+
+        if self.amount is None:
+            etc = self.profile.end_time
+            etr = max(etc - now, 0)
+            remaining = int(etr * rate)
+        else:
+            remaining = self.amount - sent
+            etr = remaining / rate if rate else 0
+            etc = now + etr
+
+        return MetricsSnapshot(now, sent, remaining, rate, sending_time,
+                               etr, etc, connections, worker_sent,
+                               worker_state, bytes_sent, byte_rate,
+                               bytes_saved, queue_depth, gen_wait,
+                               gen_blocked, self.done)
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the MessagePipeline, which builds messages on producer threads of
+its own and hands them to the worker threads through a bounded queue, so
+that getting a message ready isn't done on the same threads as talking to
+the server.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    # py2
+    import Queue as queue
+
+from metrics import ProducerMetrics
+import logger
+
+LOG = logger.get_logger('sender')
+
+
+class MessagePipeline(object):
+    """
+    Producer threads take messages from their own sources and put them on
+    one queue, holding at most `capacity` ready messages; the worker
+    threads take them off with get().
+
+    When the queue is full, producers wait for room, which is what keeps
+    memory bounded.  How long each side spends waiting shows which one a
+    run is held up by: workers waiting on get() means generation can't
+    keep up (generation-bound), producers waiting for room means the
+    workers can't (network-bound).  The producers' share is counted in
+    their ProducerMetrics, the workers' in their WorkerMetrics.
+
+    If a source raises, the error is handed to whichever worker next calls
+    get(), and that producer stops; a source that runs out just stops its
+    producer.  Once every producer has stopped and the queue is empty,
+    get() raises the first error any of them hit to every worker that
+    calls it, or returns None if there wasn't one, rather than wait for
+    messages that will never come.
+    """
+
+    def __init__(self, sources, capacity, name="MessagePipeline"):
+        """
+        Instantiate the MessagePipeline, and start producing.
+
+        :sources: list of iterators, one per producer thread, each
+                  yielding ready-to-send messages.  Each is only ever used
+                  from its own thread.
+        :capacity: int.  Most ready messages to hold.
+        :name: str.  Prefix for the producer threads' names.
+        """
+        self.capacity = max(int(capacity), 1)
+        self.producers = [ProducerMetrics() for _ in sources]
+        self._queue = queue.Queue(self.capacity)
+        self._stop = threading.Event()
+        # set once the last producer has stopped, with the first error a
+        # producer hit, if any
+        self._exhausted = threading.Event()
+        self._error = None
+        self._running = len(sources)
+        self._lock = threading.Lock()
+        if not sources:
+            self._exhausted.set()
+
+        self._threads = [threading.Thread(target=self._run,
+                                          args=(source, stats),
+                                          name="{}-{}".format(name, n))
+                         for n, (source, stats)
+                         in enumerate(zip(sources, self.producers))]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _put(self, item, stats):
+        """Put item on the queue, waiting for room unless told to stop.
+        Returns False if stopped first."""
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        blocked = time.time()
+        try:
+            while not self._stop.is_set():
+                try:
+                    self._queue.put(item, timeout=0.05)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            stats.blocked += time.time() - blocked
+
+    def _run(self, source, stats):
+        """Body of each producer thread."""
+        try:
+            self._produce(source, stats)
+        finally:
+            with self._lock:
+                self._running -= 1
+                if self._running == 0:
+                    self._exhausted.set()
+
+    def _produce(self, source, stats):
+        """Put what source yields on the queue until it runs out, fails,
+        or the pipeline is closed."""
+        while not self._stop.is_set():
+            try:
+                item = next(source)
+            except StopIteration:
+                return
+            except Exception as exc:  # pylint: disable=W0703
+                # handed on to a worker, who deals with it
+                LOG.debug("producer failed",
+                          thread=threading.current_thread().name,
+                          error=repr(exc))
+                with self._lock:
+                    if self._error is None:
+                        self._error = exc
+                self._put(exc, stats)
+                return
+            if not self._put(item, stats):
+                return
+            stats.produced += 1
+
+    def get(self, stats, should_stop):
+        """
+        Return the next ready message, waiting if there isn't one yet.
+        Raises whatever producing it raised.  Once the producers have all
+        stopped and there's nothing left, raises the first error they hit,
+        or returns None if none did.
+
+        :stats: the calling worker's WorkerMetrics, charged with the time
+                spent waiting.
+        :should_stop: callable.  Checked while waiting; if it returns true,
+                      get() gives up and returns None.
+        """
+        try:
+            item = self._queue.get_nowait()
+        except queue.Empty:
+            waited = time.time()
+            try:
+                while True:
+                    # checked before the queue, so whatever the last
+                    # producer put there is still taken
+                    exhausted = self._exhausted.is_set()
+                    try:
+                        item = self._queue.get(timeout=0.05)
+                        break
+                    except queue.Empty:
+                        if exhausted:
+                            if self._error is not None:
+                                raise self._error
+                            return None
+                        if should_stop():
+                            return None
+            finally:
+                stats.gen_wait += time.time() - waited
+        if isinstance(item, Exception):
+            raise item
+        stats.gen_taken += 1
+        return item
+
+    def close(self):
+        """Stop the producers, and drop whatever they'd made."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                return
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the ConnectionPrefetcher, which opens a worker's next SMTP
+connections in the background so the handshake doesn't hold up sending.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import smtplib
+import threading
+
+try:
+    import queue
+except ImportError:
+    # py2
+    import Queue as queue
+
+import logger
+
+LOG = logger.get_logger('sender')
+
+
+class ConnectionPrefetcher(object):
+    """
+    Keeps up to `lookahead` connections open or opening for one worker.
+
+    Background threads open connections with the given function (which
+    does the whole handshake: connect, EHLO, STARTTLS, AUTH), as many at
+    once as there are free slots, and quit the connections the worker is
+    done with.  A slot is taken when a connection starts opening, and
+    given back when the worker takes it, so there are never more than
+    `lookahead` waiting or in progress.  The worker just calls get() for
+    its next connection and retire() for its last one, so in con_per mode
+    it only waits on the network when `lookahead` handshakes take longer
+    than sending that many emails.
+
+    If opening a connection fails, the error takes that connection's place
+    and is raised to the worker when it calls get(), just as if it had
+    tried to connect itself.  The background threads carry on opening
+    connections, so a worker that tries again gets the next one.
+    """
+
+    def __init__(self, connect, lookahead, name="ConnectionPrefetcher"):
+        """
+        Instantiate the ConnectionPrefetcher, and start opening
+        connections.
+
+        :connect: callable returning a connected, ready smtplib.SMTP.
+        :lookahead: int.  Most connections to have waiting or opening.
+        :name: str.  Prefix for the background threads' names.
+        """
+        lookahead = max(int(lookahead), 1)
+        self._connect = connect
+        self._slots = threading.Semaphore(lookahead)
+        self._ready = queue.Queue()
+        self._retired = queue.Queue()
+        self._stop = threading.Event()
+
+        self._threads = [threading.Thread(target=self._run,
+                                          name="{}-{}".format(name, n))
+                         for n in range(lookahead)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def _quit_retired(self):
+        """Quit every connection the worker has finished with."""
+        while True:
+            try:
+                server = self._retired.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                server.quit()
+            except (smtplib.SMTPException, OSError):
+                # it's done with either way
+                pass
+
+    def _run(self):
+        """Body of each background thread."""
+        while not self._stop.is_set():
+            self._quit_retired()
+            # wait for a free slot, but keep quitting retired connections,
+            # and give up if told to stop
+            if not self._slots.acquire(timeout=0.05):
+                continue
+            if self._stop.is_set():
+                return
+
+            try:
+                item = self._connect()
+            except Exception as exc:  # pylint: disable=W0703
+                # handed on to the worker, who deals with it
+                LOG.debug("prefetch failed",
+                          thread=threading.current_thread().name,
+                          error=repr(exc))
+                item = exc
+            self._ready.put(item)
+
+    def get(self):
+        """Return the next ready connection, waiting if there isn't one
+        yet.  Raises whatever opening it raised."""
+        item = self._ready.get()
+        self._slots.release()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def retire(self, server):
+        """Hand over a connection the worker is done with, to be quit in
+        the background."""
+        self._retired.put(server)
+
+    def close(self):
+        """Stop opening connections, and quit every one left over."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        while True:
+            try:
+                item = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            if not isinstance(item, Exception):
+                self._retired.put(item)
+        self._quit_retired()
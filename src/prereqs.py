@@ -11,6 +11,15 @@ import sys
 import json
 import smtplib
 import os
+import re
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    # py2
+    import Queue as queue
 
 if sys.version_info.major == 3:
     # use xrange if python 2 to speed things up
@@ -29,42 +38,139 @@ else:
     raise RuntimeError("This code is not designed to be run outside of Python"
                        " 2 or 3!  Contact developer to fix this issue.")
 
-try:
-    with open("settings.json", 'r') as config:
-        CONFIG = json.load(config)
-except FILE_NOT_FOUND:
-    sys.stderr.write("Couldn't find config file [settings.json]!")
-    sys.exit(0)
+# the config files are only read and parsed the first time something asks
+# for them, through load_config(), catch_exc(), gui_doc() and
+# validation_regex(), and then kept
+_CACHE = {}
+
+
+class NeverGonnaHappenException(Exception):
+    """Caught instead of Exception in debug mode, which is to say never."""
+    pass
+
+
+def load_config():
+    """Return the parsed settings.json."""
+    try:
+        return _CACHE['config']
+    except KeyError:
+        pass
+
+    try:
+        with open("settings.json", 'r') as config:
+            loaded = json.load(config)
+    except FILE_NOT_FOUND:
+        sys.stderr.write("Couldn't find config file [settings.json]!")
+        sys.exit(0)
+
+    # We need to join the message on newlines because it's stored in JSON
+    # as an array of strings
+    loaded['contents']['text'] = '\n'.join(loaded['contents']['text'])
+    _CACHE['config'] = loaded
+    return loaded
+
 
+def catch_exc():
+    """The exception class that should be caught and shown to the user,
+    rather than left to fall with a full traceback."""
+    if load_config()['settings']['debug']:
+        # we don't want to catch exceptions here -- let them fall, and get
+        # a full & proper traceback
+        return NeverGonnaHappenException
+    return Exception
 
-# We need to join the message on newlines because it's stored in JSON
-# as an array of strings
-CONFIG['contents']['text'] = '\n'.join(CONFIG['contents']['text'])
 
-MAX_RESP_LEN = max([len(CONFIG['SMTP_resp_codes'][i]) for i in
-                    CONFIG['SMTP_resp_codes']])
+def _read_template_file(filename):
+    """Read one of the files the program can't do without."""
+    try:
+        with open(filename, 'r') as template:
+            return template.readlines()
+    except FILE_NOT_FOUND as exc:
+        print("Couldn't find necessary template file" +
+              " [{}]".format(exc.filename), file=sys.stderr)
+        sys.exit(0)
 
 
-if CONFIG['settings']['debug']:
-    # we don't want to catch exceptions here -- let them fall, and get
-    # a full & proper traceback
-    class NeverGonnaHappenException(Exception):
+def gui_doc():
+    """Return the in-program help text, filled in from the config."""
+    try:
+        return _CACHE['gui_doc']
+    except KeyError:
         pass
-    CATCH_EXC = NeverGonnaHappenException
-else:
-    CATCH_EXC = Exception
+
+    config = load_config()
+    text = ''.join(_read_template_file("GUI_DOC.template")).format(
+        AMOUNT=config['settings']['amount'],
+        SUBJECT=config['contents']['subject'],
+        FROM=config['contents']['account'],
+        TO=config['contents']['to'],
+        SERVER=config['settings']['server'],
+        TEXT=config['contents']['text'],
+        ATTACH=config['contents']['attach'])
+    _CACHE['gui_doc'] = text
+    return text
+
+
+def validation_regex():
+    """Return the compiled RFC 5322 address regex."""
+    try:
+        return _CACHE['validation_re']
+    except KeyError:
+        pass
+
+    pattern = ''.join(line.strip() for line in
+                      _read_template_file("validation.regex"))
+    _CACHE['validation_re'] = re.compile(pattern)
+    return _CACHE['validation_re']
 
 
 class FakeSTDOUT(object):
     '''Pretend to be sys.stdout, but write everything to a log AND
-    the actual sys.stdout.'''
+    the actual sys.stdout.
+
+    Writes to the log go onto a bounded queue and are written out in
+    batches by a single background thread, so callers never wait on the
+    disk (unless the queue fills up).  In realtime mode the log file is
+    flushed after every batch instead of only when buffers fill.'''
+
+    # put on the queue to make the writer thread exit
+    _STOP = object()
+    # most writes to gather into one batch
+    _BATCH = 1024
+    # seconds between checks that the writer thread is still there, while
+    # waiting on it
+    _PUT_TIMEOUT = 0.5
 
-    def __init__(self, stream, filename, realtime=False):
+    def __init__(self, stream, filename, realtime=False, max_bytes=0,
+                 rotate_interval=0, backups=3, queue_size=10000):
+        """
+        :stream: the real stream to tee to, e.g. sys.stdout.
+        :filename: str.  Log file to write to.
+        :realtime: bool.  Flush the log after every batch of writes.
+        :max_bytes: int.  Rotate the log once it grows past this many
+                    bytes.  0 to never rotate on size.
+        :rotate_interval: float.  Rotate the log every this many seconds.
+                          0 to never rotate on time.
+        :backups: int.  How many rotated logs to keep around.
+        :queue_size: int.  Most writes that can be waiting at once.
+        """
         self.terminal = stream
-        if not realtime:
-            self.log = open(filename, 'w')
         self._filename = filename
         self.realtime = realtime
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backups = backups
+
+        self.log = open(filename, 'w')
+        self._failing = False
+        self._size = 0
+        self._opened_at = time.time()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name="LogWriter-" + filename)
+        self._writer.daemon = True
+        self._writer.start()
 
         self.is_empty = True
 
@@ -76,33 +182,124 @@ class FakeSTDOUT(object):
         if not logonly:
             self.terminal.write(message)
 
-        if self.realtime:
-            with open(self._filename, 'a') as log:
-                log.write(message)
-        else:
-            self.log.write(message)
+        self._put(message)
 
         self.is_empty = False
 
+    def _put(self, item):
+        """Queue item for the writer thread.  Returns False, dropping the
+        item, if the thread isn't running to take it."""
+        while self._writer.is_alive():
+            try:
+                self._queue.put(item, timeout=self._PUT_TIMEOUT)
+                return True
+            except queue.Full:
+                pass
+        return False
+
     def flush(self):
         '''Impersonate sys.stdout.flush().  Needed for py3 compatibility.'''
         self.terminal.flush()
 
+    def _write_loop(self):
+        """Body of the writer thread.  Takes everything that's waiting on
+        the queue, writes it in one go, and releases anyone waiting on a
+        flush barrier once everything before it is on disk."""
+        while True:
+            batch = []
+            barriers = []
+            stop = False
+            item = self._queue.get()
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    barriers.append(item)
+                else:
+                    batch.append(item)
+                if len(batch) >= self._BATCH:
+                    # leave the rest for the next round, so a size-based
+                    # rotation can't overshoot by too much
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self._write_batch(''.join(batch))
+                if batch and self.realtime or barriers or stop:
+                    self.log.flush()
+            except (IOError, OSError) as exc:
+                # a full disk or a locked file loses this batch, but
+                # mustn't stop the thread: everyone writing would block
+                # once the queue filled up
+                if not self._failing:
+                    self.terminal.write("\nCouldn't write to {}: {}\n"
+                                        .format(self._filename, exc))
+                self._failing = True
+            else:
+                self._failing = False
+            finally:
+                for barrier in barriers:
+                    barrier.set()
+            if stop:
+                return
+
+    def _write_batch(self, data):
+        """Write a chunk to the log, rotating first if it's due."""
+        due = (self.max_bytes and self._size >= self.max_bytes) or \
+            (self.rotate_interval and
+             time.time() - self._opened_at >= self.rotate_interval)
+        if due:
+            self._rotate()
+        if self.log.closed:
+            # a rotation couldn't open the new file; try again
+            self.log = open(self._filename, 'a')
+        self.log.write(data)
+        self._size += len(data)
+
+    def _rotate(self):
+        """Shift filename.1 -> filename.2 etc, move the current log to
+        filename.1, and start a new one."""
+        self.log.close()
+        # if the logs can't be moved, carry on in the current one, and
+        # don't try again until the next rotation is due
+        self._size = 0
+        self._opened_at = time.time()
+        mode = 'a'
+        try:
+            for i in range(self.backups - 1, 0, -1):
+                older = "{}.{}".format(self._filename, i)
+                if os.path.exists(older):
+                    os.replace(older, "{}.{}".format(self._filename, i + 1))
+            if self.backups > 0:
+                os.replace(self._filename, self._filename + ".1")
+            mode = 'w'
+        finally:
+            self.log = open(self._filename, mode)
+
     def dump_logs(self):
-        """Dump log info already obtained, if any."""
+        """Dump log info already obtained, if any.  Blocks until everything
+        written so far is on disk."""
         if not self.is_empty:
-            self.log.close()
-            self.log = open(self._filename, 'a')
+            barrier = threading.Event()
+            if self._put(barrier):
+                while not barrier.wait(self._PUT_TIMEOUT):
+                    if not self._writer.is_alive():
+                        break
 
     def FSO_close(self):
         '''Close the log files.'''
         empty = self.is_empty
         self.write("\n----- ending log file -----\n", True)
         self.is_empty = empty
-        if not self.realtime:
-            self.log.close()
+        self._put(self._STOP)
+        self._writer.join()
+        self.log.close()
 
-        if not self.is_empty and not CONFIG['settings']['debug']:
+        if not self.is_empty and not load_config()['settings']['debug']:
             os.remove(self._filename)
 
         return self.terminal
@@ -124,24 +321,3 @@ class EmergencyStop(Exception):
 POPUP_ERRORS = [smtplib.SMTPAuthenticationError,
                 smtplib.SMTPDataError,
                 EmailSendError]
-
-try:
-    with open("GUI_DOC.template", 'r') as template:
-        GUI_DOC = template.read().format(AMOUNT=CONFIG['settings']['amount'],
-                                         SUBJECT=CONFIG['contents']['subject'],
-                                         FROM=CONFIG['contents']['account'],
-                                         TO=CONFIG['contents']['to'],
-                                         SERVER=CONFIG['settings']['server'],
-                                         TEXT=CONFIG['contents']['text'],
-                                         ATTACH=CONFIG['contents']['attach'])
-
-    with open("validation.regex", 'r') as regexfile:
-        lines = regexfile.readlines()
-        VALIDATION_RE = ''
-        for line in lines:
-            VALIDATION_RE += line.strip()
-
-except FILE_NOT_FOUND as exc:
-    print("Couldn't find necessary template file" +
-          " [{}]".format(exc.filename), file=sys.stderr)
-    sys.exit(0)
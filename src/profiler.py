@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the SamplingProfiler, which finds out where a run's time goes by
+periodically looking at what every thread is doing.
+
+Stacks are written out in the "collapsed" format that flamegraph tools
+(flamegraph.pl, speedscope, inferno...) read: one line per distinct stack,
+root first, frames separated by semicolons, followed by how many samples
+landed in it.  If allocation tracking is on, the top allocation sites are
+also written out as each load profile phase starts, and at the end.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import os
+import re
+import sys
+import threading
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # py2; allocations just aren't tracked
+    tracemalloc = None
+
+import logger
+
+LOG = logger.get_logger('profiler')
+
+# numbered thread names, so all the threads of a kind share one root in the
+# graph: "Thread #12" -> "Thread", "Thread #12-prefetch-0" ->
+# "Thread-prefetch", "Generator-3" -> "Generator"
+_THREAD_NUMBER = re.compile(r'(\s*#|-)\d+(?=-|$)')
+
+
+class SamplingProfiler(object):
+    """
+    Samples the stacks of all threads from a background thread.
+
+    Each sample costs time proportional to the number of threads looked at,
+    so with lots of workers, only max_threads of them (taking turns) are
+    sampled each time.  That keeps the overhead flat however many workers
+    there are, at the price of fewer samples per worker.
+    """
+
+    def __init__(self, output, hz=100, alloc_top=10, max_threads=64,
+                 profile=None):
+        """
+        Instantiate the SamplingProfiler.  Call start() to begin sampling.
+
+        :output: str.  Base filename; stacks go to output + '.collapsed'
+                 and allocations to output + '.alloc.txt'.
+        :hz: float.  Samples per second.
+        :alloc_top: int.  Number of allocation sites to write out at each
+                    phase boundary, or 0 not to track allocations at all.
+                    Tracking allocations slows every allocation in the
+                    program down, sampling doesn't.
+        :max_threads: int.  Most threads to sample each time.
+        :profile: the run's LoadProfile, to tell when phases change.
+        """
+        self.output = output
+        self.interval = 1.0 / hz
+        self.alloc_top = alloc_top
+        self.max_threads = max_threads
+        self.profile = profile
+
+        # tuple of frame labels, root first -> number of samples
+        self.stacks = {}
+        self.samples = 0
+        # seconds spent taking samples, to report the overhead
+        self.busy = 0.0
+
+        # code object -> frame label, so each is only formatted once
+        self._labels = {}
+        self._offset = 0
+        self._phase = None
+        self._started_tracemalloc = False
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name="SamplingProfiler")
+        self._thread.daemon = True
+
+    def _label(self, code):
+        """Return the flamegraph label for a code object."""
+        label = self._labels.get(code)
+        if label is None:
+            label = "{} ({}:{})".format(code.co_name,
+                                        os.path.basename(code.co_filename),
+                                        code.co_firstlineno)
+            # ';' separates frames in the output
+            label = self._labels[code] = label.replace(';', ':')
+        return label
+
+    def sample(self):
+        """Take one sample of the threads' stacks."""
+        frames = sys._current_frames()
+        me = threading.current_thread().ident
+        names = {t.ident: t.name for t in threading.enumerate()}
+
+        idents = [ident for ident in frames if ident != me]
+        if len(idents) > self.max_threads:
+            # take turns, so every thread gets looked at now and then
+            start = self._offset % len(idents)
+            idents = (idents[start:] + idents[:start])[:self.max_threads]
+            self._offset += self.max_threads
+
+        stacks = self.stacks
+        for ident in idents:
+            labels = []
+            frame = frames[ident]
+            while frame is not None:
+                labels.append(self._label(frame.f_code))
+                frame = frame.f_back
+            labels.append(_THREAD_NUMBER.sub('', names.get(ident, 'thread')))
+            labels.reverse()
+            key = tuple(labels)
+            stacks[key] = stacks.get(key, 0) + 1
+        self.samples += 1
+
+    def mark_phase(self, label):
+        """Write out the top allocation sites, under a heading."""
+        if not self.alloc_top or tracemalloc is None or \
+                not tracemalloc.is_tracing():
+            return
+        stats = tracemalloc.take_snapshot().statistics('lineno')
+        with open(self.output + '.alloc.txt', 'a') as out:
+            out.write("===== {} at {} =====\n".format(
+                label, time.strftime("%H:%M:%S")))
+            for stat in stats[:self.alloc_top]:
+                out.write(str(stat) + '\n')
+            out.write('\n')
+
+    def _check_phase(self):
+        """Call mark_phase if the load profile has moved to a new phase."""
+        if self.profile is None or self.profile.start_time is None:
+            return
+        phase = self.profile.phase_at(time.time() - self.profile.start_time)
+        if phase != self._phase:
+            self.mark_phase("phase {}".format(phase))
+            self._phase = phase
+
+    def _run(self):
+        """Sample until stopped."""
+        while not self._stop.wait(self.interval):
+            began = time.time()
+            self.sample()
+            self._check_phase()
+            self.busy += time.time() - began
+
+    def start(self):
+        """Start tracking allocations, if asked to, and start sampling."""
+        if os.path.exists(self.output + '.alloc.txt'):
+            os.remove(self.output + '.alloc.txt')
+        if self.alloc_top and tracemalloc is not None and \
+                not tracemalloc.is_tracing():
+            # one frame per allocation keeps tracemalloc's own cost down
+            tracemalloc.start(1)
+            self._started_tracemalloc = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling, and write out the stacks."""
+        self._stop.set()
+        self._thread.join()
+        self.mark_phase("end")
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        with open(self.output + '.collapsed', 'w') as out:
+            for stack, count in sorted(self.stacks.items()):
+                out.write("{} {}\n".format(';'.join(stack), count))
+
+        LOG.info("profile written", output=self.output,
+                 samples=self.samples, busy=round(self.busy, 3))
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the RecipientSource class, which hands out the envelope recipients
+(RCPT TO addresses) for each SMTP transaction a worker makes.
+"""
+
+import csv
+import itertools
+
+
+class RecipientSource(object):
+    """
+    Yields lists of recipient addresses, one list per SMTP transaction.
+
+    If a recipient file is configured, addresses are streamed out of it one
+    line at a time (blank lines and lines starting with '#' are skipped) and
+    never held in memory all at once.  The file is sharded between workers
+    by line: worker i of n takes every address whose position in the file
+    is i modulo n, so no two workers send to the same mailbox in the same
+    pass.  When a worker runs off the end of the file, it starts over from
+    the top.
+
+    Without a recipient file, every transaction goes to the comma-separated
+    addresses in the 'to' field.
+    """
+
+    def __init__(self, coordinator, shard=0, n_shards=1):
+        """
+        Instantiate the RecipientSource.
+
+        :coordinator: Must be a Coordinator object.
+        :shard: int.  Index of the worker this source belongs to.
+        :n_shards: int.  Total number of workers the file is split between.
+        """
+        self.coordinator = coordinator
+        self.filename = coordinator.settings['rcpt_source']
+        self.batch_size = max(int(coordinator.settings['rcpt_per_txn']), 1)
+        self.shard = shard
+        self.n_shards = max(n_shards, 1)
+
+        self._batches = self._iter_batches()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._batches)
+
+    next = __next__  # py2
+
+    def _iter_file(self, shard, n_shards):
+        """Yield one pass worth of addresses from this shard of the file."""
+        with open(self.filename, 'r') as rcptfile:
+            position = 0
+            for line in rcptfile:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                if position % n_shards == shard:
+                    yield line
+                position += 1
+
+    def _iter_addresses(self):
+        """Yield addresses forever, wrapping around the file as needed."""
+        shard, n_shards = self.shard, self.n_shards
+        while True:
+            found = False
+            for address in self._iter_file(shard, n_shards):
+                found = True
+                yield address
+            if not found:
+                if n_shards == 1:
+                    raise ValueError("Recipient file {} contains no "
+                                     "addresses".format(self.filename))
+                # more workers than recipients.  rather than leave this
+                # worker idle, let it use the whole list.
+                shard, n_shards = 0, 1
+
+    def _iter_batches(self):
+        """Group the addresses into lists for each transaction."""
+        if not self.filename:
+            # the whole 'to' field goes out as one transaction, every time
+            to = [a.strip() for a in
+                  self.coordinator.contents['to'].split(',') if a.strip()]
+            while True:
+                yield to
+
+        addresses = self._iter_addresses()
+        while True:
+            yield list(itertools.islice(addresses, self.batch_size))
+
+
+def merge_rcpt_results(into, other):
+    """Merge one per-recipient result dictionary into another.  Each maps
+    address -> [n_accepted, n_refused, last_code, last_message]."""
+    for address, result in other.items():
+        mine = into.get(address)
+        if mine is None:
+            into[address] = list(result)
+        else:
+            mine[0] += result[0]
+            mine[1] += result[1]
+            mine[2], mine[3] = result[2], result[3]
+    return into
+
+
+def write_rcpt_report(filename, results):
+    """Write per-recipient acceptance results as CSV."""
+    with open(filename, 'w') as report:
+        writer = csv.writer(report)
+        writer.writerow(('address', 'accepted', 'refused', 'last_code',
+                         'last_message'))
+        for address, (acc, ref, code, msg) in results.items():
+            writer.writerow((address, acc, ref, code, msg))
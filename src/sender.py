@@ -9,9 +9,35 @@ number of worker threads.
 import threading
 import smtplib
 import time
-import sys
+
+try:
+    import resource
+except ImportError:
+    # not on windows; the connection ceiling then can't follow the fd limit
+    resource = None
 
 from prereqs import EmergencyStop
+from corpus import Corpus, CorpusSource
+from eventlog import EventLog
+from loadprofile import LoadProfile
+from pipeline import MessagePipeline
+from prefetch import ConnectionPrefetcher
+from profiler import SamplingProfiler
+from smtpwire import LeanClient, WireBody
+from metrics import SendMetrics, IDLE, CONNECTING, SENDING, RETRYING, \
+    DONE
+from recipients import RecipientSource, merge_rcpt_results, \
+    write_rcpt_report
+import logger
+
+LOG = logger.get_logger('sender')
+SMTP_LOG = logger.get_logger('smtp')
+
+# ceiling on connections in unlimited mode when max_connections is 0
+AUTO_MAX_CONNECTIONS = 1024
+# file descriptors left over for logs, attachments etc. when the ceiling is
+# worked out from the process' fd limit
+FD_HEADROOM = 64
 
 
 class EmailSendHandler(threading.Thread):
@@ -32,30 +58,114 @@ class EmailSendHandler(threading.Thread):
         self.coordinator = coordinator
 
         self.worker_amounts = []
-        self.worker_bars = []
-        self.worker_vars = []
         self.workers = []
-
-        self._bar_lock = threading.Lock()
+        # first virtual worker id of each worker, see virtual_id()
+        self.virtual_bases = None
+
+        # address -> [n_accepted, n_refused, last_code, last_message],
+        # merged in from each worker as it is collected
+        self.rcpt_results = {}
+
+        # built from the settings when the run starts
+        self.profile = None
+        self.event_log = None
+        self.profiler = None
+        self.history = None
+        # the Corpus being replayed, if any, and the MessagePipeline
+        # preparing its messages, if it has one
+        self.corpus = None
+        self.pipeline = None
+        # SendMetrics for the run.  The GUI polls snapshots of it; the
+        # workers never talk to the GUI directly.
+        self.metrics = None
+
+        # (body type, utf8) -> (WireBody, MAIL FROM options, bytes saved),
+        # for the lean SMTP path.  shared by every worker
+        self._wire_bodies = {}
+        self._wire_lock = threading.Lock()
+        # whether the last lean connection made sends with BDAT; None until
+        # one is made.  Only a hint for prepare_message
+        self.lean_chunked = None
 
         self.is_done = self.do_abort = False
 
+    @property
+    def time_bounded(self):
+        """Whether this run ends on time rather than on amount sent."""
+        return self.profile is not None and self.profile.time_bounded
+
+    def times_sends(self):
+        """Whether workers time every send, which they only do when
+        something reads the latencies: the GUI's metrics, the event log,
+        the metrics exporter or the run history."""
+        settings = self.coordinator.settings
+        return bool(settings['metrics'] or settings['metrics_port'] or
+                    settings['history_db'] or self.event_log is not None)
+
+    def prefetch_lookahead(self):
+        """How many connections each worker opens ahead of time; 0 if it
+        doesn't."""
+        settings = self.coordinator.settings
+        if settings['con_mode'] not in ('con_per', 'con_some'):
+            return 0
+        return max(settings['con_prefetch'], 0)
+
+    def connection_ceiling(self):
+        """
+        The most connections unlimited mode may use.  Each worker holds at
+        most one connection at a time, plus prefetch_lookahead() opening
+        ahead of time (each on a thread of its own), so this also bounds
+        the number of sockets and thread stacks.
+
+        max_connections in the settings, if not 0; otherwise as many as the
+        process' file descriptor limit allows, up to AUTO_MAX_CONNECTIONS.
+        """
+        ceiling = self.coordinator.settings['max_connections']
+        if ceiling:
+            return ceiling
+
+        ceiling = AUTO_MAX_CONNECTIONS
+        if resource is not None:
+            soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+            if soft != resource.RLIM_INFINITY:
+                ceiling = min(ceiling, max(soft - FD_HEADROOM, 1))
+        return ceiling
+
     def create_worker_configurations(self):
         """
         Creates the list of number of emails per thread for each thread using
         the specified threading settings.
+
+        For a time-bounded run, every thread's amount is None, meaning it
+        sends until the load profile says the run is over.
+
+        Unlimited mode is one virtual worker per email, run on a pool of
+        threads that together open at most connection_ceiling()
+        connections.
         """
 
+        self.virtual_bases = None
+
         if self.coordinator.settings['mt_mode'] == 'none':
             num_threads = 1
         elif self.coordinator.settings['mt_mode'] == 'limited':
             num_threads = self.coordinator.settings['mt_num']
         elif self.coordinator.settings['mt_mode'] == 'unlimited':
             num_threads = self.coordinator.settings['amount']
+            if self.time_bounded:
+                num_threads = self.profile.max_concurrency or num_threads
+            # leave room for every worker's prefetched connections
+            num_threads = min(num_threads, max(
+                self.connection_ceiling() //
+                (1 + self.prefetch_lookahead()), 1))
         else:
             assert False, "got mt_mode = " + \
                           self.coordinator.settings['mt_mode']
 
+        if self.time_bounded:
+            self.worker_amounts = [None] * num_threads
+            return
+
         emails_per_thread = self.coordinator.settings['amount'] // num_threads
 
         # split the load evenly among all threads
@@ -79,9 +189,16 @@ class EmailSendHandler(threading.Thread):
             for i in range(n_increases):
                 self.worker_amounts[i] = self.worker_amounts[i] + 1
 
-        if self.coordinator.settings['debug']:
-            print("emailsendhandler.create_worker_configurations: done: " +
-                  repr(self.worker_amounts))
+        if self.coordinator.settings['mt_mode'] == 'unlimited':
+            # worker i sends the emails of virtual workers
+            # virtual_bases[i] up to virtual_bases[i] + worker_amounts[i]
+            self.virtual_bases = []
+            base = 0
+            for amount in self.worker_amounts:
+                self.virtual_bases.append(base)
+                base += amount
+
+        LOG.debug("worker configurations done", amounts=self.worker_amounts)
 
     def get_amount(self, worker_index):
         """
@@ -90,12 +207,21 @@ class EmailSendHandler(threading.Thread):
         """
         return self.worker_amounts[worker_index]
 
+    def virtual_id(self, worker_index, n_sent):
+        """
+        The id to report the n_sent'th email of a worker under.  In
+        unlimited mode, every email has its own virtual worker, as if it had
+        its own thread; otherwise it's just the worker's index.
+        """
+        if self.virtual_bases is None:
+            return worker_index
+        return self.virtual_bases[worker_index] + n_sent
+
     def spawn_worker_threads(self):
         """
         Create the required number of worker threads.
         """
-        if self.coordinator.settings['debug']:
-            print("emailsendhandler.spawn_worker_threads: creating work pool")
+        LOG.debug("creating work pool")
         for i in range(len(self.worker_amounts)):
             worker = EmailSender(self, i)
 
@@ -106,27 +232,124 @@ class EmailSendHandler(threading.Thread):
             self.workers.append(worker)
 
     def start_workers(self):
-        """Start all the worker threads sending emails."""
+        """Start all the worker threads sending emails.  If configured,
+        wait a little between each start so the server doesn't get hit by
+        all the connections at once."""
+
+        LOG.debug("sending start command to pool")
+        stagger = self.coordinator.settings['stagger_start']
+        stack_size = self.coordinator.settings['worker_stack_size']
+        if stack_size:
+            # only affects threads started from here on, so it's put back
+            # once the workers are all going
+            try:
+                old_stack_size = threading.stack_size(stack_size)
+            except (ValueError, RuntimeError) as exc:
+                LOG.warning("can't set worker stack size", size=stack_size,
+                            error=str(exc))
+                stack_size = 0
 
-        if self.coordinator.settings['debug']:
-            print("emailsendhandler.start_workers: "
-                  "sending start command to pool")
-        for worker in self.workers:
-            worker.start()
+        self.profile.begin()
+        try:
+            for worker in self.workers:
+                if self.do_abort:
+                    break
+                worker.start()
+                if stagger:
+                    time.sleep(stagger)
+        finally:
+            if stack_size:
+                threading.stack_size(old_stack_size)
 
-    def init_metrics(self):
+    def wait_turn(self, worker):
+        """Block a worker until the load profile lets it send again.
+        Returns False when a time-bounded run is over."""
+        return self.profile.wait_turn(worker.worker_index,
+                                      lambda: self.do_abort)
+
+    def wire_body(self, body_type, utf8):
+        """
+        Return the message encoded for a server that takes body_type
+        ('7bit', '8bit' or 'binary') and maybe SMTPUTF8, as a tuple of
+        (WireBody, MAIL FROM options, bytes saved over 7bit).  Each is only
+        built once per run, by whichever worker first needs it.
         """
-        Set up the coordinator object's metrics.
+        key = (body_type, utf8)
+        with self._wire_lock:
+            cached = self._wire_bodies.get(key)
+            if cached is not None:
+                return cached
+
+            email = self.coordinator.email
+            data = email.as_wire(body_type, utf8)
+            options = b''
+            if body_type == '8bit':
+                options += b' BODY=8BITMIME'
+            elif body_type == 'binary':
+                options += b' BODY=BINARYMIME'
+            headers = data[:data.find(b'\r\n\r\n')]
+            if utf8 and any(byte > 127 for byte in headers):
+                options += b' SMTPUTF8'
+            saved = len(email.as_wire()) - len(data)
+
+            cached = self._wire_bodies[key] = (WireBody(data, canonical=True),
+                                               options, saved)
+            return cached
+
+    def prepare_message(self, message):
         """
+        Get a corpus message ready to send.  Returns a tuple of (WireBody,
+        whether it has 8-bit bytes).  On the lean path, the dot-stuffed
+        body for DATA is worked out here too, unless servers are taking
+        BDAT.
 
-        self.coordinator.metrics['sending-rate'] = 1
-        self.coordinator.metrics['sending-time'] = 1
-        self.coordinator.metrics['remaining'] = \
+        :message: bytes or memoryview, from a CorpusSource.
+        """
+        body = WireBody(message)
+        if not self.coordinator.settings['lean_smtp']:
+            return body, False
+        if not self.lean_chunked:
+            # worked out now, on whichever thread is preparing the message
+            body.stuffed  # pylint: disable=W0104
+        return body, body.eight_bit()
+
+    def start_pipeline(self):
+        """
+        Start the MessagePipeline preparing corpus messages for the
+        workers, with gen_threads producers.  The corpus is sharded between
+        the producers as it otherwise would be between the workers.
+        """
+        settings = self.coordinator.settings
+        n_producers = settings['gen_threads']
+        sources = [(self.prepare_message(message)
+                    for message in CorpusSource(self.corpus,
+                                                settings['corpus_order'], i,
+                                                n_producers,
+                                                settings['corpus_seed']))
+                   for i in range(n_producers)]
+        self.pipeline = MessagePipeline(sources, settings['gen_queue_size'],
+                                        name="Generator")
+        self.metrics.producers = self.pipeline.producers
+
+    def stop_pipeline(self):
+        """Stop the MessagePipeline, and log which side of it waited."""
+        self.pipeline.close()
+        snapshot = self.metrics.snapshot()
+        LOG.info("generation pipeline done",
+                 produced=sum(p.produced for p in self.pipeline.producers),
+                 workers_waited=round(snapshot.gen_wait, 3),
+                 producers_waited=round(snapshot.gen_blocked, 3))
+        self.pipeline = None
+
+    def init_metrics(self):
+        """
+        Set up the metrics for this run.  The worker configurations must
+        have been created already.
+        """
+        amount = None if self.time_bounded else \
             self.coordinator.settings['amount']
-        self.coordinator.metrics['sent'] = 0
-        self.coordinator.metrics['etr'] = 0
-        self.coordinator.metrics['etc'] = time.time()
-        self.coordinator.metrics['no-active-connections'] = 0
+        self.metrics = SendMetrics(len(self.worker_amounts), amount,
+                                   self.profile)
 
     def run(self):
         """
@@ -134,25 +357,75 @@ class EmailSendHandler(threading.Thread):
         Automatically generates sending distribution, worker threads, and
         runs the workers.
         """
-        self.init_metrics()
+        self.profile = LoadProfile.from_settings(self.coordinator.settings)
         self.create_worker_configurations()
-        if self.coordinator.settings['metrics']:
-            self.worker_bars, self.worker_vars = \
-                self.coordinator.gui.add_n_progress_bars(len(
-                    self.worker_amounts))
+        self.init_metrics()
+        if self.coordinator.settings['event_log']:
+            self.event_log = EventLog(
+                self.coordinator.settings['event_log'],
+                len(self.worker_amounts),
+                compress=self.coordinator.settings['event_log_compress'],
+                sample=self.coordinator.settings['event_log_sample'])
+        settings = self.coordinator.settings
+        if settings['corpus_source']:
+            self.corpus = Corpus(settings['corpus_source'])
+            if settings['gen_threads'] > 0:
+                self.start_pipeline()
+        elif settings['gen_threads'] > 0:
+            LOG.info("gen_threads only applies to corpus replay; ignored")
         self.spawn_worker_threads()
+        if settings['profiler']:
+            self.profiler = SamplingProfiler(
+                settings['profiler_output'], hz=settings['profiler_hz'],
+                alloc_top=settings['profiler_alloc_top'],
+                profile=self.profile)
+            self.profiler.start()
+        if settings['history_db']:
+            # sqlite3 is only imported when there's history to keep
+            from history import RunRecorder
+            self.history = RunRecorder(settings['history_db'], self.metrics,
+                                       settings['history_interval'])
         self.start_workers()
 
-        while not self.is_done:
-            for worker in self.workers:
-                if worker.is_done:
-                    if self.coordinator.settings['debug']:
-                        print("thread manager collecting " + worker.name)
-                    worker.join()
-                    self.workers.remove(worker)
+        # join rather than poll is_done, so we don't spin a core that the
+        # workers could be using
+        for worker in self.workers:
+            worker.join()
+            LOG.debug("collected worker", name=worker.name)
+            merge_rcpt_results(self.rcpt_results, worker.rcpt_results)
+
+        if self.event_log is not None:
+            self.event_log.close()
+        if self.profiler is not None:
+            self.profiler.stop()
+        if self.pipeline is not None:
+            self.stop_pipeline()
+        if self.corpus is not None:
+            self.corpus.close()
+
+        self.report_rcpt_results()
+
+        self.metrics.finish()
+        if self.history is not None:
+            self.history.finish(settings, self.coordinator.contents)
+        self.is_done = True
+
+    def report_rcpt_results(self):
+        """
+        Summarize the per-recipient acceptance results, and write them out
+        to the configured report file, if any.
+        """
+        if not self.coordinator.settings['rcpt_source']:
+            return
 
-            if not self.workers:
-                self.is_done = True
+        accepted = sum(r[0] for r in self.rcpt_results.values())
+        refused = sum(r[1] for r in self.rcpt_results.values())
+        LOG.info("recipient results", accepted=accepted, refused=refused,
+                 addresses=len(self.rcpt_results))
+
+        if self.coordinator.settings['rcpt_report']:
+            write_rcpt_report(self.coordinator.settings['rcpt_report'],
+                              self.rcpt_results)
 
     def abort(self):
         """
@@ -165,65 +438,6 @@ class EmailSendHandler(threading.Thread):
         for worker in self.workers:
             worker.do_abort = True
 
-    def callback_sent(self, worker):
-        """
-        Takes action when each email is sent.  Mainly reports upwards to
-        the coordinator for updating progress information.
-        """
-
-        self._bar_lock.acquire()
-
-        if self.coordinator.settings['debug']:
-            print("emailsendhandler received notification of a sent email")
-
-        self.coordinator.callback_sent()
-
-        if self.coordinator.settings['debug']:
-            print("emailsendhandler pushed pbar update")
-
-        self.coordinator.metrics['sent'] += 1
-
-        if self.coordinator.settings['metrics']:
-
-            self.coordinator.metrics['remaining'] -= 1
-
-            # we have to average all the thread's sending-time average here..
-            # costly operation, but benefits to ux outweigh the detriments
-            # maybe investigate a toggle switch for metrics?
-            avgs = []
-            for worker in self.workers:
-                avgs.append(worker._sending_time)
-            avg = sum(avgs) / len(avgs)
-
-            # now compute the sending rate from the time.
-            # inversely proportional
-            rate = 1 / avg
-
-            self.coordinator.metrics['sending-time'] = avg
-            self.coordinator.metrics['sending-rate'] = rate
-
-            # est. time remaining
-            # can be computed by remaining / rate
-            self.coordinator.metrics['etr'] = \
-                self.coordinator.metrics['remaining'] / rate
-
-            # est. time completion
-            # computed by adding time.time() to etr
-            self.coordinator.metrics['etc'] = \
-                self.coordinator.metrics['etr'] + time.time()
-
-            self.coordinator.gui.pull_metrics_from_coordinator()
-
-        if self.coordinator.metrics['sent'] == \
-           self.coordinator.settings['amount']:
-            self.is_done = True
-            self.coordinator.gui.root.bell()
-
-        if self.coordinator.settings['debug']:
-            print("emailsendhandler notification actions complete")
-
-        self._bar_lock.release()
-
     def pre_delete_actions(self):
         """Actions to take before being discarded."""
         if not self.is_done:
@@ -254,39 +468,76 @@ class EmailSender(threading.Thread):
 
         self.worker_index = worker_index
         self.amount = self.handler.get_amount(self.worker_index)
-        if self.handler.coordinator.settings['metrics']:
-            self.bar = self.handler.worker_bars[self.worker_index]
-            self.var = self.handler.worker_vars[self.worker_index]
+        self.stats = self.handler.metrics.workers[self.worker_index]
+
+        self.recipients = RecipientSource(self.handler.coordinator,
+                                          self.worker_index,
+                                          len(self.handler.worker_amounts))
+        self.rcpt_results = {}
+
+        # real messages to send instead of the built one, if replaying a
+        # corpus without a pipeline
+        self.corpus = None
+        if self.handler.corpus is not None and \
+                self.handler.pipeline is None:
+            settings = self.handler.coordinator.settings
+            self.corpus = CorpusSource(self.handler.corpus,
+                                       settings['corpus_order'],
+                                       self.worker_index,
+                                       len(self.handler.worker_amounts),
+                                       settings['corpus_seed'])
 
         self.is_done = False
-        self.last_delta = 0
-        self._n_sent = 0
-        self._sending_time = 0
-
+        # opens connections ahead of time in con_per and con_some modes;
+        # set up in run()
+        self.prefetcher = None
+        # seconds spent on the last connection handshake, not yet charged
+        # to a message in the event log
+        self._connect_time = 0
+        self._connected_before = False
+
+        # render once up front instead of on every send
         self.message = self.handler.coordinator.email.getmime()
+        self.payload = self.handler.coordinator.email.as_string()
+        # with lean_smtp, the client for the current connection, and what
+        # the handler's wire_body gave for it
+        self.lean = self.handler.coordinator.settings['lean_smtp']
+        self._lean = None
+        self._wire = None
+        # bytes of the message being sent, as it goes on the wire
+        self.size = len(self.payload)
+
+    def _open_connection(self, retries_left=None, report=True):
+        """Connect to the server specified in the handler's settings
+        dictionary and get through the handshake.  Returns an smtplib.SMTP
+        object.
 
-    def establish_connection(self, retries_left=None):
-        """Establish a connection to the server specified in
-        the handler's settings dictionary.  Returns an smtplib.SMTP object."""
-
-        if self.handler.coordinator.settings['metrics']:
-            prevar = self.var.get()
-            self.bar.config(mode='indeterminate')
-            self.bar.start(interval=200)
+        :retries_left: Internal recursive use only.
+        :report: bool.  Whether to show retries in the worker's state; off
+                 when connecting from the prefetcher's thread.
+        """
 
-        retries = retries_left or self.handler.coordinator.settings[
-            'retry_establish']
+        retries = retries_left if retries_left is not None else \
+            self.handler.coordinator.settings['retry_establish']
 
         try:
             server = smtplib.SMTP(self.handler.coordinator.settings['server'],
                                   timeout=self.handler.coordinator.settings[
                                       'connection_timeout'])
         except ConnectionRefusedError:
+            self.stats.conn_errors += 1
             if retries != 0:
+                if report:
+                    self.stats.state = RETRYING
                 if self.handler.coordinator.settings['wait_on_retry']:
                     time.sleep(self.handler.coordinator.settings[
                         'wait_dur_on_retry'])
-                return self.establish_connection(retries - 1)
+                return self._open_connection(retries - 1, report)
+            raise
+        except (OSError, smtplib.SMTPException):
+            # timed out, unreachable, or turned away in the greeting
+            self.stats.conn_errors += 1
+            raise
 
         server.ehlo_or_helo_if_needed()
 
@@ -300,18 +551,144 @@ class EmailSender(threading.Thread):
             server.login(self.handler.coordinator.contents['account'],
                          self.handler.coordinator.contents['password'])
 
-        if self.handler.coordinator.settings['debug']:
+        # only when printing at debug level, not just keeping the ring
+        if SMTP_LOG.level <= logger.DEBUG:
             server.set_debuglevel(1)
 
-        self.handler.coordinator.metrics['no-active-connections'] += 1
+        return server
+
+    def establish_connection(self):
+        """Get a connection to the server, either by connecting now or from
+        the prefetcher.  Returns an smtplib.SMTP object."""
 
-        if self.handler.coordinator.settings['metrics']:
-            self.bar.stop()
-            self.bar.config(mode='determinate')
-            self.var.set(prevar)
+        connect_start = time.time()
+        self.stats.state = CONNECTING
+
+        if self.prefetcher is not None:
+            server = self.prefetcher.get()
+        else:
+            server = self._open_connection()
+
+        if self._connected_before:
+            self.stats.reconnects += 1
+        self._connected_before = True
+        self.stats.connections += 1
+        # with prefetching, this is only the time spent waiting for one
+        self._connect_time += time.time() - connect_start
+        self.stats.state = IDLE
 
         return server
 
+    def close_connection(self, server):
+        """Finish with a connection mid-run.  With prefetching it's quit in
+        the background rather than waited on."""
+        self.stats.connections -= 1
+        if self.prefetcher is not None:
+            self.prefetcher.retire(server)
+        else:
+            server.quit()
+
+    def deliver(self, server, rcpts):
+        """Send the message to rcpts over server.  Returns the refused
+        recipients, and raises, just like smtplib.SMTP.sendmail."""
+        if self.handler.corpus is not None:
+            return self.deliver_corpus(server, rcpts)
+
+        if not self.lean:
+            refused = server.sendmail(self.message['from'], rcpts,
+                                      self.payload)
+            self.stats.record_bytes(self.size)
+            return refused
+
+        if self._lean is None or self._lean.server is not server:
+            settings = self.handler.coordinator.settings
+            self._lean = LeanClient(server, settings['bdat_chunk_size'])
+            if settings['negotiate_mime']:
+                self._wire = self.handler.wire_body(self._lean.body_type,
+                                                    self._lean.utf8)
+            else:
+                self._wire = self.handler.wire_body('7bit', False)
+        body, options, saved = self._wire
+
+        block = b'X-Emailer-Id: %d\r\n' % self.handler.virtual_id(
+            self.worker_index, self.stats.sent)
+        self.size = len(block) + len(body)
+        refused = self._lean.sendmail(self.message['from'], rcpts, body,
+                                      block, options)
+        self.stats.record_bytes(self.size, saved)
+        return refused
+
+    def deliver_corpus(self, server, rcpts):
+        """Send the next message from the corpus to rcpts over server, as
+        deliver() does.  Only the envelope is ours: MAIL FROM is the From
+        field and RCPT TO our recipients, whatever the message's headers
+        say."""
+        if self.handler.pipeline is None:
+            body, eight_bit = self.handler.prepare_message(next(self.corpus))
+        else:
+            item = self.handler.pipeline.get(self.stats,
+                                             lambda: self.handler.do_abort)
+            if item is None:
+                raise EmergencyStop("Aborting")
+            body, eight_bit = item
+        self.size = len(body)
+
+        if not self.lean:
+            refused = server.sendmail(self.message['from'], rcpts, body.data)
+            self.stats.record_bytes(self.size)
+            return refused
+
+        if self._lean is None or self._lean.server is not server:
+            self._lean = LeanClient(
+                server, self.handler.coordinator.settings['bdat_chunk_size'])
+            self.handler.lean_chunked = self._lean.chunk_size > 0
+        options = b''
+        if self._lean.body_type != '7bit' and eight_bit:
+            options = b' BODY=8BITMIME'
+
+        block = b'X-Emailer-Id: %d\r\n' % self.handler.virtual_id(
+            self.worker_index, self.stats.sent)
+        self.size += len(block)
+        refused = self._lean.sendmail(self.message['from'], rcpts, body,
+                                      block, options)
+        self.stats.record_bytes(self.size)
+        return refused
+
+    def record_rcpt_results(self, rcpts, refused):
+        """Tally up which recipients of a transaction were accepted.
+
+        :rcpts: list of addresses given in RCPT TO.
+        :refused: dict of address -> (code, message) as returned by
+                  smtplib.SMTP.sendmail.
+        """
+        for address in rcpts:
+            result = self.rcpt_results.get(address)
+            if result is None:
+                result = self.rcpt_results[address] = [0, 0, 0, '']
+            if address in refused:
+                code, msg = refused[address]
+                if isinstance(msg, bytes):
+                    msg = msg.decode('utf-8', 'replace')
+                result[1] += 1
+                result[2], result[3] = code, msg
+            else:
+                result[0] += 1
+                result[2], result[3] = 250, ''
+
+    def send_slots(self, sending):
+        """
+        Yield the index of each email this worker is to send, pacing them
+        as the load profile says.
+
+        :sending: int, or None to keep going until the run's time is up.
+        """
+        i = 0
+        while sending is None or i < sending:
+            if not self.handler.wait_turn(self):
+                return
+            yield i
+            i += 1
+
     def send_emails(self, remaining=None, retries_left=None):
         """
         Send the requested number of emails for this worker thread.
@@ -325,13 +702,18 @@ class EmailSender(threading.Thread):
         retries_left = retries_left or \
             self.handler.coordinator.settings['retry_dropped']
 
+        server = None
+        i = 0
         try:
 
             server = self.establish_connection()
 
-            for i in range(sending):
+            event_log = self.handler.event_log
+            timed = self.handler.times_sends()
 
-                if self.handler.coordinator.settings['metrics']:
+            for i in self.send_slots(sending):
+
+                if timed:
                     starttime = time.time()
 
                 if self.handler.do_abort:
@@ -345,36 +727,57 @@ class EmailSender(threading.Thread):
                     and (i != 0)
 
                 if d_per or d_some:
-                    self.handler.coordinator.metrics[
-                        'no-active-connections'] -= 1
-                    server.quit()
+                    self.close_connection(server)
+                    # not ours to quit any more, even if the next one fails
+                    server = None
                     server = self.establish_connection()
 
-                if self.handler.coordinator.settings['debug']:
-                    print("Sending {} at {}".format(str(i),
-                                                    str(time.time())))
-
-                server.sendmail(self.message['from'],
-                                self.handler.coordinator.contents['to'],
-                                self.message.as_string())
-
-                if self.handler.coordinator.settings['debug']:
-                    print("Sent successfully!")
-
-                if self.handler.coordinator.settings['metrics']:
-                    self.var.set(self.var.get() + 1)
-
+                if LOG.isdebug:
+                    LOG.debug("sending", worker=self.name, index=i,
+                              virtual=self.handler.virtual_id(
+                                  self.worker_index, self.stats.sent))
+
+                rcpts = next(self.recipients)
+                code = 250
+                self.stats.state = SENDING
+                if event_log is not None:
+                    sendstart = time.time()
+                try:
+                    refused = self.deliver(server, rcpts)
+                except smtplib.SMTPRecipientsRefused as exc:
+                    # nobody took it.  sendmail has already RSET the
+                    # transaction, so the connection can carry on.
+                    refused = exc.recipients
+                    code = next(iter(refused.values()))[0]
+                    self.stats.record_failure(code)
+                except smtplib.SMTPResponseException as exc:
+                    # MAIL FROM or DATA refused.  count it, but it's still
+                    # up to the caller what happens next
+                    self.stats.record_failure(exc.smtp_code)
+                    raise
+                self.record_rcpt_results(rcpts, refused)
+                self.stats.state = IDLE
+
+                if timed:
                     endtime = time.time()
-
-                    delta = endtime - starttime
-
-                    self._n_sent += 1
-                    self._sending_time = self._sending_time + \
-                        (delta - self._sending_time) \
-                        / self._n_sent
-                self.handler.callback_sent(self)
-                if self.handler.coordinator.settings['debug']:
-                    print("Completed send callback")
+                if event_log is not None:
+                    event_log.log(self.worker_index, starttime,
+                                  self._connect_time, endtime - sendstart,
+                                  endtime - starttime, self.size,
+                                  code, self.handler.virtual_id(
+                                      self.worker_index, self.stats.sent))
+                    self._connect_time = 0
+
+                if LOG.isdebug:
+                    LOG.debug("sent", worker=self.name, index=i,
+                              refused=len(refused))
+
+                if timed:
+                    self.stats.record_send(
+                        endtime - starttime,
+                        not self.handler.profile.in_warmup(starttime))
+                else:
+                    self.stats.sent += 1
 
                 # by using timeit, it's easy to tell that
                 # this if-statement is much faster than
@@ -382,53 +785,71 @@ class EmailSender(threading.Thread):
                 # difference is 0.017 to 0.43 seconds
                 delay = self.handler.coordinator.settings['delay']
                 if delay != 0:
-                    if self.handler.coordinator.settings['debug']:
-                        print("about to sleep for " + str(delay))
                     time.sleep(delay)
             server.quit()
-            self.handler.coordinator.metrics['no-active-connections'] -= 1
+            self.stats.connections -= 1
 
         except smtplib.SMTPServerDisconnected:
-            try:
-                server.quit()
-            except smtplib.SMTPServerDisconnected:
-                # already closed one way or another
-                pass
+            self.stats.conn_errors += 1
+            if server is not None:
+                try:
+                    server.quit()
+                except smtplib.SMTPServerDisconnected:
+                    # already closed one way or another
+                    pass
+                self.stats.connections -= 1
+                server = None
 
             if retries_left != 0:
-                print("Server disconnected.  "
-                      "Trying again... {} tries left.".format(retries_left),
-                      file=sys.stderr)
-                self.send_emails(remaining=(sending - i),
+                self.stats.state = RETRYING
+                LOG.warning("server disconnected, trying again",
+                            worker=self.name, tries_left=retries_left)
+                if sending is not None:
+                    sending -= i
+                self.send_emails(remaining=sending,
                                  retries_left=(retries_left - 1))
             else:
                 raise
         except EmergencyStop:
-            if self.handler.coordinator.settings['con_mode'] != 'con_per':
+            if self.handler.coordinator.settings['con_mode'] != 'con_per' \
+                    and server is not None:
                 server.quit()
+                self.stats.connections -= 1
         finally:
             self.is_done = True
 
-        if server.sock is not None:
+        if server is not None and server.sock is not None:
             server.quit()
+            self.stats.connections -= 1
 
-        if self.handler.coordinator.settings['debug']:
-            print("emailsender.send_emails: done and returning")
+        LOG.debug("done sending", worker=self.name)
 
     def run(self):
         """
         Start the worker thread's operation.
         """
 
-        if self.handler.coordinator.settings['debug']:
-            print("Worker thread {} starting operation at {}".format(
-                self.name, time.time()))
+        LOG.debug("worker starting", worker=self.name)
+
+        lookahead = self.handler.prefetch_lookahead()
+        if lookahead:
+            self.prefetcher = ConnectionPrefetcher(
+                lambda: self._open_connection(report=False),
+                lookahead, name=self.name + "-prefetch")
 
-        self.send_emails()
+        try:
+            self.send_emails()
+        except Exception as exc:
+            # nothing above us will catch this, so at least leave a trail
+            LOG.error("worker died", worker=self.name, error=repr(exc))
+            logger.dump_ring()
+            raise
+        finally:
+            if self.prefetcher is not None:
+                self.prefetcher.close()
+            self.stats.state = DONE
 
-        if self.handler.coordinator.settings['debug']:
-            print("Worker thread {} ending operation at {}".format(
-                self.name, time.time()))
+        LOG.debug("worker ending", worker=self.name)
 
     def pre_delete_actions(self):
         """Actions to take before being deleted."""
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+A lean SMTP transaction path for the send loop.
+
+smtplib.SMTP.sendmail fixes line endings and dot-stuffs the whole message
+with a regex, copies it into a new bytes object, and reads replies a line
+at a time through a file wrapper, all on every send.  Here the body is
+prepared once (CRLF line endings, dot-stuffed, terminator appended) and
+shared by every message, and each message is written as a small
+per-message header block followed by a view of that body, in one
+socket.sendmsg call where the socket allows it.  Replies are parsed out of
+one reusable buffer.
+
+When the server advertises CHUNKING (RFC 3030), the body is sent with
+BDAT in chunks taken straight from the prepared message, with no
+dot-stuffing at all, and when it advertises PIPELINING (RFC 2920), the
+envelope commands go out together and so do the BDAT chunks, rather than
+waiting for a reply to each.  Otherwise it's one command at a time and
+DATA, as smtplib does it.  LeanClient also works out from the EHLO reply
+what the message may be encoded as (8BITMIME, BINARYMIME, SMTPUTF8), for
+Email.as_wire.
+
+smtplib still does the connecting and the handshake (EHLO, STARTTLS,
+AUTH) and the QUIT at the end; LeanClient only takes over the
+transactions in between, and raises the same exceptions smtplib does.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import re
+import smtplib
+import socket
+import ssl
+
+CRLF = b'\r\n'
+
+# longest reply line smtplib accepts; the same limit applies here
+MAX_LINE = 8192
+# most buffers passed to one sendmsg call; IOV_MAX is 1024 on linux
+MAX_BUFFERS = 512
+
+_EOLS = re.compile(br'(?:\r\n|\n|\r(?!\n))')
+_PERIODS = re.compile(br'(?m)^\.')
+_EIGHT_BIT = re.compile(b'[\x80-\xff]')
+
+
+class WireBody(object):
+    """
+    A message body ready to go on the wire.
+
+    :data: memoryview.  The message with CRLF line endings, for BDAT.
+    :stuffed: memoryview.  data dot-stuffed, with the terminating '.' line,
+              for DATA.  Only worked out the first time it's needed.
+    """
+
+    __slots__ = ('data', '_stuffed')
+
+    def __init__(self, message, canonical=False):
+        """
+        Prepare a message to be sent.
+
+        :message: str or bytes.  The whole message, headers and all.  As
+                  with smtplib, str must be ascii.
+        :canonical: bool.  If true, message already has CRLF line endings
+                    throughout, and is used as it is; binary parts could
+                    be spoiled by fixing them.
+        """
+        if isinstance(message, str):
+            message = message.encode('ascii')
+        if not canonical:
+            message = _EOLS.sub(CRLF, message)
+            if message[-2:] != CRLF:
+                message += CRLF
+        self.data = memoryview(message)
+        self._stuffed = None
+
+    @property
+    def stuffed(self):
+        """The body as sent after DATA."""
+        if self._stuffed is None:
+            stuffed = _PERIODS.sub(b'..', self.data)
+            if stuffed[-2:] != CRLF:
+                stuffed += CRLF
+            self._stuffed = memoryview(stuffed + b'.' + CRLF)
+        return self._stuffed
+
+    def eight_bit(self):
+        """Whether the body has any bytes outside 7-bit ASCII."""
+        return _EIGHT_BIT.search(self.data) is not None
+
+    def __len__(self):
+        return len(self.data)
+
+
+class ReplyReader(object):
+    """Reads SMTP replies from a socket into one buffer that's reused for
+    every reply, rather than a line at a time through a file object."""
+
+    def __init__(self, sock, size=4096, quickack=False):
+        """
+        Instantiate the ReplyReader.
+
+        :sock: the connected socket.
+        :size: int.  Starting buffer size; grows for longer replies.
+        :quickack: bool.  Acknowledge every read straight away, where the
+                   system allows it.  See LeanClient.
+        """
+        self.sock = sock
+        self.quickack = quickack and hasattr(socket, 'TCP_QUICKACK')
+        self.buf = bytearray(size)
+        self.start = 0
+        self.end = 0
+
+    def _fill(self):
+        """Read whatever's waiting on the socket into the buffer."""
+        if self.end == len(self.buf):
+            if self.start:
+                # move what's left of a reply to the front
+                pending = self.end - self.start
+                self.buf[:pending] = self.buf[self.start:self.end]
+                self.start, self.end = 0, pending
+            else:
+                self.buf.extend(bytes(len(self.buf)))
+        if self.quickack:
+            # linux turns this back off by itself, so it's set every time
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        with memoryview(self.buf) as view:
+            received = self.sock.recv_into(view[self.end:])
+        if not received:
+            raise smtplib.SMTPServerDisconnected(
+                "Connection unexpectedly closed")
+        self.end += received
+
+    def read(self):
+        """Read one (possibly multi-line) reply.  Returns (code, message)
+        just like smtplib.SMTP.getreply."""
+        lines = []
+        while True:
+            newline = self.buf.find(b'\n', self.start, self.end)
+            if newline == -1:
+                if self.end - self.start > MAX_LINE:
+                    raise smtplib.SMTPResponseException(500,
+                                                        "Line too long.")
+                self._fill()
+                continue
+
+            line = bytes(self.buf[self.start:newline + 1])
+            self.start = newline + 1
+            lines.append(line[4:].strip(b' \t\r\n'))
+            try:
+                code = int(line[:3])
+            except ValueError:
+                code = -1
+                break
+            if line[3:4] != b'-':
+                break
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return code, b'\n'.join(lines)
+
+
+def _is_ascii(address):
+    """Whether address can go in an envelope without SMTPUTF8."""
+    try:
+        address.encode('ascii')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def send_buffers(sock, buffers):
+    """
+    Write a list of buffers to a socket, with as few calls as it takes.
+
+    Plain sockets get one sendmsg (scatter-gather) call, plus more if the
+    kernel only takes part of it.  SSL sockets can't do sendmsg, so each
+    buffer is written with sendall.
+    """
+    if isinstance(sock, ssl.SSLSocket) or not hasattr(sock, 'sendmsg'):
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+
+    buffers = [memoryview(buf) for buf in buffers if len(buf)]
+    while buffers:
+        sent = sock.sendmsg(buffers[:MAX_BUFFERS])
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers[0])
+            buffers.pop(0)
+        if buffers and sent:
+            buffers[0] = buffers[0][sent:]
+
+
+class LeanClient(object):
+    """
+    Sends messages over a connection smtplib.SMTP has already set up.
+
+    Create one per connection, after the handshake; smtplib can be used
+    again afterwards (for QUIT, say), since no reply is left half-read.
+    """
+
+    def __init__(self, server, chunk_size=0):
+        """
+        Instantiate the LeanClient.
+
+        :server: a connected smtplib.SMTP, past EHLO/STARTTLS/AUTH.
+        :chunk_size: int.  Bytes per BDAT chunk if the server does
+                     CHUNKING; 0 to always use DATA.
+        """
+        self.server = server
+        self.sock = server.sock
+        self.use_size = server.does_esmtp and server.has_extn('size')
+        self.pipelining = server.does_esmtp and server.has_extn('pipelining')
+        # servers that write each pipelined reply separately have the
+        # second one held back by Nagle's algorithm until the first is
+        # acknowledged, which a delayed ACK puts off for up to 40 ms
+        self.replies = ReplyReader(self.sock, quickack=self.pipelining)
+        self.chunk_size = chunk_size if server.does_esmtp and \
+            server.has_extn('chunking') else 0
+
+        # the most the message's encoding can rely on: binary needs BDAT
+        # to send it, and SMTPUTF8 needs 8BITMIME
+        if self.chunk_size and server.has_extn('binarymime'):
+            self.body_type = 'binary'
+        elif server.does_esmtp and server.has_extn('8bitmime'):
+            self.body_type = '8bit'
+        else:
+            self.body_type = '7bit'
+        self.utf8 = self.body_type != '7bit' and server.has_extn('smtputf8')
+
+    def exchange(self, buffers, n_replies):
+        """Write buffers, then read n_replies replies.  Returns the list of
+        replies."""
+        try:
+            send_buffers(self.sock, buffers)
+            return [self.replies.read() for _ in range(n_replies)]
+        except OSError as exc:
+            self.server.close()
+            raise smtplib.SMTPServerDisconnected(
+                "Connection unexpectedly closed: " + str(exc))
+
+    def command(self, line):
+        """Send one command and return its reply."""
+        return self.exchange([line + CRLF], 1)[0]
+
+    def _abort(self, code):
+        """Give up on a transaction: RSET it, or close the connection if
+        the server is going away."""
+        if code == 421:
+            self.server.close()
+        else:
+            self.command(b'RSET')
+
+    def _cancel_data(self, reply):
+        """If a pipelined DATA was let through despite the transaction
+        failing, end it with no message."""
+        if reply is not None and reply[0] == 354:
+            self.command(b'.')
+
+    def _envelope(self, mail, rcpts, data):
+        """Send MAIL FROM and the RCPT TOs, plus DATA if data is set.
+        Returns the list of replies: pipelined, there's one for every
+        command, otherwise they stop at a refused MAIL FROM or a 421, and
+        DATA is left to the caller."""
+        if self.pipelining:
+            commands = [mail] + rcpts + ([b'DATA'] if data else [])
+            return self.exchange([CRLF.join(commands) + CRLF],
+                                 len(commands))
+
+        replies = [self.command(mail)]
+        if replies[0][0] == 250:
+            for rcpt in rcpts:
+                replies.append(self.command(rcpt))
+                if replies[-1][0] == 421:
+                    break
+        return replies
+
+    def _send_chunks(self, header_block, body):
+        """Send the message with BDAT.  Returns the reply to the last
+        chunk, or to the first one that failed."""
+        data = body.data
+        starts = range(0, len(data), self.chunk_size) or [0]
+        replies = []
+        batch = []
+        for start in starts:
+            chunk = data[start:start + self.chunk_size]
+            size = len(chunk)
+            if start == 0:
+                size += len(header_block)
+            last = start == starts[-1]
+            batch.append(b'BDAT %d%s\r\n' % (size, b' LAST' if last else b''))
+            if start == 0:
+                batch.append(header_block)
+            batch.append(chunk)
+
+            if not self.pipelining:
+                replies.extend(self.exchange(batch, 1))
+                batch = []
+                if replies[-1][0] != 250:
+                    return replies[-1]
+        if batch:
+            replies.extend(self.exchange(batch, len(starts)))
+
+        for reply in replies:
+            if reply[0] != 250:
+                return reply
+        return replies[-1]
+
+    def sendmail(self, from_addr, to_addrs, body, header_block=b'',
+                 options=b''):
+        """
+        Send one message, like smtplib.SMTP.sendmail.
+
+        :from_addr: str.  Envelope sender.
+        :to_addrs: list of str.  Envelope recipients.
+        :body: WireBody.  Shared by every message.
+        :header_block: bytes.  Header lines (each ending in CRLF) to put in
+                       front of this message only.  Must not start with
+                       '.'.
+        :options: bytes.  MAIL FROM parameters, each starting with a
+                  space, e.g. b' BODY=8BITMIME'.
+
+        Returns a dict of refused recipients to (code, message), and raises
+        smtplib's exceptions when the sender, every recipient or the
+        message is refused.  Addresses that aren't ascii are sent as UTF-8
+        with SMTPUTF8 if the server does it; if it doesn't, nothing is sent
+        and SMTPNotSupportedError is raised, as smtplib's send_message
+        does.
+        """
+        chunked = self.chunk_size > 0
+        encoding = 'ascii'
+        if not all(_is_ascii(address)
+                   for address in [from_addr] + list(to_addrs)):
+            if not (self.server.does_esmtp and
+                    self.server.has_extn('smtputf8')):
+                raise smtplib.SMTPNotSupportedError(
+                    "One or more source or delivery addresses require "
+                    "internationalized email support, but the server does "
+                    "not advertise the required SMTPUTF8 capability")
+            encoding = 'utf-8'
+            if b'SMTPUTF8' not in options.upper().split():
+                options += b' SMTPUTF8'
+
+        mail = b'MAIL FROM:' + smtplib.quoteaddr(from_addr).encode(encoding)
+        if self.use_size:
+            mail += b' SIZE=%d' % (len(header_block) + len(body))
+        mail += options
+        rcpts = [b'RCPT TO:' + smtplib.quoteaddr(address).encode(encoding)
+                 for address in to_addrs]
+
+        replies = self._envelope(mail, rcpts, not chunked)
+        data_reply = replies[len(rcpts) + 1] if len(replies) > len(rcpts) + 1 \
+            else None
+
+        code, resp = replies[0]
+        if code != 250:
+            self._cancel_data(data_reply)
+            self._abort(code)
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+        refused = {}
+        for address, (code, resp) in zip(to_addrs, replies[1:]):
+            if code not in (250, 251):
+                refused[address] = (code, resp)
+            if code == 421:
+                self.server.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            self._cancel_data(data_reply)
+            self.command(b'RSET')
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        if chunked:
+            code, resp = self._send_chunks(header_block, body)
+        else:
+            code, resp = data_reply or self.command(b'DATA')
+            if code != 354:
+                self._abort(code)
+                raise smtplib.SMTPDataError(code, resp)
+            code, resp = self.exchange([header_block, body.stuffed], 1)[0]
+        if code != 250:
+            self._abort(code)
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the sender headlessly over a grid of settings, and tabulates how each
+combination did.
+
+A sweep is described by a JSON file:
+
+    {
+        "duration": 10,
+        "warmup": 2,
+        "settings": {"server": "mail.test:25", "use_auth": false},
+        "grid": {
+            "mt_num": [1, 2, 4, 8, 16, 32, 64],
+            "con_mode": ["con_once", "con_some", "con_per"],
+            "con_num": [10, 100],
+            "message_size": [1000, 100000],
+            "use_starttls": [false, true]
+        }
+    }
+
+Every combination of the grid's values is a cell, run for `duration`
+seconds with the first `warmup` left out of the figures.  Grid keys are
+settings.json settings, plus message_size, the size in bytes of the
+message text.  "settings" and "contents" hold fixed settings and message
+fields for every cell.  Cells that only differ in a setting that doesn't
+apply to them (con_num outside con_some, mt_num outside limited
+multithreading) are only run once.
+
+    python sweep.py sweep.json -o results
+
+writes results.csv and a bar chart of mails/sec, results.svg.  Cells run
+one after another in this process, reusing the rendered message between
+cells of the same size; --cold runs each in a fresh interpreter instead.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import argparse
+import copy
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+from emailbuilder import Email
+from headers import Headers
+from history import quantile
+from metrics import LATENCY_BUCKETS
+from prereqs import load_config
+from sender import EmailSendHandler
+import logger
+
+LOG = logger.get_logger('sweep')
+
+# grid keys that aren't settings
+MESSAGE_SIZE = 'message_size'
+
+# setting -> (other setting, value it must have for this one to matter)
+ONLY_APPLIES_WITH = {
+    'con_num': ('con_mode', 'con_some'),
+    'mt_num': ('mt_mode', 'limited'),
+}
+
+# what a cell's result holds, in table order
+RESULT_FIELDS = ('sent', 'failed', 'rate', 'byte_rate', 'mean_latency',
+                 'p50', 'p95', 'p99', 'reconnects', 'conn_errors', 'error')
+
+
+def text_of_size(size):
+    """Message text of about size bytes, in lines short enough to need no
+    transfer encoding."""
+    with open('lorem.txt', 'r') as lorem:
+        words = lorem.read().replace('\n', ' ')
+    text = (words * (size // len(words) + 1))[:size]
+    return '\n'.join(text[i:i + 76] for i in range(0, len(text), 76))
+
+
+class HeadlessCoordinator(object):
+    """
+    Stands in for the Coordinator when there's no GUI: holds the settings,
+    the message contents, the Email and its Headers, and runs one
+    EmailSendHandler at a time to completion.
+    """
+
+    def __init__(self, settings, contents):
+        """
+        Instantiate the HeadlessCoordinator.
+
+        :settings: dict.  Settings, as in settings.json.  Copied.
+        :contents: dict.  Message fields, as in settings.json, plus
+                   'password' for AUTH.  Copied.
+        """
+        self.settings = copy.deepcopy(settings)
+        self.contents = copy.deepcopy(contents)
+        self.contents.setdefault('password', '')
+        logger.configure(self.settings)
+
+        self.email = Email(self, None)
+        self.headers = Headers(self, self.email)
+        self.email.headers = self.headers
+        self.sender = None
+        self._text = self.contents['text']
+
+    def run(self, overrides, message_size=None):
+        """
+        Send one run with the given settings changed, and return its
+        results: a dict of RESULT_FIELDS.
+
+        :overrides: dict.  Settings to change; they stay changed.
+        :message_size: int.  Bytes of message text, or None for the text
+                       from the contents.
+        """
+        self.settings.update(overrides)
+        self.contents['text'] = self._text if message_size is None else \
+            text_of_size(message_size)
+        # only re-rendered if the text has changed since the last run
+        self.email.pull_data_from_coordinator()
+
+        self.sender = EmailSendHandler(self)
+        error = ''
+        try:
+            self.sender.start()
+            # poll the metrics as the GUI would: the rates past the warm-up
+            # are measured from the first snapshot taken after it
+            interval = 1 / self.settings['gui_refresh_hz']
+            while self.sender.is_alive():
+                self.sender.join(interval)
+                metrics = self.sender.metrics
+                if metrics is not None and \
+                        metrics.profile.start_time is not None:
+                    metrics.snapshot()
+        except Exception as exc:  # pylint: disable=W0703
+            error = repr(exc)
+        return summarize(self.sender.metrics, error)
+
+
+def failed_results(error):
+    """Results for a run that never got going."""
+    results = dict.fromkeys(RESULT_FIELDS, 0)
+    results['error'] = error
+    return results
+
+
+def summarize(metrics, error=''):
+    """Turn a finished run's SendMetrics into a dict of RESULT_FIELDS."""
+    if metrics is None or metrics.profile.start_time is None:
+        return failed_results(error or "didn't run")
+    snapshot = metrics.snapshot()
+    workers = metrics.workers
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for worker in workers:
+        for i, count in enumerate(worker.latency):
+            counts[i] += count
+    timed = sum(counts)
+    dead = sum(1 for worker in workers if worker.sent == 0)
+    if not error and snapshot.sent == 0:
+        error = "nothing sent"
+    elif not error and dead:
+        error = "{} workers sent nothing".format(dead)
+    return {
+        'sent': snapshot.sent,
+        'failed': sum(sum(worker.failed.values()) for worker in workers),
+        'rate': snapshot.sending_rate,
+        'byte_rate': snapshot.byte_rate,
+        'mean_latency': (sum(worker.latency_sum for worker in workers) /
+                         timed) if timed else None,
+        'p50': quantile(counts, 0.50),
+        'p95': quantile(counts, 0.95),
+        'p99': quantile(counts, 0.99),
+        'reconnects': sum(worker.reconnects for worker in workers),
+        'conn_errors': sum(worker.conn_errors for worker in workers),
+        'error': error,
+    }
+
+
+def expand_grid(grid, settings):
+    """
+    Return every cell of a grid as a dict of values, in order, leaving out
+    settings that don't apply to a cell and so any repeats that leaves.
+
+    :grid: dict of key -> list of values.
+    :settings: dict.  The settings the grid's values go on top of.
+    """
+    keys = list(grid)
+    cells = []
+    seen = set()
+    for values in itertools.product(*(grid[key] for key in keys)):
+        cell = dict(zip(keys, values))
+        for key, (other, needed) in ONLY_APPLIES_WITH.items():
+            if key in cell and cell.get(other, settings.get(other)) != \
+                    needed:
+                del cell[key]
+        identity = tuple(sorted(cell.items()))
+        if identity not in seen:
+            seen.add(identity)
+            cells.append(cell)
+    return cells
+
+
+def describe_cell(cell):
+    """A cell as 'key=value ...', for labels."""
+    return ' '.join('{}={}'.format(key, value) for key, value in cell.items())
+
+
+def cell_overrides(spec, cell):
+    """The settings to run a cell with, and its message size."""
+    overrides = {'run_duration': spec.get('duration', 10),
+                 'warmup_exclude': spec.get('warmup', 2),
+                 'metrics': True,
+                 'run_label': (spec.get('label', 'sweep') + ': ' +
+                               describe_cell(cell))}
+    overrides.update((key, value) for key, value in cell.items()
+                     if key != MESSAGE_SIZE)
+    return overrides, cell.get(MESSAGE_SIZE)
+
+
+def base_config(spec):
+    """The settings and contents every cell of a sweep starts from."""
+    config = load_config()
+    settings = copy.deepcopy(config['settings'])
+    settings.update(spec.get('settings', {}))
+    grid = spec.get('grid', {})
+    if 'mt_num' in grid and 'mt_mode' not in grid and \
+            'mt_mode' not in spec.get('settings', {}):
+        # sweeping thread counts only makes sense with a fixed number
+        settings['mt_mode'] = 'limited'
+    contents = copy.deepcopy(config['contents'])
+    contents.update(spec.get('contents', {}))
+    return settings, contents
+
+
+def run_cold(spec, cell):
+    """Run one cell in a fresh interpreter, and return its results."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--cell',
+         json.dumps({'spec': spec, 'cell': cell})],
+        cwd=here, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        return failed_results("exited with {}".format(proc.returncode))
+
+
+def run_sweep(spec, cold=False, report=print):
+    """
+    Run every cell of a sweep.  Returns a list of (cell, results).
+
+    :spec: dict.  The sweep, as described at the top of this file.
+    :cold: bool.  Run each cell in a fresh interpreter.
+    :report: callable given a line of progress after each cell.
+    """
+    settings, contents = base_config(spec)
+    cells = expand_grid(spec['grid'], settings)
+    coordinator = None if cold else HeadlessCoordinator(settings, contents)
+    pause = spec.get('pause', 0)
+
+    rows = []
+    for n, cell in enumerate(cells):
+        if n and pause:
+            time.sleep(pause)
+        if cold:
+            results = run_cold(spec, cell)
+        else:
+            results = coordinator.run(*cell_overrides(spec, cell))
+        rows.append((cell, results))
+        report("[{}/{}] {}: {:.1f} mails/sec, p99 {} sec{}".format(
+            n + 1, len(cells), describe_cell(cell), results['rate'],
+            _fmt(results['p99']),
+            "  (" + results['error'] + ")" if results['error'] else ""))
+    return rows
+
+
+def _fmt(value):
+    """A number for a table, or '' if there isn't one."""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        return '{:.4g}'.format(value)
+    return str(value)
+
+
+def write_csv(filename, grid, rows):
+    """Write one line per cell: its grid values, then its results."""
+    keys = list(grid)
+    with open(filename, 'w') as out:
+        writer = csv.writer(out)
+        writer.writerow(keys + list(RESULT_FIELDS))
+        for cell, results in rows:
+            writer.writerow([cell.get(key, '') for key in keys] +
+                            [_fmt(results[field]) for field in RESULT_FIELDS])
+
+
+def write_chart(filename, rows, title="mails/sec"):
+    """Write a horizontal bar chart of each cell's mails/sec as SVG, with
+    its p99 latency at the end of the bar."""
+    bar, gap, label_width, chart_width = 16, 4, 360, 480
+    peak = max([results['rate'] for _, results in rows] + [1e-9])
+    height = 30 + len(rows) * (bar + gap)
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="{}" '
+             'height="{}" font-family="sans-serif" font-size="11">'.format(
+                 label_width + chart_width + 120, height),
+             '<text x="4" y="16" font-size="13">{}</text>'.format(title)]
+    for n, (cell, results) in enumerate(rows):
+        y = 26 + n * (bar + gap)
+        width = chart_width * results['rate'] / peak
+        parts.append('<text x="{}" y="{}" text-anchor="end">{}</text>'.format(
+            label_width - 6, y + bar - 4, _escape(describe_cell(cell))))
+        parts.append('<rect x="{}" y="{}" width="{:.1f}" height="{}" '
+                     'fill="{}"/>'.format(
+                         label_width, y, width, bar,
+                         '#c44' if results['error'] else '#48c'))
+        parts.append('<text x="{:.1f}" y="{}">{:.1f}  p99 {} s</text>'.format(
+            label_width + width + 4, y + bar - 4, results['rate'],
+            _fmt(results['p99']) or '-'))
+    parts.append('</svg>')
+    with open(filename, 'w') as out:
+        out.write('\n'.join(parts) + '\n')
+
+
+def _escape(text):
+    """Escape text for SVG."""
+    return (text.replace('&', '&amp;')
+            .replace('<', '&lt;')
+            .replace('>', '&gt;'))
+
+
+def main(argv=None):
+    """Run a sweep from the command line.  Returns the exit status."""
+    parser = argparse.ArgumentParser(description="Run the sender over a "
+                                     "grid of settings.")
+    parser.add_argument('spec', nargs='?', help="sweep description (JSON)")
+    parser.add_argument('-o', '--output', metavar='PREFIX', default='sweep',
+                        help="write PREFIX.csv and PREFIX.svg "
+                        "(default: %(default)s)")
+    parser.add_argument('--cold', action='store_true',
+                        help="run each cell in a fresh interpreter")
+    parser.add_argument('--cell', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.cell:
+        # one cell of a --cold sweep; the results are the last line out
+        job = json.loads(args.cell)
+        settings, contents = base_config(job['spec'])
+        coordinator = HeadlessCoordinator(settings, contents)
+        print(json.dumps(coordinator.run(*cell_overrides(job['spec'],
+                                                         job['cell']))))
+        return 0
+    if not args.spec:
+        parser.error("a sweep description is needed")
+
+    with open(args.spec, 'r') as spec_file:
+        spec = json.load(spec_file)
+    rows = run_sweep(spec, args.cold)
+    write_csv(args.output + '.csv', spec['grid'], rows)
+    write_chart(args.output + '.svg', rows)
+    print("wrote {0}.csv and {0}.svg".format(args.output))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+"""
+Records raw SMTP sessions and replays them, byte for byte, against a
+server, to benchmark its protocol handling without our MIME building or
+SMTP client in the way.
+
+Recording is done by a proxy: point EmailSender (or any other client) at
+it, and it passes every session through to the real server, noting what
+each side sent and when.  A session is kept as a list of steps: the bytes
+the client sent in one go, how long it thought before sending them, and
+the codes of the replies the server gave before the client spoke again.
+The first step is the greeting, with nothing sent.  Replaying writes each
+step's bytes as they were recorded, reads as many replies and checks their
+codes; nothing is parsed or built in the loop.
+
+    python transcript.py record -s 127.0.0.1:2525 -o sessions.smtp
+    python transcript.py replay sessions.smtp -s 127.0.0.1:2525 -x 10 -c 50
+
+Sessions that use STARTTLS can't be replayed (what follows it was
+encrypted for the recorded session only), so they're left out when the
+transcript is read.
+
+File layout:
+    header:   MAGIC, then HEADER (version).
+    sessions: SESSION (epoch time the session started, number of steps),
+              then for each step STEP (think secs, bytes sent, number of
+              replies), the reply codes, each a REPLY_CODE, and the bytes.
+              Sessions are written as they end, so not in start order.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import argparse
+import collections
+import select
+import socket
+import struct
+import sys
+import threading
+import time
+
+try:
+    import queue
+    import socketserver
+except ImportError:
+    # py2
+    import Queue as queue
+    import SocketServer as socketserver
+
+from smtpwire import ReplyReader
+import logger
+
+LOG = logger.get_logger('transcript')
+
+MAGIC = b'EGTS'
+VERSION = 1
+
+HEADER = struct.Struct('<B')
+# start time, number of steps
+SESSION = struct.Struct('<dI')
+# think secs, bytes sent, number of replies
+STEP = struct.Struct('<fIH')
+REPLY_CODE = struct.Struct('<H')
+
+Step = collections.namedtuple('Step', ['think', 'data', 'codes'])
+Session = collections.namedtuple('Session', ['start', 'steps'])
+
+
+def parse_address(text, default_port=25):
+    """Turn 'host:port' (or just 'host') into a (host, port) tuple."""
+    host, _, port = text.rpartition(':')
+    if not host:
+        return text, default_port
+    return host, int(port)
+
+
+def reply_codes(data):
+    """Return the code of every complete reply in data, or 0 for a reply
+    that doesn't start with one."""
+    codes = []
+    for line in data.split(b'\n'):
+        if len(line) >= 3 and line[3:4] != b'-':
+            try:
+                codes.append(int(line[:3]))
+            except ValueError:
+                codes.append(0)
+    return codes
+
+
+def steps_from_events(events):
+    """
+    Turn what the proxy saw of one session into a list of Steps.
+
+    :events: list of (time, from_client, bytes), in the order they were
+             seen.
+
+    Everything the client sends until the server replies is one step, and
+    the replies until the client sends again are what it expects back.
+    Think time is from the end of the last reply to the first byte sent.
+    """
+    steps = []
+    sent, received = [], []
+    think = 0.0
+    last_reply = events[0][0] if events else 0.0
+    for when, from_client, data in events:
+        if from_client:
+            if received:
+                steps.append(Step(think, b''.join(sent),
+                                  reply_codes(b''.join(received))))
+                sent, received = [], []
+            if not sent:
+                think = max(when - last_reply, 0.0)
+            sent.append(data)
+        else:
+            received.append(data)
+            last_reply = when
+    if sent or received:
+        steps.append(Step(think, b''.join(sent),
+                          reply_codes(b''.join(received))))
+    return steps
+
+
+class TranscriptWriter(object):
+    """Writes sessions to a transcript file, from any number of threads."""
+
+    def __init__(self, filename):
+        """
+        Instantiate the TranscriptWriter.
+
+        :filename: str.  File to write the transcript to.  Overwritten.
+        """
+        self.filename = filename
+        self.n_sessions = 0
+        self._lock = threading.Lock()
+        self._file = open(filename, 'wb')
+        self._file.write(MAGIC)
+        self._file.write(HEADER.pack(VERSION))
+
+    def write(self, start, steps):
+        """Write one session that began at epoch time start."""
+        chunks = [SESSION.pack(start, len(steps))]
+        for step in steps:
+            chunks.append(STEP.pack(step.think, len(step.data),
+                                    len(step.codes)))
+            chunks.extend(REPLY_CODE.pack(code) for code in step.codes)
+            chunks.append(step.data)
+        block = b''.join(chunks)
+        with self._lock:
+            self._file.write(block)
+            self._file.flush()
+            self.n_sessions += 1
+
+    def close(self):
+        """Close the file."""
+        with self._lock:
+            self._file.close()
+
+
+class _ProxyHandler(socketserver.BaseRequestHandler):
+    """Passes one session through to the server, recording it."""
+
+    def handle(self):
+        proxy = self.server
+        client = self.request
+        try:
+            upstream = socket.create_connection(proxy.upstream,
+                                                timeout=proxy.timeout)
+        except (socket.error, OSError) as exc:
+            LOG.warning("couldn't connect to server",
+                        server=proxy.upstream, error=repr(exc))
+            return
+
+        events = []
+        # socket -> the socket its data goes to, while it's still open
+        open_ends = {client: upstream, upstream: client}
+        try:
+            while open_ends:
+                readable, _, _ = select.select(list(open_ends), [], [],
+                                               proxy.timeout)
+                if not readable:
+                    LOG.warning("session timed out",
+                                client=self.client_address)
+                    break
+                for sock in readable:
+                    data = sock.recv(1 << 16)
+                    other = open_ends[sock]
+                    if not data:
+                        # pass the close on, and wait for the other side's
+                        del open_ends[sock]
+                        try:
+                            other.shutdown(socket.SHUT_WR)
+                        except (socket.error, OSError):
+                            pass
+                        continue
+                    events.append((time.time(), sock is client, data))
+                    other.sendall(data)
+        except (socket.error, OSError) as exc:
+            LOG.debug("session ended with an error",
+                      client=self.client_address, error=repr(exc))
+        finally:
+            upstream.close()
+
+        if events:
+            proxy.writer.write(events[0][0], steps_from_events(events))
+
+
+class RecordingProxy(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """
+    A TCP proxy that records every session passing through it to a
+    transcript.  Each session gets its own thread.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, listen, upstream, writer, timeout=60):
+        """
+        Instantiate the RecordingProxy.
+
+        :listen: (host, port) to accept clients on.
+        :upstream: (host, port) of the server to pass sessions on to.
+        :writer: TranscriptWriter.  Where sessions go as they end.
+        :timeout: float.  Seconds of silence from both sides after which a
+                  session is dropped.
+        """
+        self.upstream = upstream
+        self.writer = writer
+        self.timeout = timeout
+        socketserver.TCPServer.__init__(self, listen, _ProxyHandler)
+
+
+def read_transcript(filename, skip_starttls=True):
+    """
+    Read a transcript file.  Returns its sessions as a list, in the order
+    they started, with start times made relative to the first.
+    """
+    with open(filename, 'rb') as transcript:
+        data = transcript.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(filename + " is not a transcript")
+    pos = len(MAGIC)
+    version, = HEADER.unpack_from(data, pos)
+    if version != VERSION:
+        raise ValueError("Unsupported transcript version " + str(version))
+    pos += HEADER.size
+
+    sessions = []
+    skipped = 0
+    while pos < len(data):
+        start, n_steps = SESSION.unpack_from(data, pos)
+        pos += SESSION.size
+        steps = []
+        for _ in range(n_steps):
+            think, size, n_codes = STEP.unpack_from(data, pos)
+            pos += STEP.size
+            codes = struct.unpack_from('<{}H'.format(n_codes), data, pos)
+            pos += n_codes * REPLY_CODE.size
+            steps.append(Step(think, data[pos:pos + size], codes))
+            pos += size
+        if skip_starttls and any(step.data.strip().upper() == b'STARTTLS'
+                                 for step in steps):
+            skipped += 1
+            continue
+        sessions.append(Session(start, steps))
+
+    if skipped:
+        LOG.warning("skipped sessions using STARTTLS", sessions=skipped)
+    sessions.sort(key=lambda session: session.start)
+    if sessions:
+        first = sessions[0].start
+        sessions = [Session(session.start - first, session.steps)
+                    for session in sessions]
+    return sessions
+
+
+class ReplayStats(object):
+    """The counters belonging to one replay thread.  Only that thread writes
+    to them; they're added up once the replay is over."""
+
+    __slots__ = ('ok', 'failed', 'errors', 'bytes_sent', 'mismatches')
+
+    def __init__(self):
+        self.ok = 0
+        # sessions cut short by a reply code other than the recorded one
+        self.failed = 0
+        # sessions cut short by a connection error
+        self.errors = 0
+        self.bytes_sent = 0
+        # (expected code, code received) -> count
+        self.mismatches = collections.Counter()
+
+
+class Replayer(object):
+    """
+    Replays the sessions of a transcript against a server, from a number
+    of threads at once.
+
+    With a speed-up of 1, each session starts at the same time after the
+    start of the replay as it did in the recording, and the client thinks
+    as long as it did between steps; with a speed-up of 10, both happen ten
+    times sooner.  With 0, there's no waiting at all: each thread starts its
+    next session as soon as it's done with the last.  Either way, there are
+    never more than `concurrency` sessions going at once, so a replay that
+    can't keep up falls behind the recording's schedule rather than
+    opening more connections.
+    """
+
+    def __init__(self, sessions, server, speed=1.0, concurrency=10, loops=1,
+                 timeout=30):
+        """
+        Instantiate the Replayer.
+
+        :sessions: list of Sessions, from read_transcript.
+        :server: (host, port) to replay against.
+        :speed: float.  Speed-up factor; 0 to not wait at all.
+        :concurrency: int.  Most sessions to replay at once.
+        :loops: int.  Times to replay the whole transcript; each loop is
+                scheduled to start when the one before it would end.
+        :timeout: float.  Socket timeout in seconds.
+        """
+        self.sessions = sessions
+        self.server = server
+        self.speed = speed
+        self.concurrency = max(int(concurrency), 1)
+        self.loops = max(int(loops), 1)
+        self.timeout = timeout
+        self.stats = []
+        self.elapsed = 0.0
+
+    def _schedule(self):
+        """Fill a queue with (start secs, session) for every session
+        replayed, in order."""
+        span = max(session.start + sum(step.think for step in session.steps)
+                   for session in self.sessions)
+        work = queue.Queue()
+        for loop in range(self.loops):
+            for session in self.sessions:
+                work.put((loop * span + session.start, session))
+        return work
+
+    def _replay_session(self, session, stats):
+        """Replay one session, counting how it went in stats."""
+        speed = self.speed
+        sock = socket.create_connection(self.server, timeout=self.timeout)
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            replies = ReplyReader(sock, quickack=True)
+            for step in session.steps:
+                if speed and step.think:
+                    time.sleep(step.think / speed)
+                if step.data:
+                    sock.sendall(step.data)
+                    stats.bytes_sent += len(step.data)
+                for expected in step.codes:
+                    code = replies.read()[0]
+                    if code != expected:
+                        stats.mismatches[(expected, code)] += 1
+                        stats.failed += 1
+                        return
+            stats.ok += 1
+        finally:
+            sock.close()
+
+    def _run(self, work, begin, stats):
+        """Body of each replay thread."""
+        while True:
+            try:
+                due, session = work.get_nowait()
+            except queue.Empty:
+                return
+            if self.speed:
+                wait = begin + due / self.speed - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+            try:
+                self._replay_session(session, stats)
+            except Exception as exc:  # pylint: disable=W0703
+                stats.errors += 1
+                LOG.debug("replay failed", error=repr(exc))
+
+    def run(self):
+        """Replay every session, and return the totals from total()."""
+        work = self._schedule()
+        self.stats = [ReplayStats() for _ in range(self.concurrency)]
+        begin = time.time()
+        threads = [threading.Thread(target=self._run,
+                                    args=(work, begin, stats),
+                                    name="Replayer-{}".format(n))
+                   for n, stats in enumerate(self.stats)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.time() - begin
+        return self.total()
+
+    def total(self):
+        """Add up the threads' counters.  Returns a dict of sessions ok,
+        failed and errors, bytes sent, mismatches and elapsed secs."""
+        mismatches = collections.Counter()
+        for stats in self.stats:
+            mismatches.update(stats.mismatches)
+        return {
+            'ok': sum(stats.ok for stats in self.stats),
+            'failed': sum(stats.failed for stats in self.stats),
+            'errors': sum(stats.errors for stats in self.stats),
+            'bytes_sent': sum(stats.bytes_sent for stats in self.stats),
+            'mismatches': dict(mismatches),
+            'elapsed': self.elapsed,
+        }
+
+
+def _record(args):
+    """Run the recording proxy until interrupted."""
+    writer = TranscriptWriter(args.output)
+    proxy = RecordingProxy(parse_address(args.listen),
+                           parse_address(args.server), writer)
+    print("recording sessions to {}, via {} to {}; ^C to stop".format(
+        args.output, args.listen, args.server))
+    try:
+        proxy.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        proxy.server_close()
+        writer.close()
+    print("recorded {} sessions".format(writer.n_sessions))
+
+
+def _replay(args):
+    """Replay a transcript and print how it went."""
+    sessions = read_transcript(args.transcript)
+    if not sessions:
+        print("no sessions to replay")
+        return 1
+    replayer = Replayer(sessions, parse_address(args.server), args.speed,
+                        args.concurrency, args.loops, args.timeout)
+    totals = replayer.run()
+    took = totals['elapsed']
+
+    print("sessions: ok {ok}, failed {failed}, errors {errors}".format(
+        **totals))
+    for (expected, code), count in sorted(totals['mismatches'].items()):
+        print("  expected {}, got {}: {}".format(expected, code, count))
+    print("{:.2f} sec, {:.0f} sessions/sec, {:.0f} bytes/sec".format(
+        took, (totals['ok'] + totals['failed']) / took if took else 0,
+        totals['bytes_sent'] / took if took else 0))
+    return 0 if not totals['failed'] and not totals['errors'] else 1
+
+
+def main(argv=None):
+    """Record or replay transcripts from the command line."""
+    parser = argparse.ArgumentParser(description="Record SMTP sessions "
+                                     "through a proxy, or replay them.")
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    record = commands.add_parser('record', help="record sessions")
+    record.add_argument('-l', '--listen', default='127.0.0.1:2526',
+                        help="host:port to accept clients on "
+                        "(default: %(default)s)")
+    record.add_argument('-s', '--server', required=True,
+                        help="host:port of the server to record")
+    record.add_argument('-o', '--output', required=True,
+                        help="transcript file to write")
+    record.set_defaults(func=_record)
+
+    replay = commands.add_parser('replay', help="replay a transcript")
+    replay.add_argument('transcript', help="transcript file to replay")
+    replay.add_argument('-s', '--server', required=True,
+                        help="host:port of the server to replay against")
+    replay.add_argument('-x', '--speed', type=float, default=1.0,
+                        help="speed-up factor; 0 to not wait at all "
+                        "(default: %(default)s)")
+    replay.add_argument('-c', '--concurrency', type=int, default=10,
+                        help="most sessions at once (default: %(default)s)")
+    replay.add_argument('-n', '--loops', type=int, default=1,
+                        help="times to replay the transcript "
+                        "(default: %(default)s)")
+    replay.add_argument('-t', '--timeout', type=float, default=30,
+                        help="socket timeout in seconds "
+                        "(default: %(default)s)")
+    replay.set_defaults(func=_replay)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
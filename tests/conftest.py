@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Lets the tests import the program's modules, which import each other by
+their plain names, and find the files they read relative to src/, just as
+when the program is run from there.
+"""
+
+import os
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))), 'src')
+
+sys.path.insert(0, SRC)
+os.chdir(SRC)
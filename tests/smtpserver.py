@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+A small SMTP server for the tests to send to, which accepts everything and
+can be told to misbehave, and helpers for running the sender against it.
+"""
+
+from __future__ import (division, print_function, generators, absolute_import)
+
+import threading
+
+from sweep import HeadlessCoordinator, base_config
+
+# seconds to wait for anything that's meant to be quick before giving up
+TIMEOUT = 10
+
+try:
+    import socketserver
+except ImportError:
+    # py2
+    import SocketServer as socketserver
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """One SMTP session."""
+
+    def reply(self, line):
+        self.wfile.write(line.encode('utf-8') + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.sessions += 1
+            session = server.sessions
+        self.reply('220 test ready')
+        # the message so far: lines after DATA, or BDAT chunks
+        chunks = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                if session in server.drop_at_ehlo:
+                    return
+                lines = ['test'] + list(server.extensions)
+                for ext in lines[:-1]:
+                    self.reply('250-' + ext)
+                self.reply('250 ' + lines[-1])
+            elif verb == 'HELO':
+                self.reply('250 test')
+            elif verb in ('MAIL', 'RCPT'):
+                with server.lock:
+                    server.commands.append(line.rstrip(b'\r\n'))
+                self.reply('250 ok')
+            elif verb == 'DATA':
+                self.reply('354 go ahead')
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b'.\r\n', b''):
+                        break
+                    chunks.append(line[1:] if line[:1] == b'.' else line)
+                self.received(chunks)
+                self.reply('250 queued')
+            elif verb == 'BDAT':
+                # BDAT <size> [LAST]; the chunk follows straight away
+                args = command.split()[1:]
+                size = int(args[0])
+                with server.lock:
+                    server.commands.append(line.rstrip(b'\r\n'))
+                chunks.append(self.rfile.read(size))
+                if args[1:] == ['LAST']:
+                    self.received(chunks)
+                    self.reply('250 queued')
+                else:
+                    self.reply('250 {} octets received'.format(size))
+            elif verb in ('RSET', 'NOOP'):
+                if verb == 'RSET':
+                    del chunks[:]
+                self.reply('250 ok')
+            elif verb == 'QUIT':
+                with server.lock:
+                    server.quits += 1
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('502 not implemented')
+
+    def received(self, chunks):
+        """Keep a whole message, and clear chunks for the next one."""
+        with self.server.lock:
+            self.server.messages += 1
+            self.server.bodies.append(b''.join(chunks))
+        del chunks[:]
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    """
+    Listens on a free port on localhost, serving from a background thread
+    until shutdown().  Counts sessions, messages and QUITs, and keeps the
+    MAIL, RCPT and BDAT commands it was sent and the messages' bodies, as
+    bytes.  Takes bodies after DATA or in BDAT chunks.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, extensions=(), drop_at_ehlo=()):
+        """
+        :extensions: EHLO keywords to advertise.
+        :drop_at_ehlo: numbers of the sessions (counting from 1) to hang up
+                       on instead of answering their EHLO.
+        """
+        socketserver.ThreadingTCPServer.__init__(self, ('127.0.0.1', 0),
+                                                 _Handler)
+        self.extensions = extensions
+        self.drop_at_ehlo = set(drop_at_ehlo)
+        self.lock = threading.Lock()
+        self.sessions = self.messages = self.quits = 0
+        self.commands = []
+        self.bodies = []
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    @property
+    def address(self):
+        """The server's "host:port"."""
+        return '{}:{}'.format(*self.server_address)
+
+    def shutdown(self):
+        socketserver.ThreadingTCPServer.shutdown(self)
+        self.server_close()
+
+
+def call_with_timeout(func):
+    """Call func on another thread; return what it returned or raise what
+    it raised, or fail if it takes longer than TIMEOUT."""
+    result = {}
+
+    def target():
+        try:
+            result['value'] = func()
+        except Exception as exc:  # pylint: disable=W0703
+            result['error'] = exc
+
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    thread.join(TIMEOUT)
+    if thread.is_alive():
+        raise AssertionError("still waiting after {} sec".format(TIMEOUT))
+    if 'error' in result:
+        raise result['error']
+    return result['value']
+
+
+def run_headless(server, amount, **settings):
+    """
+    Send amount emails to server on one thread, with the given settings on
+    top of settings.json.  Returns the HeadlessCoordinator and the run's
+    results, as sweep.summarize gives them.
+    """
+    base = {'server': server.address, 'debug': False, 'use_auth': False,
+            'use_starttls': False, 'history_db': '', 'metrics_port': 0,
+            'amount': amount, 'mt_mode': 'none', 'wait_on_retry': False}
+    base.update(settings)
+    coordinator = HeadlessCoordinator(*base_config({'settings': base}))
+    results = call_with_timeout(lambda: coordinator.run({}))
+    return coordinator, results
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""Tests for addrparse.py."""
+
+import time
+import unittest
+
+from addrparse import PATHOLOGICAL, check_address, conformance
+
+
+class CheckAddressTest(unittest.TestCase):
+
+    def test_agrees_with_regex(self):
+        self.assertEqual(conformance(n_random=3000, seed=1), [])
+
+    def test_valid(self):
+        for address in ('user@example.com', 'a.b+c@mail.example.com',
+                        'user@[192.168.0.1]', '"odd\\"one"@example.com'):
+            self.assertEqual(check_address(address), (True, None), address)
+
+    def test_reasons(self):
+        self.assertEqual(check_address('no at sign here').reason,
+                         "there's no '@'")
+        self.assertEqual(check_address('user@localhost').reason,
+                         "the domain needs at least one '.'")
+        self.assertIn("not '-'", check_address('user@-example.com').reason)
+
+    def test_linear_time(self):
+        # the regex takes minutes on some of these at this length
+        for name, make in PATHOLOGICAL:
+            text = make(20000)
+            start = time.time()
+            check_address(text)
+            self.assertLess(time.time() - start, 1.0, name)
+
+
+if __name__ == '__main__':
+    unittest.main()
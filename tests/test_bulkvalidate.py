@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""Tests for bulkvalidate.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import bulkvalidate
+from addrparse import check_address
+
+VALID = ['user{}@example.com', '"quoted {}"@example.com',
+         'first.last+{}@sub.example.org', 'x{}@[192.168.0.1]']
+INVALID = ['no-at-sign-{}', 'two@@at{}.com', 'trailing{}.@example.com',
+           'spaces {}@example.com', '@nolocal{}.com']
+
+
+class ValidateListTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.list = os.path.join(self.folder, 'list.txt')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write_list(self, n):
+        """Write a list of n different addresses, a mix of valid and
+        invalid, with comments, blank lines and repeats (in other cases)
+        in between.  Returns the addresses in order and the repeats."""
+        patterns = VALID + INVALID
+        addresses = [patterns[i % len(patterns)].format(i)
+                     for i in range(n)]
+        repeats = []
+        with open(self.list, 'w') as listfile:
+            listfile.write('# a comment\n\n')
+            for i, address in enumerate(addresses):
+                listfile.write(address + '\n')
+                if i % 7 == 0:
+                    repeats.append(address.upper())
+                    listfile.write('  ' + address.upper() + '\n\n')
+        return addresses, repeats
+
+    def read(self, suffix):
+        with open(self.list + suffix) as out:
+            return out.read().splitlines()
+
+    def check(self, n, **kwargs):
+        addresses, repeats = self.write_list(n)
+        counts = bulkvalidate.validate_list(self.list, **kwargs)
+
+        valid = [a for a in addresses if check_address(a).reason is None]
+        invalid = ['{}\t{}'.format(a, check_address(a).reason)
+                   for a in addresses if check_address(a).reason is not None]
+        self.assertTrue(valid and invalid)
+        self.assertEqual(self.read('.valid'), valid)
+        self.assertEqual(self.read('.invalid'), invalid)
+        self.assertEqual(self.read('.duplicates'), repeats)
+        self.assertEqual(counts, {'read': n + len(repeats),
+                                  'valid': len(valid),
+                                  'invalid': len(invalid),
+                                  'duplicate': len(repeats)})
+
+    def test_small_list_in_process(self):
+        with mock.patch.object(bulkvalidate.multiprocessing, 'Pool') as pool:
+            self.check(200)
+        self.assertFalse(pool.called)
+
+    def test_one_process(self):
+        with mock.patch.object(bulkvalidate, 'CHUNK_SIZE', 10), \
+                mock.patch.object(bulkvalidate.multiprocessing,
+                                  'Pool') as pool:
+            self.check(200, processes=1)
+        self.assertFalse(pool.called)
+
+    def test_chunks_in_a_pool(self):
+        # many chunks, and more of them than the window of chunks in flight
+        with mock.patch.object(bulkvalidate, 'CHUNK_SIZE', 7):
+            self.check(500, processes=2)
+
+    def test_exactly_one_chunk(self):
+        with mock.patch.object(bulkvalidate, 'CHUNK_SIZE', 50):
+            self.check(50, processes=2)
+
+    def test_empty_list(self):
+        with open(self.list, 'w') as listfile:
+            listfile.write('# nothing here\n')
+        counts = bulkvalidate.validate_list(self.list, processes=2)
+        self.assertEqual(counts, {'read': 0, 'valid': 0, 'invalid': 0,
+                                  'duplicate': 0})
+        self.assertEqual(self.read('.valid'), [])
+
+    def test_prefix(self):
+        self.write_list(10)
+        prefix = os.path.join(self.folder, 'out')
+        bulkvalidate.validate_list(self.list, prefix)
+        for suffix in ('.valid', '.invalid', '.duplicates'):
+            self.assertTrue(os.path.exists(prefix + suffix))
+
+
+if __name__ == '__main__':
+    unittest.main()
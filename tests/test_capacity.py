@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""Tests for capacity.py."""
+
+import unittest
+
+from capacity import DEFAULT_SLO, CapacitySearch, check_slo, format_step
+
+from smtpserver import SMTPServer
+
+
+def results(**changes):
+    """A step's results, as sweep.summarize gives them, meeting every
+    default SLO at 100 mails/sec."""
+    base = {'sent': 1000, 'failed': 0, 'rate': 100.0, 'p99': 0.1,
+            'mean_latency': 0.05, 'conn_errors': 0, 'error': ''}
+    base.update(changes)
+    return base
+
+
+class CheckSLOTest(unittest.TestCase):
+
+    def broken(self, tempfail_rate=0.0, **changes):
+        return check_slo(DEFAULT_SLO, 100.0, results(**changes),
+                         tempfail_rate)
+
+    def test_ok(self):
+        self.assertEqual(self.broken(), [])
+        # no latencies at all isn't a p99 problem in itself
+        self.assertEqual(self.broken(p99=None), [])
+
+    def test_each_slo(self):
+        self.assertEqual(len(self.broken(p99=0.6)), 1)
+        self.assertEqual(len(self.broken(tempfail_rate=0.02)), 1)
+        self.assertEqual(len(self.broken(conn_errors=1)), 1)
+        self.assertEqual(len(self.broken(rate=90.0)), 1)
+        self.assertEqual(len(self.broken(error="nothing sent")), 1)
+
+    def test_all_at_once(self):
+        self.assertEqual(len(self.broken(tempfail_rate=0.5, p99=2,
+                                         conn_errors=3, rate=1.0)), 4)
+
+
+class ModelSearch(CapacitySearch):
+    """A CapacitySearch against a modelled server, which meets its SLOs up
+    to `limit` mails/sec, and fails `flaky` of its confirmation runs."""
+
+    def __init__(self, spec, limit, flaky=0):
+        spec = dict(spec, settings={'debug': False})
+        CapacitySearch.__init__(self, spec, report=lambda line: None)
+        self.limit = limit
+        self.flaky = flaky
+        self.offered = []
+
+    def trial(self, rate, phase):
+        self.offered.append((phase, rate))
+        ok = rate <= self.limit
+        if phase == 'confirm' and self.flaky:
+            self.flaky -= 1
+            ok = False
+        self.steps.append({'phase': phase, 'offered': rate,
+                           'achieved': min(rate, self.limit),
+                           'concurrency': 1.0, 'ok': ok})
+        return ok
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_step_mode(self):
+        search = ModelSearch({'mode': 'step', 'start_rate': 50, 'step': 50,
+                              'precision': 0.05}, limit=430)
+        result = search.run()
+        ramp = [rate for phase, rate in search.offered if phase == 'ramp']
+        self.assertEqual(ramp, [50, 100, 150, 200, 250, 300, 350, 400, 450])
+        self.assertLessEqual(result['rate'], 430)
+        self.assertGreaterEqual(result['rate'], 430 / 1.05)
+        self.assertEqual(search.offered[-1], ('confirm', result['rate']))
+
+    def test_search_mode(self):
+        search = ModelSearch({'mode': 'search', 'start_rate': 10,
+                              'precision': 0.02}, limit=1000)
+        result = search.run()
+        ramp = [rate for phase, rate in search.offered if phase == 'ramp']
+        self.assertEqual(ramp, [10, 20, 40, 80, 160, 320, 640, 1280])
+        self.assertLessEqual(result['rate'], 1000)
+        self.assertGreaterEqual(result['rate'], 1000 / 1.02)
+
+    def test_backs_off_when_confirmation_fails(self):
+        search = ModelSearch({'mode': 'step', 'start_rate': 100,
+                              'step': 100, 'precision': 0.05,
+                              'backoff': 0.1}, limit=300, flaky=1)
+        result = search.run()
+        confirms = [rate for phase, rate in search.offered
+                    if phase == 'confirm']
+        self.assertEqual(len(confirms), 2)
+        self.assertAlmostEqual(confirms[1], confirms[0] * 0.9)
+        self.assertEqual(result['rate'], confirms[1])
+
+    def test_max_rate_reached(self):
+        search = ModelSearch({'mode': 'step', 'start_rate': 100,
+                              'step': 100, 'max_rate': 300}, limit=1000)
+        self.assertEqual(search.run()['rate'], 300)
+
+    def test_nothing_sustainable(self):
+        search = ModelSearch({'start_rate': 100}, limit=50)
+        self.assertIsNone(search.run()['rate'])
+        self.assertEqual(search.offered, [('ramp', 100)])
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            ModelSearch({'mode': 'guess'}, limit=1)
+
+
+class TrialTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SMTPServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_short_search(self):
+        lines = []
+        search = CapacitySearch({
+            'settings': {'server': self.server.address, 'debug': False,
+                         'use_auth': False, 'use_starttls': False,
+                         'history_db': ''},
+            'concurrency': 2, 'step_duration': 1, 'warmup': 0,
+            'start_rate': 20, 'step': 20, 'max_rate': 40,
+            'slo': {'min_rate_ratio': 0.5}}, report=lines.append)
+        result = search.run()
+        self.assertEqual(result['rate'], 40)
+        self.assertEqual([step['phase'] for step in search.steps],
+                         ['ramp', 'ramp', 'confirm'])
+        for step in search.steps:
+            self.assertTrue(step['ok'], step['broken'])
+            self.assertEqual(step['tempfail_rate'], 0)
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], format_step(search.steps[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
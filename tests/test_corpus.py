@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Tests for corpus.py."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    from unittest import mock
+except ImportError:
+    # py2
+    import mock
+
+from corpus import Corpus, CorpusSource
+
+MBOX = (b'From a@x.test Mon Jan  1 00:00:00 2024\n'
+        b'Subject: one\n\nfirst\n\n'
+        b'From b@x.test Mon Jan  1 00:00:01 2024\n'
+        b'Subject: two\n\nsecond\n>From the quoted line\n\n'
+        b'From c@x.test Mon Jan  1 00:00:02 2024\n'
+        b'Subject: three\n\nthird\n')
+
+
+class CorpusTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mbox = os.path.join(self.folder, 'test.mbox')
+        with open(self.mbox, 'wb') as mbox:
+            mbox.write(MBOX)
+        self.corpora = []
+
+    def tearDown(self):
+        for corpus in self.corpora:
+            corpus.close()
+        shutil.rmtree(self.folder)
+
+    def open(self, path=None):
+        corpus = Corpus(path or self.mbox)
+        self.corpora.append(corpus)
+        return corpus
+
+    def test_mbox_messages(self):
+        corpus = self.open()
+        self.assertEqual(len(corpus), 3)
+        self.assertEqual(bytes(corpus.message(0)),
+                         b'Subject: one\n\nfirst\n')
+        self.assertEqual(bytes(corpus.message(1)),
+                         b'Subject: two\n\nsecond\n>From the quoted line\n')
+        self.assertEqual(bytes(corpus.message(2)),
+                         b'Subject: three\n\nthird\n')
+
+    def test_index_saved_and_reused(self):
+        first = self.open()
+        self.assertTrue(os.path.exists(first.index_path))
+        with mock.patch.object(Corpus, '_build_index',
+                               side_effect=AssertionError("rebuilt")):
+            second = self.open()
+        self.assertEqual(list(second.offsets), list(first.offsets))
+
+    def test_stale_index_rebuilt(self):
+        self.open().close()
+        with open(self.mbox, 'ab') as mbox:
+            mbox.write(b'\nFrom d@x.test Mon Jan  1 00:00:03 2024\n'
+                       b'Subject: four\n\nfourth\n')
+        corpus = self.open()
+        self.assertEqual(len(corpus), 4)
+        self.assertEqual(bytes(corpus.message(3)),
+                         b'Subject: four\n\nfourth\n')
+
+    def test_corrupt_index_rebuilt(self):
+        corpus = self.open()
+        with open(corpus.index_path, 'wb') as index:
+            index.write(b'garbage')
+        self.assertEqual(len(self.open()), 3)
+
+    def test_eml_directory(self):
+        folder = os.path.join(self.folder, 'eml')
+        os.makedirs(os.path.join(folder, 'sub'))
+        for name, text in (('b.eml', b'B'), ('a.EML', b'A'),
+                           ('sub/c.eml', b'C'), ('notes.txt', b'no')):
+            with open(os.path.join(folder, name), 'wb') as eml:
+                eml.write(text)
+        corpus = self.open(folder)
+        self.assertEqual([corpus.message(i) for i in range(len(corpus))],
+                         [b'A', b'B', b'C'])
+
+    def test_empty(self):
+        empty = os.path.join(self.folder, 'empty.mbox')
+        open(empty, 'wb').close()
+        with self.assertRaises(ValueError):
+            Corpus(empty)
+
+
+class CorpusSourceTest(unittest.TestCase):
+
+    class Numbers(object):
+        """A stand-in Corpus whose message i is i."""
+
+        def __init__(self, n):
+            self.n = n
+
+        def __len__(self):
+            return self.n
+
+        def message(self, i):
+            return i
+
+    def take(self, source, n):
+        return [next(source) for _ in range(n)]
+
+    def test_sequential_shards(self):
+        corpus = self.Numbers(5)
+        self.assertEqual(self.take(CorpusSource(corpus, shard=0, n_shards=2),
+                                   5), [0, 2, 4, 0, 2])
+        self.assertEqual(self.take(CorpusSource(corpus, shard=1, n_shards=2),
+                                   4), [1, 3, 1, 3])
+
+    def test_more_workers_than_messages(self):
+        source = CorpusSource(self.Numbers(2), shard=3, n_shards=4)
+        self.assertEqual(self.take(source, 3), [0, 1, 0])
+
+    def test_random_repeatable(self):
+        corpus = self.Numbers(100)
+        first = self.take(CorpusSource(corpus, 'random', 1, 2, seed=7), 20)
+        again = self.take(CorpusSource(corpus, 'random', 1, 2, seed=7), 20)
+        other = self.take(CorpusSource(corpus, 'random', 0, 2, seed=7), 20)
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+
+    def test_unknown_order(self):
+        with self.assertRaises(ValueError):
+            CorpusSource(self.Numbers(1), 'backwards')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Tests for emailbuilder.py's Email."""
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from email import message_from_bytes
+
+from emailbuilder import Email
+from headers import Headers
+
+# multipart boundaries are random each time a message is built
+BOUNDARY = re.compile(r'={15}\d+==')
+
+
+class FakeCoordinator(object):
+    """Just what an Email and its Headers look at."""
+
+    def __init__(self, **contents):
+        self.contents = {'text': "Hello there.", 'attach': '',
+                         'subject': "Test", 'account': 'me@example.com',
+                         'headers': {'from': 'me@example.com',
+                                     'to': 'you@example.com',
+                                     # fixed, so two builds can be compared
+                                     'date': 'Mon, 19 Oct 2026 12:00:00 '
+                                             '+0000',
+                                     'message-id': '<1@example.com>'}}
+        self.contents.update(contents)
+        self.email = None
+
+
+def build(coordinator):
+    """A freshly built Email, with its Headers, for a coordinator."""
+    email = Email(coordinator, None)
+    coordinator.email = email
+    email.headers = Headers(coordinator, email)
+    email.pull_data_from_coordinator()
+    return email
+
+
+class RenderTest(unittest.TestCase):
+    """Re-rendering after a change gives the same message as building it
+    again from scratch."""
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def assertSameAsRebuilt(self, email, coordinator):
+        rebuilt = build(coordinator)
+        rebuilt.headers.headers = [dict(entry) for entry in
+                                   email.headers.headers]
+        rebuilt.headers.dirty = True
+        self.assertEqual(BOUNDARY.sub('BOUNDARY', email.as_string()),
+                         BOUNDARY.sub('BOUNDARY', rebuilt.as_string()))
+
+    def count_body_builds(self, email):
+        """Count the calls to email._build_body from now on."""
+        builds = []
+        build_body = email._build_body
+
+        def counted():
+            builds.append(1)
+            return build_body()
+
+        email._build_body = counted
+        return builds
+
+    def test_header_change(self):
+        coordinator = FakeCoordinator()
+        email = build(coordinator)
+        builds = self.count_body_builds(email)
+        email.headers.add_or_update_header('To', 'someone@example.com')
+        email.headers.add_header('Comments', 'first')
+        email.headers.add_header('comments', 'second')
+        self.assertTrue(email.dirty)
+        self.assertIn('to: someone@example.com', email.as_string())
+        self.assertEqual(builds, [])
+        self.assertSameAsRebuilt(email, coordinator)
+
+    def test_header_disabled(self):
+        coordinator = FakeCoordinator()
+        email = build(coordinator)
+        email.as_string()
+        email.headers.update_entry(email.headers.get_entry('sender'),
+                                   enabled=False)
+        self.assertNotIn('sender:', email.as_string().lower())
+        self.assertSameAsRebuilt(email, coordinator)
+
+    def test_subject_change(self):
+        coordinator = FakeCoordinator()
+        email = build(coordinator)
+        builds = self.count_body_builds(email)
+        coordinator.contents['subject'] = "Changed"
+        email.pull_data_from_coordinator()
+        self.assertIn('subject: Changed', email.as_string())
+        self.assertEqual(email.as_string().count('subject:'), 1)
+        self.assertEqual(builds, [])
+        self.assertSameAsRebuilt(email, coordinator)
+
+    def test_header_named_like_a_mime_header(self):
+        headers = dict(FakeCoordinator().contents['headers'])
+        headers['Content-Type'] = 'text/plain; format=flowed'
+        coordinator = FakeCoordinator(headers=headers)
+        email = build(coordinator)
+        before = email.as_string()
+        self.assertEqual(before.count('Content-Type:'), 2)
+        email.headers.add_or_update_header('to', 'someone@example.com')
+        after = email.as_string()
+        self.assertEqual(after.count('Content-Type:'), 2)
+        self.assertIn('Content-Type: text/plain; charset="us-ascii"', after)
+        self.assertSameAsRebuilt(email, coordinator)
+
+    def test_body_change_keeps_headers(self):
+        coordinator = FakeCoordinator()
+        email = build(coordinator)
+        email.headers.add_header('X-Test', 'kept')
+        email.as_string()
+        coordinator.contents['text'] = "Something else."
+        email.pull_data_from_coordinator()
+        self.assertIn('Something else.', email.as_string())
+        self.assertEqual(email.as_string().count('X-Test: kept'), 1)
+        self.assertSameAsRebuilt(email, coordinator)
+
+    def test_single_part_fast_path(self):
+        email = build(FakeCoordinator())
+        self.assertFalse(email.getmime().is_multipart())
+
+    def test_attachment_header_change(self):
+        path = os.path.join(self.folder, 'data.bin')
+        with open(path, 'wb') as attachment:
+            attachment.write(bytes(range(256)))
+        coordinator = FakeCoordinator(attach=path)
+        email = build(coordinator)
+        self.assertTrue(email.getmime().is_multipart())
+        builds = self.count_body_builds(email)
+        email.headers.add_or_update_header('to', 'someone@example.com')
+        email.pull_data_from_coordinator()
+        self.assertIn('someone@example.com', email.as_string())
+        self.assertEqual(builds, [])
+        self.assertSameAsRebuilt(email, coordinator)
+
+
+class WireTest(unittest.TestCase):
+    """as_wire picks each part's encoding from what the server takes, and
+    parsing what it gives back yields the original text and files."""
+
+    TEXT = "Grüße aus Köln.\nZweite Zeile."
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        # random bytes, bare CRs and LFs and NULs included
+        self.binary = self.attachment('data.bin', bytes(range(256)) * 8 +
+                                      b'\r\n.\r\nend\r')
+        # short 8-bit CRLF lines, which can go as they are under 8BITMIME
+        self.lines = self.attachment('lines.txt',
+                                     "naïve\r\n.café\r\n".encode('utf-8') *
+                                     20)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def attachment(self, name, data):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as attachment:
+            attachment.write(data)
+        return path, data
+
+    def parts(self, body_type):
+        """Render for body_type and parse it again.  Returns the text and
+        attachment parts."""
+        email = build(FakeCoordinator(text=self.TEXT, attach='{},{}'.format(
+            self.binary[0], self.lines[0])))
+        data = email.as_wire(body_type)
+        self.assertNotIn(b'emailer-part-', data)
+        if body_type == '7bit':
+            self.assertFalse(any(byte > 127 for byte in data))
+        return message_from_bytes(data).get_payload()
+
+    def assertRoundTrip(self, body_type, encodings):
+        text, binary, lines = self.parts(body_type)
+        self.assertEqual([part['Content-Transfer-Encoding']
+                          for part in (text, binary, lines)], encodings)
+        self.assertEqual(text.get_payload(decode=True).decode('utf-8')
+                         .replace('\r\n', '\n'), self.TEXT)
+        self.assertEqual(binary.get_payload(decode=True), self.binary[1])
+        self.assertEqual(lines.get_payload(decode=True), self.lines[1])
+        self.assertEqual(binary.get_filename(), 'data.bin')
+
+    def test_7bit(self):
+        self.assertRoundTrip('7bit', ['base64', 'base64', 'base64'])
+
+    def test_8bit(self):
+        self.assertRoundTrip('8bit', ['8bit', 'base64', '8bit'])
+
+    def test_binary(self):
+        self.assertRoundTrip('binary', ['8bit', 'binary', 'binary'])
+
+    def test_cheaper_encodings_are_smaller(self):
+        email = build(FakeCoordinator(text=self.TEXT,
+                                      attach=self.binary[0]))
+        sizes = [len(email.as_wire(body_type))
+                 for body_type in ('7bit', '8bit', 'binary')]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+        self.assertLess(sizes[2], len(self.binary[1]) * 4 // 3)
+
+    def test_mostly_ascii_text_is_quoted_printable(self):
+        email = build(FakeCoordinator(text="Plain text, then é.\n" * 10))
+        message = message_from_bytes(email.as_wire('7bit'))
+        self.assertEqual(message['Content-Transfer-Encoding'],
+                         'quoted-printable')
+
+    def test_ascii_text_is_7bit(self):
+        email = build(FakeCoordinator())
+        for body_type in ('7bit', '8bit', 'binary'):
+            message = message_from_bytes(email.as_wire(body_type))
+            self.assertEqual(message['Content-Transfer-Encoding'], '7bit')
+            self.assertEqual(message.get_payload(), "Hello there.")
+
+    def test_cached_until_changed(self):
+        coordinator = FakeCoordinator()
+        email = build(coordinator)
+        self.assertIs(email.as_wire('8bit'), email.as_wire('8bit'))
+        email.headers.add_or_update_header('to', 'someone@example.com')
+        self.assertIn(b'someone@example.com', email.as_wire('8bit'))
+
+
+if __name__ == '__main__':
+    unittest.main()
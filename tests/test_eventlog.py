@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Tests for eventlog.py's binary event log."""
+
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+import unittest
+
+from eventlog import (EventLog, EventRecord, read_events, MAGIC, HEADER,
+                      RECORD, VERSION, FLAG_COMPRESSED)
+
+
+def event(worker, n):
+    """The fields of the n'th record from a worker, made up so each record
+    is different and survives packing as it is."""
+    return (1500000000.0 + n, worker, 0.25, 0.5, 0.75 + n, 1000 + n,
+            250 if n % 2 else 451)
+
+
+def log_event(log, worker, n):
+    """Log the n'th record from a worker."""
+    timestamp, _, connect, send, total, nbytes, code = event(worker, n)
+    log.log(worker, timestamp, connect, send, total, nbytes, code)
+
+
+class EventLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'events.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, n_workers, per_worker, **kwargs):
+        """Log per_worker records from each of n_workers threads at once,
+        then close the log.  Returns the EventLog."""
+        # a long interval, so everything's still buffered at close()
+        kwargs.setdefault('flush_interval', 60)
+        log = EventLog(self.filename, n_workers, **kwargs)
+
+        def worker(index):
+            for n in range(per_worker):
+                log_event(log, index, n)
+
+        threads = [threading.Thread(target=worker, args=(i,))
+                   for i in range(n_workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.close()
+        return log
+
+    def read_header(self):
+        with open(self.filename, 'rb') as logfile:
+            self.assertEqual(logfile.read(len(MAGIC)), MAGIC)
+            header = HEADER.unpack(logfile.read(HEADER.size))
+            fmt = logfile.read(header[-1])
+        return header, fmt
+
+    def assertRoundTrip(self, n_workers, per_worker, sample=1, **kwargs):
+        log = self.write(n_workers, per_worker, sample=sample, **kwargs)
+        events = list(read_events(self.filename))
+        expected = [EventRecord(*event(worker, n))
+                    for worker in range(n_workers)
+                    for n in range(per_worker) if (n + 1) % sample == 0]
+        self.assertEqual(sorted(events), sorted(expected))
+        self.assertEqual(log.n_written, len(expected))
+        # each worker's records stay in order
+        for worker in range(n_workers):
+            mine = [e for e in events if e.worker == worker]
+            self.assertEqual(mine, sorted(mine))
+
+    def test_header(self):
+        self.write(1, 0, sample=3)
+        (version, flags, size, sample, _), fmt = self.read_header()
+        self.assertEqual(version, VERSION)
+        self.assertEqual(flags, 0)
+        self.assertEqual(size, RECORD.size)
+        self.assertEqual(sample, 3)
+        self.assertEqual(struct.Struct(fmt.decode('ascii')).size,
+                         RECORD.size)
+
+    def test_fixed_width_records(self):
+        self.write(2, 10)
+        _, fmt = self.read_header()
+        header_size = len(MAGIC) + HEADER.size + len(fmt)
+        self.assertEqual(os.path.getsize(self.filename),
+                         header_size + 20 * RECORD.size)
+
+    def test_round_trip(self):
+        self.assertRoundTrip(4, 500)
+
+    def test_round_trip_compressed(self):
+        self.assertRoundTrip(4, 500, compress=True)
+        (_, flags, _, _, _), _ = self.read_header()
+        self.assertTrue(flags & FLAG_COMPRESSED)
+
+    def test_compressed_is_smaller(self):
+        self.write(2, 2000)
+        plain = os.path.getsize(self.filename)
+        self.write(2, 2000, compress=True)
+        self.assertLess(os.path.getsize(self.filename), plain // 2)
+
+    def test_sampling(self):
+        self.assertRoundTrip(3, 100, sample=7)
+
+    def test_background_flush(self):
+        log = EventLog(self.filename, 1, flush_interval=0.01)
+        log_event(log, 0, 0)
+        # give the writer a few goes at it
+        for _ in range(100):
+            if log.n_written:
+                break
+            time.sleep(0.01)
+        self.assertEqual(log.n_written, 1)
+        log.close()
+        self.assertEqual(list(read_events(self.filename)),
+                         [EventRecord(*event(0, 0))])
+
+    def test_flush_on_close(self):
+        log = self.write(2, 50)
+        self.assertEqual(log.n_written, 100)
+        self.assertEqual(len(list(read_events(self.filename))), 100)
+
+    def test_not_an_event_log(self):
+        with open(self.filename, 'wb') as logfile:
+            logfile.write(b'not an event log')
+        with self.assertRaises(ValueError):
+            list(read_events(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
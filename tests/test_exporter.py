@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Tests for exporter.py's Prometheus output."""
+
+import re
+import unittest
+
+try:
+    from urllib.request import urlopen
+except ImportError:
+    # py2
+    from urllib2 import urlopen
+
+from exporter import render_metrics, MetricsExporter, CONTENT_TYPE
+from loadprofile import LoadProfile
+from metrics import SendMetrics, LATENCY_BUCKETS, SENDING, DONE
+
+# name{labels} value
+SAMPLE = re.compile(r'^([a-z_]+)(?:\{([^}]*)\})? (\S+)$')
+
+
+def parse(text):
+    """Parse exposition text into {family: {'help': str, 'type': str,
+    'samples': [(name, labels, value)]}}."""
+    families = {}
+    for line in text.splitlines():
+        if line.startswith('# '):
+            _, kind, name, rest = line.split(' ', 3)
+            families.setdefault(name, {'samples': []})[kind.lower()] = rest
+            continue
+        match = SAMPLE.match(line)
+        assert match, "bad sample line: " + line
+        name, labels, value = match.groups()
+        family = re.sub(r'_(bucket|sum|count)$', '', name) \
+            if name not in families else name
+        families[family]['samples'].append((name, labels or '',
+                                            float(value)))
+    return families
+
+
+def sample_run():
+    """A SendMetrics for a run that's begun, with two workers' worth of
+    sends and failures."""
+    profile = LoadProfile([{'duration': 60, 'rate': 50}])
+    profile.begin()
+    run = SendMetrics(2, 100, profile)
+    first, second = run.workers
+    for delta in (LATENCY_BUCKETS[0] / 2, LATENCY_BUCKETS[2],
+                  LATENCY_BUCKETS[-1] * 2):
+        first.record_send(delta)
+    second.record_send(LATENCY_BUCKETS[2])
+    # warm-up sends aren't in the histogram
+    second.record_send(1.0, counted=False)
+    first.record_failure(550)
+    second.record_failure(550)
+    second.record_failure(451)
+    first.reconnects = 3
+    first.state, second.state = SENDING, DONE
+    return run
+
+
+class RenderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.families = parse(render_metrics(sample_run()))
+
+    def test_no_run(self):
+        self.assertEqual(render_metrics(None), "\n")
+        unstarted = SendMetrics(1, 10, LoadProfile())
+        self.assertEqual(render_metrics(unstarted), "\n")
+
+    def test_every_family_has_help_and_type(self):
+        for name, family in self.families.items():
+            self.assertTrue(name.startswith('emailer_'), name)
+            self.assertTrue(family.get('help'), name)
+            self.assertIn(family.get('type'),
+                          ('counter', 'gauge', 'histogram'), name)
+            if family['type'] == 'counter':
+                self.assertTrue(name.endswith('_total'), name)
+
+    def test_counters(self):
+        sent = self.families['emailer_sent_total']
+        self.assertEqual(sent['samples'], [('emailer_sent_total', '', 5)])
+        reconnects = self.families['emailer_reconnects_total']
+        self.assertEqual(reconnects['samples'][0][2], 3)
+
+    def test_labelled_failures(self):
+        failed = self.families['emailer_failed_total']
+        self.assertEqual(failed['type'], 'counter')
+        self.assertEqual(failed['samples'],
+                         [('emailer_failed_total', 'code="451"', 1),
+                          ('emailer_failed_total', 'code="550"', 2)])
+
+    def test_worker_states(self):
+        workers = dict((labels, value) for _, labels, value in
+                       self.families['emailer_workers']['samples'])
+        self.assertEqual(workers['state="sending"'], 1)
+        self.assertEqual(workers['state="done"'], 1)
+        self.assertEqual(workers['state="idle"'], 0)
+
+    def test_target_rate(self):
+        target = self.families['emailer_target_rate']['samples']
+        self.assertEqual(target, [('emailer_target_rate', '', 50)])
+
+    def test_histogram(self):
+        family = self.families['emailer_send_latency_seconds']
+        self.assertEqual(family['type'], 'histogram')
+        samples = family['samples']
+        buckets = [s for s in samples
+                   if s[0] == 'emailer_send_latency_seconds_bucket']
+        self.assertEqual(len(buckets), len(LATENCY_BUCKETS) + 1)
+        self.assertEqual([labels for _, labels, _ in buckets],
+                         ['le="{}"'.format(bound) for bound in
+                          LATENCY_BUCKETS + ('+Inf',)])
+        counts = [value for _, _, value in buckets]
+        # cumulative
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[0], 1)
+        self.assertEqual(counts[2], 3)
+        self.assertEqual(counts[-2], 3)
+        self.assertEqual(counts[-1], 4)
+
+        totals = dict((name, value) for name, _, value in samples)
+        self.assertEqual(totals['emailer_send_latency_seconds_count'], 4)
+        self.assertAlmostEqual(
+            totals['emailer_send_latency_seconds_sum'],
+            LATENCY_BUCKETS[0] / 2 + 2 * LATENCY_BUCKETS[2] +
+            LATENCY_BUCKETS[-1] * 2)
+
+
+class FakeCoordinator(object):
+    """Just what a MetricsExporter looks at."""
+
+    def __init__(self, metrics):
+        self.sender = type('Sender', (object,), {'metrics': metrics})()
+
+
+class ExporterTest(unittest.TestCase):
+
+    def test_scrape(self):
+        exporter = MetricsExporter(FakeCoordinator(sample_run()), 0)
+        exporter.start()
+        try:
+            url = 'http://127.0.0.1:{}/metrics'.format(
+                exporter.server.server_address[1])
+            response = urlopen(url, timeout=10)
+            self.assertEqual(response.headers['Content-Type'], CONTENT_TYPE)
+            families = parse(response.read().decode('utf-8'))
+        finally:
+            exporter.stop()
+        self.assertEqual(families['emailer_sent_total']['samples'][0][2], 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
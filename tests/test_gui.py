@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""Tests for the main window.  Skipped where there's no display to open
+it on."""
+
+import unittest
+
+try:
+    import tkinter as tk
+except ImportError:
+    import Tkinter as tk
+
+
+def has_display():
+    """Whether a Tk window can be opened here."""
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return False
+    root.destroy()
+    return True
+
+
+@unittest.skipUnless(has_display(), "no display")
+class ResetTest(unittest.TestCase):
+
+    def setUp(self):
+        from coordinator import Coordinator
+        self.coordinator = Coordinator()
+        self.gui = self.coordinator.gui
+        self.gui.spawn_gui()
+
+    def tearDown(self):
+        self.gui.root.destroy()
+
+    def test_reset_before_progress_page_is_built(self):
+        from gui_callbacks import handle_reset
+        self.assertFalse(self.gui.page_built('progress'))
+        handle_reset(self.coordinator)
+        self.assertFalse(self.gui.page_built('progress'))
+        self.assertTrue(self.coordinator.ready_to_send)
+
+    def test_reset_after_progress_page_is_built(self):
+        from gui_callbacks import handle_reset
+        self.gui.build_page('progress')
+        self.gui.variables['progressbar'].set(3)
+        handle_reset(self.coordinator)
+        self.assertEqual(self.gui.variables['progressbar'].get(), 0)
+        self.assertIsNone(self.gui.heatmap)
+        self.assertTrue(self.coordinator.ready_to_send)
+
+
+if __name__ == '__main__':
+    unittest.main()
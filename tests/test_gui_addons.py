@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tests for gui_addons.py's WorkerHeatmap, drawn on a fake canvas so no
+display is needed."""
+
+import unittest
+from unittest import mock
+
+try:
+    import gui_addons
+except ImportError:
+    # no tkinter at all
+    gui_addons = None
+
+from metrics import IDLE, CONNECTING, SENDING, RETRYING, DONE
+
+
+class FakeCanvas(object):
+    """Keeps the rectangles a WorkerHeatmap draws, and counts the changes
+    made to them."""
+
+    def __init__(self, master, width, height, **options):
+        self.width = width
+        self.height = height
+        # item id -> {'coords': [x0, y0, x1, y1], 'fill': str}
+        self.items = {}
+        self.changes = 0
+
+    def create_rectangle(self, x0, y0, x1, y1, **options):
+        item = len(self.items) + 1
+        self.items[item] = {'coords': [x0, y0, x1, y1],
+                            'fill': options.get('fill')}
+        return item
+
+    def itemconfigure(self, item, fill):
+        self.items[item]['fill'] = fill
+        self.changes += 1
+
+    def coords(self, item, x0, y0, x1, y1):
+        self.items[item]['coords'] = [x0, y0, x1, y1]
+        self.changes += 1
+
+
+@unittest.skipIf(gui_addons is None, "no tkinter")
+class WorkerHeatmapTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(gui_addons.tk, 'Canvas', FakeCanvas)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def heatmap(self, n_workers, amounts=None, **kwargs):
+        return gui_addons.WorkerHeatmap(None, n_workers, amounts, **kwargs)
+
+    def fills(self, heatmap):
+        return [heatmap.canvas.items[cell]['fill'] for cell in heatmap.cells]
+
+    def heights(self, heatmap):
+        return [heatmap.canvas.items[bar]['coords'][3] -
+                heatmap.canvas.items[bar]['coords'][1]
+                for bar in heatmap.bars]
+
+    def test_state_colours(self):
+        heatmap = self.heatmap(5, [10] * 5)
+        colors = gui_addons.WorkerHeatmap.STATE_COLORS
+        self.assertEqual(self.fills(heatmap), [colors[IDLE]] * 5)
+        states = (IDLE, CONNECTING, SENDING, RETRYING, DONE)
+        heatmap.update(states, (0,) * 5)
+        self.assertEqual(self.fills(heatmap), [colors[s] for s in states])
+        self.assertEqual(len(set(colors)), len(states))
+
+    def test_only_changes_are_redrawn(self):
+        heatmap = self.heatmap(4, [10] * 4)
+        heatmap.update((SENDING,) * 4, (5, 5, 5, 5))
+        changes = heatmap.canvas.changes
+        heatmap.update((SENDING,) * 4, (5, 5, 5, 5))
+        self.assertEqual(heatmap.canvas.changes, changes)
+        heatmap.update((SENDING, SENDING, DONE, SENDING), (5, 5, 5, 5))
+        self.assertEqual(heatmap.canvas.changes, changes + 1)
+
+    def test_progress_bars(self):
+        heatmap = self.heatmap(3, [10, 20, 40], strip_height=40)
+        heatmap.update((SENDING,) * 3, (5, 5, 40))
+        self.assertEqual(self.heights(heatmap), [20, 10, 40])
+
+    def test_time_bounded_scales_to_busiest(self):
+        heatmap = self.heatmap(2, None, strip_height=40)
+        heatmap.update((SENDING,) * 2, (10, 40))
+        self.assertEqual(self.heights(heatmap), [10, 40])
+
+    def test_many_workers_share_cells(self):
+        heatmap = self.heatmap(10000, [1] * 10000, max_cells=1024)
+        self.assertEqual(heatmap.per_cell, 10)
+        self.assertEqual(len(heatmap.cells), 1000)
+        self.assertEqual(len(heatmap.bars), 1000)
+        # every cell is inside the map, and none overlap
+        corners = set()
+        for cell in heatmap.cells:
+            x0, y0, x1, y1 = heatmap.canvas.items[cell]['coords']
+            self.assertGreater(x1, x0)
+            self.assertLessEqual(x1, heatmap.canvas.width)
+            self.assertLessEqual(y1, heatmap.strip_top)
+            corners.add((x0, y0))
+        self.assertEqual(len(corners), 1000)
+
+    def test_shared_cell_shows_most_common_state(self):
+        heatmap = self.heatmap(6, [4] * 6, max_cells=2)
+        self.assertEqual(heatmap.per_cell, 3)
+        colors = gui_addons.WorkerHeatmap.STATE_COLORS
+        heatmap.update((SENDING, SENDING, IDLE, DONE, RETRYING, DONE),
+                       (2, 2, 2, 4, 4, 4))
+        self.assertEqual(self.fills(heatmap),
+                         [colors[SENDING], colors[DONE]])
+        # combined progress: 6 of 12, and 12 of 12
+        self.assertEqual(self.heights(heatmap),
+                         [heatmap.strip_height // 2, heatmap.strip_height])
+
+    def test_one_worker(self):
+        heatmap = self.heatmap(1, [5])
+        heatmap.update((DONE,), (5,))
+        self.assertEqual(self.heights(heatmap), [heatmap.strip_height])
+
+
+if __name__ == '__main__':
+    unittest.main()
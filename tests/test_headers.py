@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Tests for headers.py's Headers."""
+
+import unittest
+
+from headers import Headers
+
+
+class FakeCoordinator(object):
+    """Just what Headers looks at."""
+
+    def __init__(self, headers=None):
+        self.contents = {'account': 'me@example.com',
+                         'headers': {'from': 'me@example.com'}}
+        if headers is not None:
+            self.contents['headers'] = headers
+
+
+class HeadersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.headers = Headers(FakeCoordinator(), None)
+
+    def test_lookups_ignore_case(self):
+        self.headers.add_header('X-Mailer', 'test')
+        self.assertIn('x-mailer', self.headers)
+        self.assertIn('X-MAILER', self.headers)
+        self.assertEqual(self.headers.get_value('x-MaIlEr'), 'test')
+        self.assertIs(self.headers.get_entry('X-Mailer'),
+                      self.headers.get_entry('x-mailer'))
+        self.assertNotIn('x-other', self.headers)
+        self.assertIsNone(self.headers.get_entry('x-other'))
+        self.assertEqual(self.headers.get_value('x-other', 'none'), 'none')
+
+    def test_basics_are_made(self):
+        self.assertFalse(self.headers.check_for_required_headers())
+        self.headers.add_header('To', 'you@example.com')
+        self.assertTrue(self.headers.check_for_required_headers())
+        for name in ('date', 'message-id', 'sender', 'from'):
+            self.assertTrue(self.headers.get_value(name))
+
+    def test_user_headers_are_kept_over_basics(self):
+        headers = Headers(FakeCoordinator({'from': 'boss@example.com',
+                                           'Message-ID': '<1@example.com>',
+                                           'Sender': ''}), None)
+        # not added again under the lowercased name
+        self.assertEqual(len(headers.get_entries('message-id')), 1)
+        self.assertEqual(headers.get_value('message-id'), '<1@example.com>')
+        # empty ones are filled in
+        self.assertEqual(headers.get_value('sender'), 'me@example.com')
+        self.assertEqual(len(headers.get_entries('sender')), 1)
+        self.assertEqual(headers.get_entry('sender')['name'], 'Sender')
+
+    def test_multiple_values(self):
+        self.headers.add_header('Comments', 'first')
+        self.headers.add_header('comments', 'second')
+        self.headers.add_header('COMMENTS', '')
+        self.assertEqual([entry['value'] for entry in
+                          self.headers.get_entries('Comments')],
+                         ['first', 'second', ''])
+        self.assertEqual(self.headers.get_value('comments'), 'first')
+        # empty values are disabled unless said otherwise
+        enabled = [value for name, value in self.headers.enabled_items()
+                   if name.lower() == 'comments']
+        self.assertEqual(enabled, ['first', 'second'])
+
+    def test_order_is_kept(self):
+        names = self.headers.header_list
+        self.headers.add_header('X-B', 'b')
+        self.headers.add_header('X-A', 'a')
+        self.headers.add_header('x-b', 'b2')
+        self.assertEqual(self.headers.header_list,
+                         names + ['X-B', 'X-A', 'x-b'])
+        self.assertEqual(len(self.headers), len(names) + 3)
+
+    def test_add_or_update(self):
+        self.headers.add_or_update_header('X-Test', 'one')
+        self.headers.add_or_update_header('x-test', 'two')
+        self.assertEqual(len(self.headers.get_entries('x-test')), 1)
+        self.assertEqual(self.headers.get_value('X-Test'), 'two')
+        self.headers.add_or_update_header('X-TEST', '', enabled=False)
+        self.assertFalse(self.headers.get_entry('x-test')['enabled'])
+
+    def test_add_nonexisting_and_if_empty(self):
+        self.headers.add_nonexisting_header('From', 'other@example.com')
+        self.assertEqual(self.headers.get_value('from'), 'me@example.com')
+        self.headers.add_header('X-Empty', '')
+        self.headers.add_if_empty('x-empty', 'filled')
+        self.assertEqual(self.headers.get_value('X-Empty'), 'filled')
+        self.assertTrue(self.headers.get_entry('X-Empty')['enabled'])
+
+    def test_dirty_flag(self):
+        self.assertTrue(self.headers.dirty)
+        self.headers.mark_clean()
+        self.headers.get_value('from')
+        self.assertFalse(self.headers.dirty)
+        self.headers.update_entry(self.headers.get_entry('from'),
+                                  enabled=False)
+        self.assertTrue(self.headers.dirty)
+        self.headers.mark_clean()
+        self.headers.add_header('X-New', 'new')
+        self.assertTrue(self.headers.dirty)
+
+
+if __name__ == '__main__':
+    unittest.main()
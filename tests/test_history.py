@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Tests for history.py's statistics and run comparison."""
+
+import unittest
+
+from history import compare, difference_interval, interval_rates, \
+    mean_interval, quantile, quantile_interval, value_at_rank
+from metrics import LATENCY_BUCKETS
+
+
+def histogram(**by_bound):
+    """A latency histogram with the given counts, keyed by bucket bound
+    written like b0_001 for 0.001, or overflow."""
+    counts = [0] * (len(LATENCY_BUCKETS) + 1)
+    for key, count in by_bound.items():
+        if key == 'overflow':
+            counts[-1] = count
+        else:
+            bound = float(key[1:].replace('_', '.'))
+            counts[LATENCY_BUCKETS.index(bound)] = count
+    return counts
+
+
+def run(run_id, rates, counts, warmup=0):
+    """A run as load_run gives it, sent at the given per-second rates."""
+    samples = [(0.0, 0)]
+    for rate in rates:
+        samples.append((samples[-1][0] + 1, samples[-1][1] + rate))
+    sent = samples[-1][1]
+    return {'id': run_id, 'label': '', 'started': 0, 'duration': len(rates),
+            'warmup': warmup, 'sent': sent, 'failed': 0, 'reconnects': 0,
+            'rate': sent / float(len(rates)), 'mean_latency': None,
+            'p50': quantile(counts, 0.5), 'p95': quantile(counts, 0.95),
+            'p99': quantile(counts, 0.99), 'counts': counts,
+            'samples': samples}
+
+
+class QuantileTest(unittest.TestCase):
+
+    def test_interpolates_within_bucket(self):
+        # 10 sends between 5 and 10 ms
+        counts = histogram(b0_01=10)
+        self.assertAlmostEqual(value_at_rank(counts, 0), 0.005)
+        self.assertAlmostEqual(value_at_rank(counts, 5), 0.0075)
+        self.assertAlmostEqual(quantile(counts, 0.5), 0.0075)
+
+    def test_across_buckets(self):
+        counts = histogram(b0_001=90, b0_1=10)
+        self.assertLess(quantile(counts, 0.5), 0.001)
+        self.assertGreater(quantile(counts, 0.95), 0.05)
+
+    def test_overflow(self):
+        counts = histogram(overflow=3)
+        self.assertEqual(quantile(counts, 0.99), LATENCY_BUCKETS[-1])
+
+    def test_empty(self):
+        self.assertIsNone(quantile(histogram(), 0.5))
+        self.assertIsNone(quantile_interval(histogram(), 0.5))
+
+    def test_interval_holds_quantile(self):
+        counts = histogram(b0_001=500, b0_005=400, b0_05=90, b0_5=10)
+        low, high = quantile_interval(counts, 0.99)
+        self.assertLessEqual(low, quantile(counts, 0.99))
+        self.assertGreaterEqual(high, quantile(counts, 0.99))
+
+
+class IntervalTest(unittest.TestCase):
+
+    def test_interval_rates_skip_warmup(self):
+        samples = [(0, 0), (1, 50), (2, 150), (3, 250)]
+        self.assertEqual(interval_rates(samples, 0), [50, 100, 100])
+        self.assertEqual(interval_rates(samples, 1), [100, 100])
+
+    def test_mean_interval(self):
+        mean, half, n = mean_interval([1.0, 2.0, 3.0])
+        self.assertEqual((mean, n), (2.0, 3))
+        # t(2) = 4.303, standard error 1/sqrt(3)
+        self.assertAlmostEqual(half, 4.303 / 3 ** 0.5, places=3)
+        self.assertEqual(mean_interval([5.0]), (5.0, None, 1))
+        self.assertEqual(mean_interval([]), (None, None, 0))
+
+    def test_difference_interval(self):
+        # equal variances of 1/3 each over 3 values: 4 degrees of freedom
+        low, high = difference_interval([1.0, 2.0, 3.0], [4.0, 5.0, 6.0])
+        half = 2.776 * (2 / 3.0) ** 0.5
+        self.assertAlmostEqual(low, 3 - half, places=3)
+        self.assertAlmostEqual(high, 3 + half, places=3)
+
+    def test_difference_interval_needs_two(self):
+        self.assertIsNone(difference_interval([1.0], [1.0, 2.0]))
+
+    def test_difference_without_spread(self):
+        self.assertEqual(difference_interval([2.0, 2.0], [3.0, 3.0]),
+                         (1.0, 1.0))
+
+
+class CompareTest(unittest.TestCase):
+
+    fast = histogram(b0_001=990, b0_0025=10)
+    slow = histogram(b0_001=800, b0_05=200)
+
+    def test_same(self):
+        a = run(1, [100, 101, 99, 100, 100], self.fast)
+        b = run(2, [99, 100, 101, 100, 100], self.fast)
+        self.assertEqual(compare(a, b, 0.05, 0.1)[1], [])
+
+    def test_throughput_drop(self):
+        a = run(1, [100, 101, 99, 100, 100], self.fast)
+        b = run(2, [80, 81, 79, 80, 80], self.fast)
+        regressions = compare(a, b, 0.05, 0.1)[1]
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("throughput", regressions[0])
+
+    def test_noisy_drop_not_flagged(self):
+        a = run(1, [100, 60, 140, 100, 100], self.fast)
+        b = run(2, [140, 60, 70, 90, 100], self.fast)
+        self.assertEqual(compare(a, b, 0.05, 0.1)[1], [])
+
+    def test_p99_rise(self):
+        a = run(1, [100] * 5, self.fast)
+        b = run(2, [100] * 5, self.slow)
+        regressions = compare(a, b, 0.05, 0.1)[1]
+        self.assertEqual(len(regressions), 1)
+        self.assertIn("p99", regressions[0])
+
+    def test_p99_missing_is_said(self):
+        a = run(1, [100] * 5, histogram())
+        b = run(2, [100] * 5, self.fast)
+        lines, regressions = compare(a, b, 0.05, 0.1)
+        self.assertEqual(regressions, [])
+        self.assertIn("p99 latency: not compared, none recorded for run 1",
+                      lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
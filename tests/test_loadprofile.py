@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""Tests for loadprofile.py."""
+
+import unittest
+
+from loadprofile import LoadProfile
+
+
+class TargetsTest(unittest.TestCase):
+
+    def rates(self, phase, times):
+        profile = LoadProfile([phase])
+        return [round(profile.targets(t)[0], 2) for t in times]
+
+    def test_steady(self):
+        profile = LoadProfile([{'duration': 10, 'rate': 5,
+                                'concurrency': 2}])
+        self.assertEqual(profile.targets(3), (5.0, 2.0))
+        # past the end, the last phase is held
+        self.assertEqual(profile.targets(30), (5.0, 2.0))
+
+    def test_smooth_ramp(self):
+        self.assertEqual(self.rates({'duration': 10, 'rate': [0, 100]},
+                                    [0, 2.5, 5, 10]),
+                         [0, 25, 50, 100])
+
+    def test_stepped_ramp_starts_on_start_value(self):
+        phase = {'duration': 40, 'rate': [10, 50], 'steps': 4}
+        self.assertEqual(self.rates(phase, [0, 9.9, 10, 20, 30, 39.9, 50]),
+                         [10, 10, 23.33, 36.67, 50, 50, 50])
+
+    def test_two_steps(self):
+        phase = {'duration': 10, 'rate': [10, 50], 'steps': 2}
+        self.assertEqual(self.rates(phase, [0, 4.9, 5, 9.9]),
+                         [10, 10, 50, 50])
+
+    def test_one_step_holds_start(self):
+        phase = {'duration': 10, 'rate': [10, 50], 'steps': 1}
+        self.assertEqual(self.rates(phase, [0, 9.9]), [10, 10])
+
+    def test_unlimited(self):
+        profile = LoadProfile([{'duration': 10}])
+        self.assertEqual(profile.targets(1), (None, None))
+        self.assertIsNone(profile.max_concurrency)
+
+    def test_phases_in_turn(self):
+        profile = LoadProfile([{'duration': 5, 'rate': 1, 'concurrency': 4},
+                               {'duration': 5, 'rate': 2,
+                                'concurrency': [4, 8]}])
+        self.assertEqual(profile.phase_at(4.9), 0)
+        self.assertEqual(profile.phase_at(5), 1)
+        self.assertEqual(profile.phase_at(10), 2)
+        self.assertEqual(profile.targets(7.5), (2.0, 6.0))
+        self.assertEqual(profile.max_concurrency, 8)
+        self.assertEqual(profile.duration, 10)
+
+    def test_time_bounded(self):
+        self.assertFalse(LoadProfile().time_bounded)
+        self.assertTrue(LoadProfile(duration=5).time_bounded)
+        self.assertEqual(LoadProfile([{'duration': 3}], duration=8).duration,
+                         8)
+
+
+if __name__ == '__main__':
+    unittest.main()
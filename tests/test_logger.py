@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Tests for logger.py's levels and ring buffer."""
+
+import io
+import sys
+import unittest
+
+import logger
+
+
+def settings(**overrides):
+    """Logging settings as configure() takes them."""
+    base = {'debug': False, 'log_levels': {}, 'log_ring_size': 1000,
+            'log_ring_level': 'debug'}
+    base.update(overrides)
+    return base
+
+
+class LoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout, self.stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+        logger._RING.clear()
+
+    def tearDown(self):
+        sys.stdout, sys.stderr = self.stdout, self.stderr
+        logger.configure(settings())
+        logger._RING.clear()
+
+    def ring(self):
+        out = io.StringIO()
+        logger.dump_ring(out)
+        return out.getvalue()
+
+    def test_info_by_default(self):
+        logger.configure(settings())
+        log = logger.get_logger('test-default')
+        log.debug("hidden")
+        log.info("shown", n=1)
+        log.warning("careful")
+        self.assertNotIn("hidden", sys.stdout.getvalue())
+        self.assertIn("INFO test-default: shown n=1", sys.stdout.getvalue())
+        self.assertIn("WARNING test-default: careful",
+                      sys.stderr.getvalue())
+
+    def test_debug_mode(self):
+        logger.configure(settings(debug=True))
+        log = logger.get_logger('test-debug')
+        log.debug("step", index=3)
+        self.assertIn("DEBUG test-debug: step index=3", sys.stdout.getvalue())
+
+    def test_subsystem_override(self):
+        logger.configure(settings(log_levels={'test-loud': 'debug',
+                                              'test-quiet': 'error'}))
+        loud = logger.get_logger('test-loud')
+        quiet = logger.get_logger('test-quiet')
+        other = logger.get_logger('test-other')
+        loud.debug("loud debug")
+        quiet.warning("quiet warning")
+        other.debug("other debug")
+        self.assertIn("loud debug", sys.stdout.getvalue())
+        self.assertNotIn("quiet warning", sys.stderr.getvalue())
+        self.assertNotIn("other debug", sys.stdout.getvalue())
+
+    def test_configure_updates_existing_loggers(self):
+        log = logger.get_logger('test-existing')
+        logger.configure(settings(log_levels={'test-existing': 'warning'}))
+        self.assertEqual(log.level, logger.WARNING)
+        logger.configure(settings())
+        self.assertEqual(log.level, logger.INFO)
+
+    def test_ring_keeps_unprinted_debug(self):
+        logger.configure(settings())
+        log = logger.get_logger('test-ring')
+        self.assertTrue(log.isdebug)
+        log.debug("before the error", index=7)
+        self.assertEqual(sys.stdout.getvalue(), "")
+        self.assertIn("DEBUG test-ring: before the error index=7",
+                      self.ring())
+
+    def test_ring_is_not_formatted_until_dumped(self):
+        logger.configure(settings())
+
+        class Lazy(object):
+            formatted = 0
+
+            def __repr__(self):
+                Lazy.formatted += 1
+                return "lazy"
+
+        logger.get_logger('test-lazy').debug("event", value=Lazy())
+        self.assertEqual(Lazy.formatted, 0)
+        self.assertIn("value=lazy", self.ring())
+        self.assertEqual(Lazy.formatted, 1)
+
+    def test_ring_level(self):
+        logger.configure(settings(log_ring_level='warning'))
+        log = logger.get_logger('test-ring-level')
+        self.assertFalse(log.isdebug)
+        log.debug("not kept")
+        log.info("printed, not kept")
+        log.warning("kept")
+        ring = self.ring()
+        self.assertNotIn("not kept", ring)
+        self.assertIn("kept", ring)
+        self.assertIn("printed, not kept", sys.stdout.getvalue())
+
+    def test_ring_size(self):
+        logger.configure(settings(log_ring_size=3))
+        log = logger.get_logger('test-ring-size')
+        for i in range(5):
+            log.debug("event", i=i)
+        ring = self.ring()
+        self.assertIn("last 3 log events", ring)
+        self.assertNotIn("i=1", ring)
+        self.assertIn("i=4", ring)
+
+    def test_off(self):
+        logger.configure(settings(log_levels={'test-off': 'off'},
+                                  log_ring_level='off'))
+        log = logger.get_logger('test-off')
+        log.error("gone")
+        self.assertEqual(sys.stderr.getvalue(), "")
+        self.assertNotIn("gone", self.ring())
+
+
+if __name__ == '__main__':
+    unittest.main()
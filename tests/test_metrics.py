@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""Tests for metrics.py's snapshots, on a fake clock."""
+
+import unittest
+from unittest import mock
+
+import metrics
+from metrics import SendMetrics
+
+
+class FakeClock(object):
+    """Stands in for the time module in metrics.py."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeProfile(object):
+    """Just what SendMetrics looks at of a LoadProfile."""
+
+    def __init__(self, start_time, warmup=0.0, duration=0.0):
+        self.start_time = start_time
+        self.warmup = warmup
+        self.end_time = start_time + duration
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock(1000.0)
+        patcher = mock.patch.object(metrics, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def metrics(self, amount=100, n_workers=2, **profile):
+        return SendMetrics(n_workers, amount, FakeProfile(1000.0, **profile))
+
+    def send(self, run, worker, count, delta=0.1):
+        for _ in range(count):
+            run.workers[worker].record_send(delta)
+
+    def poll(self, run, at):
+        self.clock.now = at
+        return run.snapshot()
+
+    def test_rate_and_estimates(self):
+        run = self.metrics()
+        first = self.poll(run, 1000.0)
+        self.assertEqual(first.sending_rate, 0.0)
+        self.assertEqual(first.remaining, 100)
+
+        self.send(run, 0, 6)
+        self.send(run, 1, 4)
+        snap = self.poll(run, 1005.0)
+        self.assertEqual(snap.sent, 10)
+        self.assertEqual(snap.worker_sent, (6, 4))
+        self.assertAlmostEqual(snap.sending_rate, 2.0)
+        self.assertEqual(snap.remaining, 90)
+        self.assertAlmostEqual(snap.etr, 45.0)
+        self.assertAlmostEqual(snap.etc, 1050.0)
+        self.assertAlmostEqual(snap.sending_time, 0.1)
+        self.assertFalse(snap.done)
+
+    def test_nothing_sent_estimates_nothing(self):
+        run = self.metrics()
+        self.poll(run, 1000.0)
+        snap = self.poll(run, 1010.0)
+        self.assertEqual(snap.sending_rate, 0.0)
+        self.assertEqual(snap.etr, 0)
+        self.assertEqual(snap.etc, 1010.0)
+
+    def test_warmup(self):
+        run = self.metrics(warmup=10.0)
+        self.send(run, 0, 5)
+        snap = self.poll(run, 1005.0)
+        self.assertEqual(snap.sending_rate, 0.0)
+        self.assertIsNone(run._warm_sent)
+
+        # the first poll past the warm-up takes the count to start from
+        self.send(run, 0, 15)
+        snap = self.poll(run, 1012.0)
+        self.assertEqual(run._warm_sent, 20)
+        self.assertEqual(snap.sending_rate, 0.0)
+        self.assertEqual(snap.sent, 20)
+
+        # and later ones only count what was sent since
+        self.send(run, 1, 10)
+        snap = self.poll(run, 1014.0)
+        self.assertEqual(run._warm_sent, 20)
+        self.assertAlmostEqual(snap.sending_rate, 10 / 4.0)
+        self.assertEqual(snap.remaining, 70)
+        self.assertAlmostEqual(snap.etr, 28.0)
+
+    def test_warmup_not_polled_until_later(self):
+        run = self.metrics(warmup=10.0)
+        self.send(run, 0, 40)
+        # nothing polled it during the warm-up; it starts from here
+        self.poll(run, 1030.0)
+        self.assertEqual(run._warm_sent, 40)
+        self.send(run, 0, 10)
+        snap = self.poll(run, 1040.0)
+        self.assertAlmostEqual(snap.sending_rate, 10 / 30.0)
+
+    def test_unlimited(self):
+        run = self.metrics(amount=None, duration=60.0)
+        self.poll(run, 1000.0)
+        self.send(run, 0, 20)
+        snap = self.poll(run, 1010.0)
+        self.assertAlmostEqual(snap.sending_rate, 2.0)
+        self.assertAlmostEqual(snap.etc, 1060.0)
+        self.assertAlmostEqual(snap.etr, 50.0)
+        self.assertEqual(snap.remaining, 100)
+
+        # past the end, nothing's left
+        snap = self.poll(run, 1070.0)
+        self.assertEqual(snap.etr, 0)
+        self.assertEqual(snap.remaining, 0)
+
+    def test_untimed_sends(self):
+        run = self.metrics()
+        run.workers[0].record_send(0.5, counted=False)
+        run.workers[1].record_send(0.2)
+        run.workers[1].record_send(0.4)
+        snap = self.poll(run, 1001.0)
+        self.assertEqual(snap.sent, 3)
+        # only worker 1's were timed
+        self.assertAlmostEqual(snap.sending_time, 0.3)
+
+    def test_bytes(self):
+        run = self.metrics(warmup=10.0)
+        run.workers[0].record_bytes(5000, 1000)
+        self.poll(run, 1010.0)
+        run.workers[0].record_bytes(3000, 600)
+        run.workers[1].record_bytes(2000)
+        snap = self.poll(run, 1015.0)
+        self.assertEqual(snap.bytes_sent, 10000)
+        self.assertEqual(snap.bytes_saved, 1600)
+        # only what was sent after the warm-up counts toward the rate
+        self.assertAlmostEqual(snap.byte_rate, 1000.0)
+
+    def test_finish_stops_the_clock(self):
+        run = self.metrics()
+        self.poll(run, 1000.0)
+        self.send(run, 0, 10)
+        self.clock.now = 1010.0
+        run.finish()
+        snap = self.poll(run, 2000.0)
+        self.assertTrue(snap.done)
+        self.assertEqual(snap.time, 1010.0)
+        self.assertAlmostEqual(snap.sending_rate, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Tests for pipeline.py."""
+
+import itertools
+import time
+import unittest
+
+from metrics import WorkerMetrics
+from pipeline import MessagePipeline
+
+from smtpserver import call_with_timeout
+
+
+def failing(after, error):
+    """A source that yields after items, then raises error."""
+    for i in range(after):
+        yield i
+    raise error
+
+
+def never_stop():
+    return False
+
+
+class MessagePipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = WorkerMetrics()
+        self.pipeline = None
+
+    def tearDown(self):
+        if self.pipeline is not None:
+            self.pipeline.close()
+
+    def get(self):
+        return call_with_timeout(
+            lambda: self.pipeline.get(self.stats, never_stop))
+
+    def test_in_order_from_one_producer(self):
+        self.pipeline = MessagePipeline([iter(range(5))], 2)
+        self.assertEqual([self.get() for _ in range(5)], list(range(5)))
+        self.assertEqual(self.stats.gen_taken, 5)
+
+    def test_sources_running_out(self):
+        self.pipeline = MessagePipeline([iter(range(3)), iter(range(3))], 8)
+        items = [self.get() for _ in range(6)]
+        self.assertEqual(sorted(items), [0, 0, 1, 1, 2, 2])
+        # then nothing more is coming, rather than a wait forever
+        self.assertIsNone(self.get())
+        self.assertIsNone(self.get())
+
+    def test_every_producer_failing(self):
+        self.pipeline = MessagePipeline(
+            [failing(0, IOError("gone")), failing(0, IOError("gone"))], 4)
+        # every worker that asks is told, not just the first
+        for _ in range(5):
+            with self.assertRaises(IOError):
+                self.get()
+
+    def test_one_producer_failing(self):
+        self.pipeline = MessagePipeline(
+            [failing(2, IOError("gone")), itertools.count(100)], 4)
+        errors = 0
+        items = []
+        for _ in range(20):
+            try:
+                items.append(self.get())
+            except IOError:
+                errors += 1
+        # the other producer carries on
+        self.assertEqual(errors, 1)
+        self.assertTrue(any(item >= 100 for item in items))
+
+    def test_error_after_items(self):
+        self.pipeline = MessagePipeline([failing(3, ValueError("bad"))], 8)
+        self.assertEqual([self.get() for _ in range(3)], [0, 1, 2])
+        with self.assertRaises(ValueError):
+            self.get()
+        with self.assertRaises(ValueError):
+            self.get()
+
+    def test_should_stop(self):
+        self.pipeline = MessagePipeline([iter([])], 1)
+        self.pipeline.close()
+        # closed by hand above, so tearDown mustn't close it again
+        pipeline, self.pipeline = self.pipeline, None
+        self.assertIsNone(call_with_timeout(
+            lambda: pipeline.get(self.stats, lambda: True)))
+
+    def test_producers_wait_for_room(self):
+        self.pipeline = MessagePipeline([itertools.count()], 1)
+        time.sleep(0.2)
+        # the wait is counted once the producer gets item 1 on, which is
+        # certainly done by the time item 2 is
+        self.assertEqual([self.get() for _ in range(3)], [0, 1, 2])
+        self.assertGreater(self.pipeline.producers[0].blocked, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
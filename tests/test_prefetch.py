@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Tests for prefetch.py, and prefetching in the sender."""
+
+import smtplib
+import threading
+import unittest
+
+from prefetch import ConnectionPrefetcher
+from sweep import HeadlessCoordinator, base_config
+
+from smtpserver import SMTPServer, call_with_timeout, run_headless
+
+
+class FakeServer(object):
+    """Stands in for an smtplib.SMTP, counting how often it's quit."""
+
+    def __init__(self, number):
+        self.number = number
+        self.quits = 0
+
+    def quit(self):
+        self.quits += 1
+
+
+class ConnectionPrefetcherTest(unittest.TestCase):
+
+    def connector(self, fail_on=()):
+        """A connect function that returns FakeServers numbered from 1, and
+        raises SMTPServerDisconnected instead on the given calls."""
+        calls = []
+        lock = threading.Lock()
+
+        def connect():
+            with lock:
+                calls.append(None)
+                number = len(calls)
+            if number in fail_on:
+                raise smtplib.SMTPServerDisconnected("dropped in EHLO")
+            return FakeServer(number)
+        return connect
+
+    def test_connections_in_order(self):
+        prefetcher = ConnectionPrefetcher(self.connector(), 1)
+        try:
+            numbers = [call_with_timeout(prefetcher.get).number
+                       for _ in range(3)]
+        finally:
+            prefetcher.close()
+        self.assertEqual(numbers, [1, 2, 3])
+
+    def test_failed_handshake_raises_once_and_carries_on(self):
+        prefetcher = ConnectionPrefetcher(self.connector(fail_on=(2,)), 1)
+        try:
+            self.assertEqual(call_with_timeout(prefetcher.get).number, 1)
+            with self.assertRaises(smtplib.SMTPServerDisconnected):
+                call_with_timeout(prefetcher.get)
+            # trying again gets the next connection, not a hang
+            self.assertEqual(call_with_timeout(prefetcher.get).number, 3)
+        finally:
+            prefetcher.close()
+
+    def test_every_handshake_failing(self):
+        prefetcher = ConnectionPrefetcher(
+            self.connector(fail_on=range(1, 100)), 2)
+        try:
+            for _ in range(5):
+                with self.assertRaises(smtplib.SMTPServerDisconnected):
+                    call_with_timeout(prefetcher.get)
+        finally:
+            prefetcher.close()
+
+    def test_retired_and_leftover_connections_quit_once(self):
+        prefetcher = ConnectionPrefetcher(self.connector(), 2)
+        server = call_with_timeout(prefetcher.get)
+        prefetcher.retire(server)
+        prefetcher.close()
+        self.assertEqual(server.quits, 1)
+
+
+class PrefetchingSenderTest(unittest.TestCase):
+    """Sending per connection with prefetching, through a real server."""
+
+    def setUp(self):
+        self.server = None
+
+    def tearDown(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+    def send(self, amount, **settings):
+        """Send amount emails with the given settings, and return the
+        HeadlessCoordinator after the run."""
+        coordinator, results = run_headless(self.server, amount, **settings)
+        self.assertEqual(results['error'], '')
+        return coordinator
+
+    def test_handshake_dropped_in_con_per(self):
+        self.server = SMTPServer(drop_at_ehlo=(3,))
+        coordinator = self.send(10, con_mode='con_per', con_prefetch=1,
+                                retry_dropped=3)
+        stats = coordinator.sender.metrics.workers[0]
+        self.assertEqual(self.server.messages, 10)
+        self.assertEqual(stats.sent, 10)
+        self.assertEqual(stats.conn_errors, 1)
+        # the connection retired before the drop is only counted as closed
+        # once, and every session but the dropped one was quit
+        self.assertEqual(stats.connections, 0)
+        self.assertEqual(self.server.quits, self.server.sessions - 1)
+
+    def test_handshake_dropped_in_con_some(self):
+        self.server = SMTPServer(drop_at_ehlo=(2,))
+        coordinator = self.send(10, con_mode='con_some', con_num=3,
+                                con_prefetch=2, retry_dropped=3)
+        stats = coordinator.sender.metrics.workers[0]
+        self.assertEqual(self.server.messages, 10)
+        self.assertEqual(stats.connections, 0)
+        self.assertEqual(self.server.quits, self.server.sessions - 1)
+
+
+class ConnectionCeilingTest(unittest.TestCase):
+
+    def handler(self, **settings):
+        from sender import EmailSendHandler
+        base = {'debug': False, 'mt_mode': 'unlimited', 'amount': 1000,
+                'max_connections': 60, 'con_mode': 'con_per',
+                'con_prefetch': 0}
+        base.update(settings)
+        coordinator = HeadlessCoordinator(*base_config({'settings': base}))
+        handler = EmailSendHandler(coordinator)
+        handler.create_worker_configurations()
+        return handler
+
+    def test_pool_fills_ceiling_without_prefetch(self):
+        self.assertEqual(len(self.handler().worker_amounts), 60)
+
+    def test_prefetched_connections_count_against_ceiling(self):
+        handler = self.handler(con_prefetch=2)
+        self.assertEqual(len(handler.worker_amounts), 20)
+
+    def test_prefetch_ignored_when_connecting_once(self):
+        handler = self.handler(con_prefetch=2, con_mode='con_once')
+        self.assertEqual(len(handler.worker_amounts), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
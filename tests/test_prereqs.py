@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Tests for prereqs.py's config loaders and FakeSTDOUT."""
+
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import prereqs
+
+from conftest import SRC
+from smtpserver import call_with_timeout
+
+
+class LoaderTest(unittest.TestCase):
+
+    def test_importing_reads_no_files(self):
+        # run from an empty folder, where reading settings.json would fail
+        code = ("import sys; sys.path.insert(0, {!r}); "
+                "import coordinator, sweep, history, capacity, "
+                "gui_callbacks, helpers; print('imported')").format(SRC)
+        folder = tempfile.mkdtemp()
+        try:
+            proc = subprocess.run([sys.executable, '-c', code], cwd=folder,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+        finally:
+            os.rmdir(folder)
+        self.assertEqual(proc.stdout.strip(), 'imported', proc.stderr)
+
+    def test_config_is_loaded_once(self):
+        config = prereqs.load_config()
+        self.assertIs(prereqs.load_config(), config)
+        self.assertIsInstance(config['contents']['text'], str)
+
+    def test_catch_exc_follows_debug(self):
+        settings = prereqs.load_config()['settings']
+        debug = settings['debug']
+        try:
+            settings['debug'] = True
+            self.assertIs(prereqs.catch_exc(),
+                          prereqs.NeverGonnaHappenException)
+            settings['debug'] = False
+            self.assertIs(prereqs.catch_exc(), Exception)
+        finally:
+            settings['debug'] = debug
+
+
+class RecordingSTDOUT(prereqs.FakeSTDOUT):
+    """Keeps the size of every batch written, and can hold the writer
+    thread back until let go."""
+
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        prereqs.FakeSTDOUT.__init__(self, *args, **kwargs)
+
+    def _write_batch(self, data):
+        self.gate.wait()
+        self.batches.append(data.count('\n'))
+        prereqs.FakeSTDOUT._write_batch(self, data)
+
+
+class FakeSTDOUTTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'stdout.log')
+        self.terminal = io.StringIO()
+        self.logs = []
+
+    def tearDown(self):
+        for log in self.logs:
+            if log._writer.is_alive():
+                log.FSO_close()
+        shutil.rmtree(self.folder)
+
+    def open_log(self, cls=prereqs.FakeSTDOUT, **kwargs):
+        log = cls(self.terminal, self.filename, **kwargs)
+        self.logs.append(log)
+        return log
+
+    def read(self, suffix=''):
+        with open(self.filename + suffix) as log_file:
+            return log_file.read()
+
+    def test_tees_to_terminal_and_log(self):
+        log = self.open_log()
+        log.write("to both\n")
+        log.write("log only\n", True)
+        call_with_timeout(log.dump_logs)
+        self.assertEqual(self.terminal.getvalue(), "to both\n")
+        self.assertTrue(self.read().endswith("to both\nlog only\n"))
+
+    def test_writes_are_batched(self):
+        log = self.open_log(RecordingSTDOUT)
+        log.write("ready\n", True)
+        call_with_timeout(log.dump_logs)
+        log.gate.clear()
+        # held up on this one while the rest pile up
+        log.write("first\n", True)
+        time.sleep(0.1)
+        for i in range(2500):
+            log.write("{}\n".format(i), True)
+        log.gate.set()
+        call_with_timeout(log.dump_logs)
+        later = log.batches[-4:]
+        self.assertEqual(later, [1, log._BATCH, log._BATCH,
+                                 2500 - 2 * log._BATCH])
+        lines = self.read().splitlines()
+        self.assertEqual(lines[-2501:],
+                         ["first"] + [str(i) for i in range(2500)])
+
+    def test_rotates_on_size(self):
+        log = self.open_log(max_bytes=100, backups=2)
+        for i in range(5):
+            # one write per batch, each of which takes the log past
+            # max_bytes
+            log.write("{}".format(i) * 120 + "\n", True)
+            call_with_timeout(log.dump_logs)
+        self.assertEqual(self.read(), "4" * 120 + "\n")
+        self.assertEqual(self.read('.1'), "3" * 120 + "\n")
+        self.assertEqual(self.read('.2'), "2" * 120 + "\n")
+        self.assertFalse(os.path.exists(self.filename + '.3'))
+
+    def test_rotates_on_time(self):
+        log = self.open_log(rotate_interval=0.2, backups=1)
+        log.write("before\n", True)
+        call_with_timeout(log.dump_logs)
+        time.sleep(0.3)
+        log.write("after\n", True)
+        call_with_timeout(log.dump_logs)
+        self.assertEqual(self.read(), "after\n")
+        self.assertTrue(self.read('.1').endswith("before\n"))
+
+    def test_dump_logs_waits_for_disk(self):
+        log = self.open_log(RecordingSTDOUT)
+        log.gate.clear()
+        log.write("slow\n", True)
+        threading.Timer(0.2, log.gate.set).start()
+        call_with_timeout(log.dump_logs)
+        self.assertTrue(self.read().endswith("slow\n"))
+
+    def test_keeps_writing_after_failed_rotation(self):
+        # the log can't be moved onto a folder
+        os.mkdir(self.filename + '.1')
+        log = self.open_log(max_bytes=10, backups=1)
+        log.write("x" * 20 + "\n", True)
+        call_with_timeout(log.dump_logs)
+        log.write("rotation fails\n", True)
+        call_with_timeout(log.dump_logs)
+        log.write("still logging\n", True)
+        call_with_timeout(log.dump_logs)
+        self.assertTrue(log._writer.is_alive())
+        self.assertIn("Couldn't write", self.terminal.getvalue())
+        self.assertTrue(self.read().endswith("still logging\n"))
+
+    def test_keeps_writing_after_failed_write(self):
+        log = self.open_log(queue_size=2)
+        call_with_timeout(log.dump_logs)
+        log.log.close()
+        log.log = open(os.devnull, 'r')
+        # more than fit on the queue; these mustn't block
+        call_with_timeout(lambda: [log.write("lost\n", True)
+                                   for _ in range(10)])
+        call_with_timeout(log.dump_logs)
+        self.assertTrue(log._writer.is_alive())
+        self.assertEqual(self.terminal.getvalue().count("Couldn't write"), 1)
+
+    def test_writes_dont_block_once_writer_is_gone(self):
+        log = self.open_log(queue_size=2)
+        call_with_timeout(log.FSO_close)
+        call_with_timeout(lambda: [log.write("after close\n")
+                                   for _ in range(10)])
+        call_with_timeout(log.dump_logs)
+        self.assertIn("after close", self.terminal.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Tests for profiler.py's SamplingProfiler."""
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+
+from profiler import SamplingProfiler
+
+# "frame (file.py:12);frame (file.py:34) 5"
+LINE = re.compile(r'^[^;]+(;[^;]+ \([^;:]+:\d+\))+ \d+$')
+
+
+def busy_loop(stop):
+    """Keep a thread busy in a frame the samples can find."""
+    while not stop.is_set():
+        sum(range(100))
+
+
+class SamplingProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.output = os.path.join(self.folder, 'run_profile')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def profile(self, names, **kwargs):
+        """Profile threads with the given names, each running busy_loop,
+        for a moment.  Returns the lines written, and the number of
+        samples."""
+        stop = threading.Event()
+        threads = [threading.Thread(target=busy_loop, args=(stop,),
+                                    name=name) for name in names]
+        for thread in threads:
+            thread.start()
+        profiler = SamplingProfiler(self.output, hz=200, alloc_top=0,
+                                    **kwargs)
+        profiler.start()
+        try:
+            # until the profiler has sampled a few times
+            while profiler.samples < 20:
+                stop.wait(0.01)
+        finally:
+            profiler.stop()
+            stop.set()
+            for thread in threads:
+                thread.join()
+        with open(self.output + '.collapsed') as collapsed:
+            return collapsed.read().splitlines(), profiler.samples
+
+    def test_collapsed_format(self):
+        lines, _ = self.profile(["Thread #0"])
+        self.assertTrue(lines)
+        for line in lines:
+            self.assertRegex(line, LINE)
+        busy = [line for line in lines if 'busy_loop (test_profiler.py:' in
+                line]
+        self.assertTrue(busy)
+        stack, count = busy[0].rsplit(' ', 1)
+        self.assertTrue(stack.startswith('Thread;'))
+        self.assertGreater(int(count), 0)
+
+    def test_numbered_threads_share_a_root(self):
+        lines, _ = self.profile(["Thread #0", "Thread #17",
+                                 "Thread #17-prefetch-0", "Generator-3"])
+        roots = set(line.split(';', 1)[0] for line in lines
+                    if 'busy_loop' in line)
+        self.assertEqual(roots, {'Thread', 'Thread-prefetch', 'Generator'})
+
+    def test_takes_turns_over_many_threads(self):
+        names = ["Thread #{}".format(i) for i in range(8)]
+        lines, samples = self.profile(names, max_threads=3)
+        stacks = sum(int(line.rsplit(' ', 1)[1]) for line in lines)
+        # only max_threads stacks per sample
+        self.assertEqual(stacks, 3 * samples)
+        self.assertEqual(set(line.split(';', 1)[0] for line in lines
+                             if 'busy_loop' in line), {'Thread'})
+
+
+if __name__ == '__main__':
+    unittest.main()
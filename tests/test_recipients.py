@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Tests for recipients.py."""
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from recipients import RecipientSource, merge_rcpt_results, \
+    write_rcpt_report
+
+
+class FakeCoordinator(object):
+    """Just the settings and contents a RecipientSource reads."""
+
+    def __init__(self, rcpt_source='', rcpt_per_txn=1, to=''):
+        self.settings = {'rcpt_source': rcpt_source,
+                         'rcpt_per_txn': rcpt_per_txn}
+        self.contents = {'to': to}
+
+
+class RecipientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def rcpt_file(self, lines):
+        path = os.path.join(self.folder, 'rcpts.txt')
+        with open(path, 'w') as rcpts:
+            rcpts.write('\n'.join(lines) + '\n')
+        return path
+
+    def test_to_field(self):
+        source = RecipientSource(FakeCoordinator(to='a@x.test, b@x.test,'))
+        self.assertEqual(next(source), ['a@x.test', 'b@x.test'])
+        self.assertEqual(next(source), ['a@x.test', 'b@x.test'])
+
+    def test_sharded_batches_wrap_around(self):
+        path = self.rcpt_file(['# comment', 'a@x.test', '', 'b@x.test',
+                               'c@x.test', 'd@x.test', 'e@x.test'])
+        coordinator = FakeCoordinator(rcpt_source=path, rcpt_per_txn=2)
+        first = RecipientSource(coordinator, 0, 2)
+        second = RecipientSource(coordinator, 1, 2)
+        self.assertEqual([next(first) for _ in range(3)],
+                         [['a@x.test', 'c@x.test'], ['e@x.test', 'a@x.test'],
+                          ['c@x.test', 'e@x.test']])
+        self.assertEqual(next(second), ['b@x.test', 'd@x.test'])
+
+    def test_more_workers_than_recipients(self):
+        path = self.rcpt_file(['a@x.test'])
+        source = RecipientSource(FakeCoordinator(rcpt_source=path), 1, 2)
+        self.assertEqual(next(source), ['a@x.test'])
+
+    def test_empty_file(self):
+        path = self.rcpt_file(['# nobody'])
+        with self.assertRaises(ValueError):
+            next(RecipientSource(FakeCoordinator(rcpt_source=path)))
+
+    def test_merge(self):
+        into = {'a@x.test': [1, 0, 250, '']}
+        merge_rcpt_results(into, {'a@x.test': [0, 1, 550, 'no'],
+                                  'b@x.test': [2, 0, 250, '']})
+        self.assertEqual(into, {'a@x.test': [1, 1, 550, 'no'],
+                                'b@x.test': [2, 0, 250, '']})
+
+    def test_report_quotes_awkward_fields(self):
+        path = os.path.join(self.folder, 'report.csv')
+        results = {'"odd, name"@x.test': [0, 2, 550, 'no, "really" no'],
+                   'a@x.test': [3, 0, 250, '']}
+        write_rcpt_report(path, results)
+        with open(path, 'r') as report:
+            rows = list(csv.reader(report))
+        self.assertEqual(rows[0], ['address', 'accepted', 'refused',
+                                   'last_code', 'last_message'])
+        self.assertEqual(sorted(rows[1:]), sorted(
+            [[address] + [str(field) for field in result]
+             for address, result in results.items()]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""Tests for sender.py, mostly sending to a local test server."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sender import EmailSendHandler
+from smtpserver import SMTPServer, run_headless
+
+
+class TimingTest(unittest.TestCase):
+    """Sends are timed whenever anything reads the latencies."""
+
+    def setUp(self):
+        self.server = SMTPServer()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder)
+
+    def timed(self, **settings):
+        """How many sends of a run were timed."""
+        settings.setdefault('metrics', False)
+        coordinator, results = run_headless(self.server, 5, **settings)
+        self.assertEqual(results['sent'], 5)
+        return sum(worker.timed
+                   for worker in coordinator.sender.metrics.workers)
+
+    def test_untimed_when_nothing_reads_latency(self):
+        self.assertEqual(self.timed(), 0)
+
+    def test_timed_for_gui_metrics(self):
+        self.assertEqual(self.timed(metrics=True), 5)
+
+    def test_timed_for_exporter(self):
+        self.assertEqual(self.timed(metrics_port=9999), 5)
+
+    def test_timed_for_event_log(self):
+        self.assertEqual(self.timed(
+            event_log=os.path.join(self.folder, 'events.bin')), 5)
+
+    def test_history_gets_percentiles(self):
+        from history import connect, load_run, resolve_run
+        path = os.path.join(self.folder, 'history.db')
+        self.assertEqual(self.timed(history_db=path), 5)
+        db = connect(path)
+        try:
+            run = load_run(db, resolve_run(db, 'last'))
+        finally:
+            db.close()
+        self.assertIsNotNone(run['p99'])
+
+
+class FakeEmail(object):
+    """Renders a made-up message for each body type, and keeps track of
+    what it was asked for."""
+
+    BODIES = {'7bit': b'Content-Transfer-Encoding: base64\r\n\r\n' +
+                      b'AAECAwQFBgcICQoLDA0ODw==\r\n',
+              '8bit': b'Content-Transfer-Encoding: 8bit\r\n\r\n' +
+                      'ünïcödé\r\n'.encode('utf-8'),
+              # binary goes as it is, bare LFs and all
+              'binary': b'Content-Transfer-Encoding: binary\r\n\r\n' +
+                        bytes(range(16))}
+
+    def __init__(self, subject):
+        self.headers = {False: b'Subject: =?utf-8?q?Gr=C3=BC=C3=9Fe?=\r\n',
+                        True: 'Subject: {}\r\n'.format(subject)
+                        .encode('utf-8')}
+        self.calls = []
+
+    def as_wire(self, body_type='7bit', utf8=False):
+        self.calls.append((body_type, utf8))
+        return self.headers[utf8] + self.BODIES[body_type]
+
+
+class FakeCoordinator(object):
+    """Just what an EmailSendHandler's wire_body looks at."""
+
+    def __init__(self, subject='Grüße'):
+        self.email = FakeEmail(subject)
+
+
+class WireBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.coordinator = FakeCoordinator()
+        self.handler = EmailSendHandler(self.coordinator)
+
+    def test_7bit(self):
+        body, options, saved = self.handler.wire_body('7bit', False)
+        self.assertEqual(bytes(body.data), self.coordinator.email.as_wire())
+        self.assertEqual(options, b'')
+        self.assertEqual(saved, 0)
+
+    def test_saved_against_7bit(self):
+        seven = len(self.coordinator.email.as_wire())
+        for body_type, option in (('8bit', b' BODY=8BITMIME'),
+                                  ('binary', b' BODY=BINARYMIME')):
+            body, options, saved = self.handler.wire_body(body_type, False)
+            data = self.coordinator.email.as_wire(body_type)
+            self.assertEqual(bytes(body.data), data)
+            self.assertEqual(options, option)
+            self.assertEqual(saved, seven - len(data))
+            self.assertGreater(saved, 0)
+
+    def test_smtputf8_only_for_8bit_headers(self):
+        _, options, saved = self.handler.wire_body('8bit', True)
+        self.assertEqual(options, b' BODY=8BITMIME SMTPUTF8')
+        # saved is still against the plain 7-bit rendering
+        self.assertEqual(saved, len(self.coordinator.email.as_wire()) -
+                         len(self.coordinator.email.as_wire('8bit', True)))
+
+        handler = EmailSendHandler(FakeCoordinator(subject='Hello'))
+        self.assertEqual(handler.wire_body('8bit', True)[1],
+                         b' BODY=8BITMIME')
+
+    def test_built_once(self):
+        first = self.handler.wire_body('binary', False)
+        self.assertIs(self.handler.wire_body('binary', False), first)
+        self.assertEqual(self.coordinator.email.calls,
+                         [('binary', False), ('7bit', False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Tests for smtpwire.py's LeanClient, against a local test server."""
+
+from __future__ import unicode_literals
+
+import smtplib
+import unittest
+
+from smtpwire import LeanClient, WireBody
+
+from smtpserver import SMTPServer
+
+MESSAGE = b'Subject: test\r\n\r\nhello\r\n'
+EVERY_BYTE = bytes(bytearray(range(256)))
+# every byte but CR and LF, and lines that need dot-stuffing after DATA
+BINARY = b'\r\n'.join([b'Subject: test', b'',
+                       EVERY_BYTE.replace(b'\r', b'').replace(b'\n', b''),
+                       b'.', b'..two', b'.\x00', b'end']) + b'\r\n'
+HEADER_BLOCK = b'X-Test: 1\r\n'
+
+
+class LeanClientTest(unittest.TestCase):
+
+    def connect(self, *extensions, **options):
+        """Start a server with the given EHLO extensions, and return a
+        LeanClient connected to it, made with options."""
+        self.server = SMTPServer(extensions=extensions)
+        self.smtp = smtplib.SMTP(self.server.address, timeout=10)
+        self.smtp.ehlo()
+        return LeanClient(self.smtp, **options)
+
+    def bdats(self):
+        return [command for command in self.server.commands
+                if command.startswith(b'BDAT')]
+
+    def tearDown(self):
+        self.smtp.quit()
+        self.server.shutdown()
+
+    def test_sends(self):
+        client = self.connect('8BITMIME')
+        refused = client.sendmail('from@example.com', ['to@example.com'],
+                                  WireBody(MESSAGE))
+        self.assertEqual(refused, {})
+        self.assertEqual(self.server.commands,
+                         [b'MAIL FROM:<from@example.com>',
+                          b'RCPT TO:<to@example.com>'])
+        self.assertEqual(self.server.messages, 1)
+
+    def test_sends_pipelined(self):
+        client = self.connect('PIPELINING')
+        client.sendmail('from@example.com', ['a@example.com', 'b@example.com'],
+                        WireBody(MESSAGE))
+        self.assertEqual(len(self.server.commands), 3)
+        self.assertEqual(self.server.messages, 1)
+
+    def test_data_body(self):
+        client = self.connect('8BITMIME', chunk_size=64)
+        client.sendmail('from@example.com', ['to@example.com'],
+                        WireBody(BINARY), header_block=HEADER_BLOCK)
+        self.assertEqual(self.server.bodies, [HEADER_BLOCK + BINARY])
+        self.assertEqual(self.bdats(), [])
+
+    def assertSendsInChunks(self, *extensions):
+        client = self.connect('CHUNKING', *extensions, chunk_size=64)
+        body = WireBody(BINARY)
+        for _ in range(2):
+            refused = client.sendmail('from@example.com', ['to@example.com'],
+                                      body, header_block=HEADER_BLOCK)
+            self.assertEqual(refused, {})
+        self.assertEqual(self.server.bodies, [HEADER_BLOCK + BINARY] * 2)
+        chunks = -(-len(BINARY) // 64)
+        self.assertEqual(len(self.bdats()), 2 * chunks)
+        self.assertEqual(self.bdats()[0],
+                         b'BDAT %d' % (len(HEADER_BLOCK) + 64))
+        self.assertEqual(self.bdats()[chunks - 1],
+                         b'BDAT %d LAST' % (len(BINARY) % 64 or 64))
+
+    def test_chunked(self):
+        self.assertSendsInChunks()
+
+    def test_chunked_pipelined(self):
+        self.assertSendsInChunks('PIPELINING')
+
+    def test_utf8_address(self):
+        client = self.connect('8BITMIME', 'SMTPUTF8')
+        client.sendmail('from@example.com', ['jürgen@exämple.com'],
+                        WireBody(MESSAGE))
+        self.assertEqual(self.server.commands,
+                         [b'MAIL FROM:<from@example.com> SMTPUTF8',
+                          'RCPT TO:<jürgen@exämple.com>'.encode('utf-8')])
+        self.assertEqual(self.server.messages, 1)
+
+    def test_utf8_address_smtputf8_given_once(self):
+        client = self.connect('8BITMIME', 'SMTPUTF8')
+        client.sendmail('jürgen@exämple.com', ['to@example.com'],
+                        WireBody(MESSAGE), options=b' SMTPUTF8')
+        self.assertEqual(self.server.commands[0],
+                         'MAIL FROM:<jürgen@exämple.com> SMTPUTF8'
+                         .encode('utf-8'))
+
+    def test_utf8_address_unsupported(self):
+        client = self.connect('8BITMIME')
+        with self.assertRaises(smtplib.SMTPNotSupportedError):
+            client.sendmail('from@example.com', ['jürgen@exämple.com'],
+                            WireBody(MESSAGE))
+        self.assertEqual(self.server.commands, [])
+        self.assertEqual(self.server.messages, 0)
+
+
+class WireBodyTest(unittest.TestCase):
+
+    def test_line_endings_and_stuffing(self):
+        body = WireBody(b'a\n.b\r\nc')
+        self.assertEqual(bytes(body.data), b'a\r\n.b\r\nc\r\n')
+        self.assertEqual(bytes(body.stuffed), b'a\r\n..b\r\nc\r\n.\r\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Tests for sweep.py."""
+
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import xml.dom.minidom
+
+from sweep import RESULT_FIELDS, base_config, cell_overrides, expand_grid, \
+    failed_results, run_sweep, text_of_size, write_chart, write_csv
+
+from smtpserver import SMTPServer
+
+
+class GridTest(unittest.TestCase):
+
+    def test_every_combination(self):
+        cells = expand_grid({'mt_num': [1, 2], 'delay': [0, 1]},
+                            {'mt_mode': 'limited'})
+        self.assertEqual(cells, [{'mt_num': 1, 'delay': 0},
+                                 {'mt_num': 1, 'delay': 1},
+                                 {'mt_num': 2, 'delay': 0},
+                                 {'mt_num': 2, 'delay': 1}])
+
+    def test_settings_that_dont_apply_run_once(self):
+        cells = expand_grid({'con_mode': ['con_once', 'con_some'],
+                             'con_num': [10, 100]}, {})
+        self.assertEqual(cells, [{'con_mode': 'con_once'},
+                                 {'con_mode': 'con_some', 'con_num': 10},
+                                 {'con_mode': 'con_some', 'con_num': 100}])
+
+    def test_applies_by_base_settings(self):
+        self.assertEqual(expand_grid({'mt_num': [1, 2]}, {'mt_mode': 'none'}),
+                         [{}])
+
+    def test_base_config_limits_threads_when_sweeping_them(self):
+        settings, _ = base_config({'grid': {'mt_num': [1, 2]}})
+        self.assertEqual(settings['mt_mode'], 'limited')
+        settings, _ = base_config({'grid': {'mt_num': [1]},
+                                   'settings': {'mt_mode': 'unlimited'}})
+        self.assertEqual(settings['mt_mode'], 'unlimited')
+        settings, contents = base_config({'contents': {'subject': 'x'}})
+        self.assertEqual(contents['subject'], 'x')
+
+    def test_cell_overrides(self):
+        overrides, size = cell_overrides(
+            {'duration': 3, 'warmup': 1, 'label': 'try'},
+            {'mt_num': 4, 'message_size': 1000})
+        self.assertEqual(size, 1000)
+        self.assertEqual(overrides['mt_num'], 4)
+        self.assertNotIn('message_size', overrides)
+        self.assertEqual((overrides['run_duration'],
+                          overrides['warmup_exclude']), (3, 1))
+        self.assertEqual(overrides['run_label'],
+                         'try: mt_num=4 message_size=1000')
+
+    def test_text_of_size(self):
+        text = text_of_size(5000)
+        self.assertEqual(len(text.replace('\n', '')), 5000)
+        self.assertTrue(all(len(line) <= 76 for line in text.split('\n')))
+
+
+class OutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_csv_and_chart(self):
+        ok = dict(failed_results(''), sent=10, rate=5.0, p99=0.01)
+        rows = [({'con_mode': 'con_once'}, ok),
+                ({'con_mode': 'con_some', 'con_num': 10},
+                 failed_results("nothing sent"))]
+        grid = {'con_mode': [], 'con_num': []}
+        path = os.path.join(self.folder, 'out.csv')
+        write_csv(path, grid, rows)
+        with open(path, 'r') as out:
+            table = list(csv.reader(out))
+        self.assertEqual(table[0], ['con_mode', 'con_num'] +
+                         list(RESULT_FIELDS))
+        self.assertEqual(table[1][:2], ['con_once', ''])
+        self.assertEqual(table[2][-1], 'nothing sent')
+
+        path = os.path.join(self.folder, 'out.svg')
+        write_chart(path, rows)
+        svg = xml.dom.minidom.parse(path)
+        self.assertEqual(len(svg.getElementsByTagName('rect')), 2)
+
+
+class SweepRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SMTPServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def test_runs_every_cell(self):
+        spec = {'duration': 1, 'warmup': 0,
+                'settings': {'server': self.server.address, 'debug': False,
+                             'use_auth': False, 'use_starttls': False,
+                             'history_db': ''},
+                'grid': {'mt_num': [1, 2], 'message_size': [100]}}
+        rows = run_sweep(spec, report=lambda line: None)
+        self.assertEqual([cell['mt_num'] for cell, _ in rows], [1, 2])
+        for _, results in rows:
+            self.assertEqual(results['error'], '')
+            self.assertGreater(results['sent'], 0)
+            self.assertGreater(results['rate'], 0)
+        self.assertEqual(self.server.messages,
+                         sum(results['sent'] for _, results in rows))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""Tests for transcript.py."""
+
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+import unittest
+
+from transcript import RecordingProxy, Replayer, Session, Step, \
+    TranscriptWriter, parse_address, read_transcript, reply_codes, \
+    steps_from_events
+
+from smtpserver import SMTPServer
+
+
+class ParsingTest(unittest.TestCase):
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address('mail.test:587'), ('mail.test', 587))
+        self.assertEqual(parse_address('mail.test'), ('mail.test', 25))
+
+    def test_reply_codes(self):
+        self.assertEqual(reply_codes(b'250-one\r\n250-two\r\n250 three\r\n'
+                                     b'354 go\r\n'), [250, 354])
+        self.assertEqual(reply_codes(b'xyz nonsense\r\n'), [0])
+        # the rest of a reply still to come
+        self.assertEqual(reply_codes(b'250-one\r\n'), [])
+
+    def test_steps_from_events(self):
+        events = [(10.0, False, b'220 hi\r\n'),
+                  (10.5, True, b'EHLO me\r\n'),
+                  (10.6, False, b'250-hi\r\n'),
+                  (10.6, False, b'250 SIZE\r\n'),
+                  (11.6, True, b'MAIL FROM:<a@x.test>\r\n'),
+                  (11.6, True, b'RCPT TO:<b@x.test>\r\n'),
+                  (11.7, False, b'250 ok\r\n250 ok\r\n'),
+                  (12.0, True, b'QUIT\r\n')]
+        steps = steps_from_events(events)
+        self.assertEqual([step.data for step in steps],
+                         [b'', b'EHLO me\r\n',
+                          b'MAIL FROM:<a@x.test>\r\nRCPT TO:<b@x.test>\r\n',
+                          b'QUIT\r\n'])
+        self.assertEqual([list(step.codes) for step in steps],
+                         [[220], [250], [250, 250], []])
+        self.assertEqual([round(step.think, 3) for step in steps],
+                         [0.0, 0.5, 1.0, 0.3])
+
+    def test_no_events(self):
+        self.assertEqual(steps_from_events([]), [])
+
+
+class TranscriptFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'sessions.egts')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_round_trip(self):
+        writer = TranscriptWriter(self.path)
+        writer.write(105.0, [Step(0.0, b'', (220,)),
+                             Step(0.25, b'QUIT\r\n', (221,))])
+        writer.write(100.0, [Step(0.0, b'', (220,))])
+        writer.write(101.0, [Step(0.0, b'STARTTLS\r\n', (220,))])
+        writer.close()
+
+        sessions = read_transcript(self.path)
+        # in order of starting, from 0, without the STARTTLS one
+        self.assertEqual([session.start for session in sessions], [0.0, 5.0])
+        self.assertEqual(sessions[1].steps[1].data, b'QUIT\r\n')
+        self.assertEqual(tuple(sessions[1].steps[1].codes), (221,))
+        self.assertEqual(len(read_transcript(self.path,
+                                             skip_starttls=False)), 3)
+
+    def test_not_a_transcript(self):
+        with open(self.path, 'wb') as junk:
+            junk.write(b'hello')
+        with self.assertRaises(ValueError):
+            read_transcript(self.path)
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SMTPServer()
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.folder)
+
+    def record(self):
+        """Send one email through a recording proxy, and return the
+        sessions recorded."""
+        path = os.path.join(self.folder, 'sessions.egts')
+        writer = TranscriptWriter(path)
+        proxy = RecordingProxy(('127.0.0.1', 0), self.server.server_address,
+                               writer, timeout=10)
+        thread = threading.Thread(target=proxy.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            smtp = smtplib.SMTP('{}:{}'.format(*proxy.server_address),
+                                timeout=10)
+            smtp.sendmail('a@x.test', ['b@x.test'], 'Subject: hi\r\n\r\nhi')
+            smtp.quit()
+            deadline = time.time() + 10
+            while writer.n_sessions < 1 and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            proxy.shutdown()
+            proxy.server_close()
+            writer.close()
+        return read_transcript(path)
+
+    def test_replay_matches(self):
+        sessions = self.record()
+        self.assertEqual(len(sessions), 1)
+        result = Replayer(sessions, self.server.server_address, speed=0,
+                          concurrency=2, loops=3, timeout=10).run()
+        self.assertEqual((result['ok'], result['failed'], result['errors']),
+                         (3, 0, 0))
+        self.assertEqual(result['mismatches'], {})
+        # the recording, plus three replays
+        self.assertEqual(self.server.messages, 4)
+
+    def test_replay_mismatch(self):
+        steps = [Step(0.0, b'', (220,)),
+                 Step(0.0, b'EHLO me\r\n', (250,)),
+                 Step(0.0, b'MAIL FROM:<a@x.test>\r\n', (550,)),
+                 Step(0.0, b'QUIT\r\n', (221,))]
+        result = Replayer([Session(0.0, steps)], self.server.server_address,
+                          speed=0, timeout=10).run()
+        self.assertEqual((result['ok'], result['failed']), (0, 1))
+        self.assertEqual(result['mismatches'], {(550, 250): 1})
+
+
+if __name__ == '__main__':
+    unittest.main()